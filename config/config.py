@@ -1,20 +1,93 @@
 import os
 from repositories.item_repository import ItemRepositoryMongo
+from repositories.item_repository_motor import ItemRepositoryMotor
+from services.jwks_service import JwksCache
+from services.local_cache import LocalCache
 
 API_NAME = os.environ['API_NAME']
 API_TAG_NAME = os.environ['API_TAG_NAME']
 
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+# Per-module overrides, e.g. 'middlewares=DEBUG,services.jwks_service=WARNING'
+LOG_LEVELS = os.getenv('LOG_LEVELS', '')
+# 'text' or 'json' (one object per line)
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+# Share of hot path debug events kept when debug is enabled
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv('LOG_DEBUG_SAMPLE_RATE', '0.01'))
+# One summary line per request from the "access" logger
+LOG_REQUEST_SUMMARY = os.getenv('LOG_REQUEST_SUMMARY', 'true').lower() == 'true'
+
+# Share of requests traced; 0 turns tracing off. A sampled incoming traceparent is always followed.
+TRACING_SAMPLE_RATE = float(os.getenv('TRACING_SAMPLE_RATE', '0'))
+# 'memory' keeps the last TRACING_MEMORY_SIZE spans, 'file' appends them to TRACING_FILE as JSON lines
+TRACING_EXPORTER = os.getenv('TRACING_EXPORTER', 'memory')
+TRACING_FILE = os.getenv('TRACING_FILE', 'traces.jsonl')
+TRACING_MEMORY_SIZE = int(os.getenv('TRACING_MEMORY_SIZE', '1000'))
+
+# Requests carrying PROFILING_HEADER set to PROFILING_SECRET are profiled (a PROFILING_SAMPLE_RATE share of them),
+# and the last PROFILING_STORE_SIZE profiles are served under /profiles/{id}. No secret: the hook is not installed.
+PROFILING_SECRET = os.getenv('PROFILING_SECRET', '')
+PROFILING_HEADER = os.getenv('PROFILING_HEADER', 'X-Profile-Token')
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', '1'))
+PROFILING_STORE_SIZE = int(os.getenv('PROFILING_STORE_SIZE', '20'))
+
 URL_API_GATEWAY = os.environ['URL_API_GATEWAY']
+# 'repository' resolves licences with a direct database query (only possible inside api-license),
+# 'gateway' asks {URL_API_GATEWAY}/license/v1/mine
+LICENCE_LOOKUP = os.getenv('LICENCE_LOOKUP', 'repository' if API_NAME == 'api-license' else 'gateway')
+GATEWAY_HTTP_MAX_CONNECTIONS = int(os.getenv('GATEWAY_HTTP_MAX_CONNECTIONS', '50'))
+GATEWAY_HTTP_MAX_KEEPALIVE = int(os.getenv('GATEWAY_HTTP_MAX_KEEPALIVE', '20'))
+GATEWAY_HTTP_TIMEOUT = float(os.getenv('GATEWAY_HTTP_TIMEOUT', '5'))
 
 KEYCLOAK_HOST = os.environ['KEYCLOAK_HOST']
 KEYCLOAK_REALM = os.environ['KEYCLOAK_REALM']
 KEYCLOAK_CLIENT_ID = os.environ['KEYCLOAK_CLIENT_ID']
 KEYCLOAK_CLIENT_SECRET = os.environ['KEYCLOAK_CLIENT_SECRET']
+KEYCLOAK_HTTP_MAX_CONNECTIONS = int(os.getenv('KEYCLOAK_HTTP_MAX_CONNECTIONS', '50'))
+KEYCLOAK_HTTP_MAX_KEEPALIVE = int(os.getenv('KEYCLOAK_HTTP_MAX_KEEPALIVE', '20'))
+KEYCLOAK_HTTP_TIMEOUT = float(os.getenv('KEYCLOAK_HTTP_TIMEOUT', '5'))
+KEYCLOAK_JWKS_URL = f"{KEYCLOAK_HOST}/realms/{KEYCLOAK_REALM}/protocol/openid-connect/certs"
+KEYCLOAK_JWKS_TTL = int(os.getenv('KEYCLOAK_JWKS_TTL', '3600'))
+KEYCLOAK_JWKS_MIN_REFRESH_INTERVAL = int(os.getenv('KEYCLOAK_JWKS_MIN_REFRESH_INTERVAL', '30'))
+
+# 'introspection' asks Keycloak for every cache miss (strict, sees revocations),
+# 'local' verifies the JWT signature against the realm JWKS and only falls back
+# to introspection when the keys cannot be fetched.
+TOKEN_VERIFICATION_MODE = os.getenv('TOKEN_VERIFICATION_MODE', 'introspection')
+TOKEN_AUDIENCE = os.getenv('TOKEN_AUDIENCE', 'karned')
+TOKEN_LEEWAY = int(os.getenv('TOKEN_LEEWAY', '0'))
+
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv('HTTP_KEEPALIVE_EXPIRY', '30'))
 
 REDIS_HOST = os.environ['REDIS_HOST']
 REDIS_PORT = int(os.environ['REDIS_PORT'])
 REDIS_DB = int(os.environ['REDIS_DB'])
 REDIS_PASSWORD = os.environ['REDIS_PASSWORD']
+REDIS_POOL_SIZE = int(os.getenv('REDIS_POOL_SIZE', '50'))
+REDIS_POOL_TIMEOUT = float(os.getenv('REDIS_POOL_TIMEOUT', '5'))
+CACHE_CODEC = os.getenv('CACHE_CODEC', 'orjson')
+
+# In-process (L1) token cache in front of Redis, per worker
+TOKEN_L1_CACHE_SIZE = int(os.getenv('TOKEN_L1_CACHE_SIZE', '10000'))
+TOKEN_L1_CACHE_MAX_STALENESS = int(os.getenv('TOKEN_L1_CACHE_MAX_STALENESS', '30'))
+
+# Unknown X-License-Key values are remembered per user, and licence refreshes are
+# limited per token, so a misconfigured client cannot trigger a lookup on every request
+LICENCE_NEGATIVE_CACHE_SIZE = int(os.getenv('LICENCE_NEGATIVE_CACHE_SIZE', '10000'))
+LICENCE_NEGATIVE_CACHE_TTL = int(os.getenv('LICENCE_NEGATIVE_CACHE_TTL', '60'))
+LICENCE_REFRESH_MIN_INTERVAL = int(os.getenv('LICENCE_REFRESH_MIN_INTERVAL', '10'))
+LICENCE_REFRESH_CACHE_SIZE = int(os.getenv('LICENCE_REFRESH_CACHE_SIZE', '10000'))
+
+# Per-user licences are refreshed in the background up to this many seconds before
+# the next licence starts or expires; each user gets a stable point in that window
+LICENCE_REFRESH_AHEAD = int(os.getenv('LICENCE_REFRESH_AHEAD', '300'))
+
+# Change stream watcher on the licence collection. Requires a replica set; while it runs,
+# cached licences are invalidated on change and can outlive the token that loaded them.
+# Enable pre-images on the collection (MongoDB 6.0+) so deletes only touch their owner.
+LICENCE_WATCH_ENABLED = os.getenv('LICENCE_WATCH_ENABLED', 'false').lower() == 'true'
+LICENCE_WATCH_CACHE_TTL = int(os.getenv('LICENCE_WATCH_CACHE_TTL', '86400'))
+LICENCE_WATCH_RETRY_DELAY = float(os.getenv('LICENCE_WATCH_RETRY_DELAY', '5'))
 
 DB_HOST = os.getenv('DB_HOST', 'localhost')
 DB_PORT = os.getenv('DB_PORT', '27017')
@@ -22,13 +95,45 @@ DB_USER = os.getenv('DB_USER')
 DB_PASSWORD = os.getenv('DB_PASSWORD')
 DB_DATABASE = os.getenv('DB_DATABASE', 'karned')
 DB_COLLECTION = os.getenv('DB_COLLECTION', 'license')
+# 'pymongo' (blocking calls run in the threadpool) or 'motor' (native asyncio)
+DB_DRIVER = os.getenv('DB_DRIVER', 'pymongo')
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '100'))
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', '0'))
+# Create the declared indexes at startup, and optionally log list endpoints whose plan is a COLLSCAN
+DB_ENSURE_INDEXES = os.getenv('DB_ENSURE_INDEXES', 'true').lower() == 'true'
+DB_CHECK_QUERY_PLANS = os.getenv('DB_CHECK_QUERY_PLANS', 'false').lower() == 'true'
+
+# Page size of the list endpoints (?limit=...)
+ITEM_PAGE_LIMIT = int(os.getenv('ITEM_PAGE_LIMIT', '100'))
+ITEM_PAGE_MAX_LIMIT = int(os.getenv('ITEM_PAGE_MAX_LIMIT', '1000'))
+# Validate list responses against the documented Item model before sending them (slower);
+# by default repository output is trusted and written straight to JSON
+ITEM_RESPONSE_VALIDATION = os.getenv('ITEM_RESPONSE_VALIDATION', 'false').lower() == 'true'
+# Documents read and written per chunk by the NDJSON listing (Accept: application/x-ndjson)
+ITEM_STREAM_BATCH_SIZE = int(os.getenv('ITEM_STREAM_BATCH_SIZE', '500'))
 
 if DB_USER and DB_PASSWORD:
     DB_URL = f"mongodb://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/"
 else:
     DB_URL = f"mongodb://{DB_HOST}:{DB_PORT}/"
 
-ITEM_REPO = ItemRepositoryMongo(url=DB_URL, database=DB_DATABASE, collection=DB_COLLECTION)
+ITEM_REPO = (ItemRepositoryMotor if DB_DRIVER == 'motor' else ItemRepositoryMongo)(
+    url=DB_URL,
+    database=DB_DATABASE,
+    collection=DB_COLLECTION,
+    max_pool_size=DB_POOL_MAX_SIZE,
+    min_pool_size=DB_POOL_MIN_SIZE
+)
+
+JWKS_CACHE = JwksCache(
+    url=KEYCLOAK_JWKS_URL,
+    ttl=KEYCLOAK_JWKS_TTL,
+    min_refresh_interval=KEYCLOAK_JWKS_MIN_REFRESH_INTERVAL
+)
+
+TOKEN_CACHE = LocalCache(max_size=TOKEN_L1_CACHE_SIZE, max_staleness=TOKEN_L1_CACHE_MAX_STALENESS)
+MISSING_LICENCE_CACHE = LocalCache(max_size=LICENCE_NEGATIVE_CACHE_SIZE, max_staleness=LICENCE_NEGATIVE_CACHE_TTL)
+LICENCE_REFRESH_CACHE = LocalCache(max_size=LICENCE_REFRESH_CACHE_SIZE, max_staleness=LICENCE_REFRESH_MIN_INTERVAL)
 
-UNPROTECTED_PATHS = ['/favicon.ico', '/docs', '/license/openapi.json']
+UNPROTECTED_PATHS = ['/favicon.ico', '/docs', '/license/openapi.json', '/metrics']
 UNLICENSED_PATHS = ['/license/v1/mine']
@@ -3,6 +3,10 @@ from fastapi import status, Request, HTTPException
 from functools import wraps
 from typing import List
 
+from utils.log_util import sampled_debug
+
+logger = logging.getLogger(__name__)
+
 
 def check_roles( list_roles: list, permissions: List[str] ) -> None:
     if not any(perm in list_roles for perm in permissions):
@@ -18,10 +22,10 @@ def check_permissions( permissions: List[str] ):
     def decorator( func ):
         @wraps(func)
         async def wrapper( request: Request, *args, **kwargs ):
-            logging.info(f"Checking permissions {permissions}")
-            logging.info(f"License: {request}")
+            sampled_debug(logger, "Checking permissions %s", permissions)
 
-            check_roles(request.state.token_info.get('license_roles'), permissions)
+            # Roles of the request licence, set by the licence middleware
+            check_roles(getattr(request.state, 'licence_roles', []), permissions)
 
             return await func(request, *args, **kwargs)
 
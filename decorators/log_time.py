@@ -1,32 +1,28 @@
-import random
 import time
 import logging
+from functools import wraps
 
+from utils.log_util import sampled_debug
 
-def log_time_async( func ):
-    async def wrapper( *args, **kwargs ):
-        id = random.randint(1, 1000000)
-        start_time = time.time()
-        logging.info(f"{func.__name__}: Start {id}")
+logger = logging.getLogger(__name__)
 
-        result = await func(*args, **kwargs)
 
-        end_time = time.time()
-        execution_time = end_time - start_time
-        logging.info(f"{func.__name__}: End {id} | Execution time: {execution_time:.4f} seconds")
-        return result
+def log_time_async( func ):
+    @wraps(func)
+    async def wrapper( *args, **kwargs ):
+        start_time = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            sampled_debug(logger, "%s: Execution time: %.4f seconds", func.__name__, time.perf_counter() - start_time)
     return wrapper
 
 def log_time( func ):
+    @wraps(func)
     def wrapper( *args, **kwargs ):
-        id = random.randint(1, 1000000)
-        start_time = time.time()
-        logging.info(f"{func.__name__}: Start {id}", id)
-
-        result = func(*args, **kwargs)
-
-        end_time = time.time()
-        execution_time = end_time - start_time
-        logging.info(f"{func.__name__}: End {id} | Execution time: {execution_time:.4f} seconds")
-        return result
-    return wrapper
\ No newline at end of file
+        start_time = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            sampled_debug(logger, "%s: Execution time: %.4f seconds", func.__name__, time.perf_counter() - start_time)
+    return wrapper
@@ -14,7 +14,11 @@ class ItemRepository(ABC):
         pass
 
     @abstractmethod
-    def list_items(self, filters: dict):
+    def list_items(self, filters: dict, fields: list[str] | None = None, limit: int | None = None):
+        pass
+
+    @abstractmethod
+    def iter_item_batches(self, filters: dict, fields: list[str] | None = None, batch_size: int = 500):
         pass
 
     @abstractmethod
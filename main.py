@@ -1,3 +1,5 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, HTTPException
 from fastapi.security import HTTPBearer
 from fastapi.openapi.utils import get_openapi
@@ -5,16 +7,61 @@ from fastapi.openapi.utils import get_openapi
 from middlewares.licence_middleware import LicenceVerificationMiddleware
 from middlewares.token_middleware import TokenVerificationMiddleware
 from middlewares.exception_handler import http_exception_handler
-from routers import v1
+from middlewares.metrics_middleware import MetricsMiddleware
+from middlewares.profiling_middleware import ProfilingMiddleware
+from middlewares.request_log_middleware import RequestLogMiddleware
+from middlewares.tracing_middleware import TracingMiddleware
+from config.config import DB_CHECK_QUERY_PLANS, DB_ENSURE_INDEXES, ITEM_REPO, LICENCE_REFRESH_CACHE, LICENCE_WATCH_ENABLED, \
+    LOG_DEBUG_SAMPLE_RATE, LOG_FORMAT, LOG_LEVEL, LOG_LEVELS, LOG_REQUEST_SUMMARY, MISSING_LICENCE_CACHE, TOKEN_CACHE, \
+    TRACING_EXPORTER, TRACING_FILE, TRACING_MEMORY_SIZE, TRACING_SAMPLE_RATE, PROFILING_HEADER, PROFILING_SAMPLE_RATE, \
+    PROFILING_SECRET, PROFILING_STORE_SIZE
+from routers import metrics, v1
+from services.http_service import close_http_clients, open_http_clients
+from services.inmemory_service import close_redis_api_db, open_redis_api_db
+from services.items_service import check_item_query_plans, ensure_item_indexes
+from services.licence_watcher import create_licence_watcher
+from services.metrics_service import register_cache_stats, register_pool_stats
+from services.profiling_service import ProfileStore
+from services.tracing_service import configure_tracing, create_exporter
+from utils.log_util import configure_logging
 import logging
 
-logging.basicConfig(level=logging.INFO)
+configure_logging(LOG_LEVEL, LOG_LEVELS, json=LOG_FORMAT == 'json', debug_sample_rate=LOG_DEBUG_SAMPLE_RATE)
 logging.info("Starting API License")
+register_cache_stats({"token": TOKEN_CACHE, "missing_licence": MISSING_LICENCE_CACHE, "licence_refresh": LICENCE_REFRESH_CACHE})
+register_pool_stats(ITEM_REPO.pool_stats)
 
 
 bearer_scheme = HTTPBearer()
 
-app = FastAPI(openapi_url="/license/openapi.json")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    span_exporter = create_exporter(TRACING_EXPORTER, TRACING_FILE, TRACING_MEMORY_SIZE) if TRACING_SAMPLE_RATE > 0 else None
+    configure_tracing(TRACING_SAMPLE_RATE, span_exporter)
+    open_http_clients()
+    open_redis_api_db()
+    ITEM_REPO.open()
+    if DB_ENSURE_INDEXES:
+        await ensure_item_indexes(ITEM_REPO)
+    if DB_CHECK_QUERY_PLANS:
+        await check_item_query_plans(ITEM_REPO)
+    watcher = create_licence_watcher() if LICENCE_WATCH_ENABLED else None
+    if watcher is not None:
+        watcher.start()
+    yield
+    if watcher is not None:
+        await watcher.stop()
+    logging.info("Token L1 cache stats: %s", TOKEN_CACHE.stats())
+    logging.info("MongoDB pool stats: %s", ITEM_REPO.pool_stats())
+    ITEM_REPO.close()
+    await close_redis_api_db()
+    await close_http_clients()
+    configure_tracing(0, None)
+    if span_exporter is not None:
+        span_exporter.close()
+
+
+app = FastAPI(openapi_url="/license/openapi.json", lifespan=lifespan)
 def custom_openapi():
     if app.openapi_schema:
         return app.openapi_schema
@@ -50,5 +97,14 @@ app.openapi = custom_openapi
 app.add_exception_handler(HTTPException, http_exception_handler)
 app.add_middleware(LicenceVerificationMiddleware)
 app.add_middleware(TokenVerificationMiddleware)
+if TRACING_SAMPLE_RATE > 0:
+    app.add_middleware(TracingMiddleware)
+if LOG_REQUEST_SUMMARY:
+    app.add_middleware(RequestLogMiddleware)
+app.add_middleware(MetricsMiddleware)
+if PROFILING_SECRET:
+    app.add_middleware(ProfilingMiddleware, secret=PROFILING_SECRET, header=PROFILING_HEADER,
+                       sample_rate=PROFILING_SAMPLE_RATE, store=ProfileStore(PROFILING_STORE_SIZE))
 
 app.include_router(v1.router)
+app.include_router(metrics.router)
@@ -1,19 +1,29 @@
 import logging
+import zlib
 from datetime import datetime, timezone
 
 import httpx
 from fastapi import HTTPException
-from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.requests import Request
-from starlette.responses import JSONResponse, Response
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
 from decorators.log_time import log_time_async
-from middlewares.token_middleware import read_cache_token, write_cache_token
+from middlewares.token_middleware import cache_key, store_licences_in_state, write_cache_licences
+from schemas.cache_token_schema import index_licences, licences_refresh_at
 from services.inmemory_service import get_redis_api_db
+from utils.log_util import annotate_request, sampled_debug
 from utils.path_util import is_unprotected_path, is_unlicensed_path
-from config.config import URL_API_GATEWAY
+from services.http_service import get_gateway_client
+from services.items_service import get_items_async, get_licence_lookup_filters
+from services.metrics_service import LICENCE_REFRESHES, MIDDLEWARE_DURATION
+from services.tracing_service import traced
+from services.single_flight import SingleFlight
+from config.config import ITEM_PAGE_MAX_LIMIT, ITEM_REPO, LICENCE_LOOKUP, LICENCE_REFRESH_AHEAD, LICENCE_REFRESH_CACHE, \
+    MISSING_LICENCE_CACHE, URL_API_GATEWAY
 
-
-r = get_redis_api_db()
+logger = logging.getLogger(__name__)
+background_refreshes = SingleFlight()
+inline_refreshes = SingleFlight()
 
 
 def extract_licence(request: Request) -> str:
@@ -33,25 +43,60 @@ def check_headers_licence(request: Request) -> None:
 
 
 def is_licence_found(request: Request, licence: str) -> bool:
-    logging.info(f"License : is_licence_found")
+    sampled_debug(logger, "License : is_licence_found")
     licenses = getattr(request.state, 'licenses', None)
     if not licenses:
         return False
-    if not any(licence_data['uuid'] == licence for licence_data in licenses):
+    licence_data = licenses.get(licence)
+    if licence_data is None:
+        return False
+    # The cached set also holds licences starting later, so both bounds are checked
+    if not licence_data['iat'] < int(datetime.now(timezone.utc).timestamp()) < licence_data['exp']:
         return False
     return True
 
 
-def get_licences(token: str) -> list:
-    logging.info(f"License : get_licences")
-    response = httpx.get(f"{URL_API_GATEWAY}/license/v1/mine", headers={"Authorization": f"Bearer {token}"})
-    if response.status_code != 200:
-        raise HTTPException(status_code=500, detail="Licences request failed")
-    data = response.json()
-    return data.get("data", [])
+# Fields read by filter_licences: the historical and sales arrays are never needed for the licence set
+LICENCE_LOOKUP_FIELDS = ["uuid", "type_uuid", "name", "iat", "exp", "entity_uuid", "api_roles", "app_roles", "apps"]
+
+
+async def get_licences_from_repository(user_uuid: str) -> list:
+    sampled_debug(logger, "License : get_licences_from_repository")
+    return await get_items_async(get_licence_lookup_filters(user_uuid), ITEM_REPO.open(), LICENCE_LOOKUP_FIELDS)
+
 
+async def get_licences_from_gateway(token: str) -> list:
+    sampled_debug(logger, "License : get_licences_from_gateway")
+    licences = []
+    params = {"limit": ITEM_PAGE_MAX_LIMIT}
+    while True:
+        try:
+            response = await get_gateway_client().get(
+                f"{URL_API_GATEWAY}/license/v1/mine",
+                headers={"Authorization": f"Bearer {token}"},
+                params=params
+            )
+        except httpx.HTTPError:
+            raise HTTPException(status_code=500, detail="Licences request failed")
+        if response.status_code != 200:
+            raise HTTPException(status_code=500, detail="Licences request failed")
+        data = response.json()
+        licences.extend(data.get("data", []))
+        # /mine is paginated: follow the cursor until the last page
+        next_cursor = data.get("next_cursor")
+        if not next_cursor:
+            return licences
+        params = {"limit": ITEM_PAGE_MAX_LIMIT, "cursor": next_cursor}
+
+
+async def get_licences(token: str, user_uuid: str) -> list:
+    if LICENCE_LOOKUP == "repository":
+        # Same query as /license/v1/mine without looping back through the gateway
+        return await get_licences_from_repository(user_uuid)
+    return await get_licences_from_gateway(token)
 
-def filter_licences(licences: list) -> list:
+
+def filter_licences(licences: list, include_future: bool = False) -> list:
     now = int(datetime.now(timezone.utc).timestamp())
     licences_filtered = [
         {
@@ -65,66 +110,166 @@ def filter_licences(licences: list) -> list:
             "app_roles": lic.get("app_roles"),
             "apps": lic.get("apps"),
         }
-        for lic in licences if lic["iat"] < now < lic["exp"]
+        for lic in licences if (include_future or lic["iat"] < now) and now < lic["exp"]
     ]
     return licences_filtered
 
 
-def prepare_licences(token: str) -> list:
-    licenses = get_licences(token)
-    return filter_licences(licenses)
+async def prepare_licences(token: str, user_uuid: str) -> dict:
+    licenses = filter_licences(await get_licences(token, user_uuid), include_future=True)
+    now = int(datetime.now(timezone.utc).timestamp())
+    # Boundaries inside the refresh window are already covered by this set: once the
+    # background refresh runs, the next boundary is always further away
+    return {
+        "refresh_at": licences_refresh_at(licenses, now + LICENCE_REFRESH_AHEAD),
+        "licences": index_licences(licenses)
+    }
 
 
-def refresh_cache_token(request: Request) -> dict:
-    logging.info(f"License : refresh_cache_token")
-    cache_token = read_cache_token(getattr(request.state, 'token', None))
-    cache_token['licenses'] = getattr(request.state, 'licenses', None)
-    logging.info(f"cache_token: {cache_token}")
-    return cache_token
+async def load_licences(token: str, user_uuid: str, exp: int | None) -> dict:
+    try:
+        licence_set = await prepare_licences(token, user_uuid)
+    except Exception:
+        LICENCE_REFRESHES.inc("inline", "error")
+        raise
+    LICENCE_REFRESHES.inc("inline", "ok")
+    # Only the licences entry changed: the token record is left untouched
+    await write_cache_licences(get_redis_api_db(), token, user_uuid, licence_set, exp)
+    return licence_set
 
 
-def refresh_licences(request: Request) -> None:
-    logging.info(f"License : refresh_licences")
+async def refresh_licences(request: Request) -> None:
+    sampled_debug(logger, "License : refresh_licences")
     token = getattr(request.state, 'token', None)
-    licenses = prepare_licences(token)
-    setattr(request.state, 'licenses', licenses)
-    write_cache_token(token=token, cache_token=refresh_cache_token(request))
+    user_uuid = getattr(request.state, 'user_uuid', None)
+    token_info = getattr(request.state, 'token_info', None) or {}
+    # Concurrent requests of the same user wait on a single lookup
+    licence_set = await inline_refreshes.do(user_uuid, load_licences, token, user_uuid, token_info.get("exp"))
+    store_licences_in_state(licence_set, request)
+
+
+def licences_refresh_ahead(user_uuid: str) -> int:
+    # Stable per-user offset so licences sharing a boundary (e.g. midnight) are not all refreshed at once
+    spread = zlib.crc32(str(user_uuid).encode()) % 1000 / 1000
+    return int(LICENCE_REFRESH_AHEAD * (0.5 + spread / 2))
+
+
+def is_licences_refresh_due(request: Request) -> bool:
+    refresh_at = getattr(request.state, 'licences_refresh_at', None)
+    if refresh_at is None:
+        return False
+    user_uuid = getattr(request.state, 'user_uuid', None)
+    return int(datetime.now(timezone.utc).timestamp()) >= refresh_at - licences_refresh_ahead(user_uuid)
+
+
+async def refresh_licences_in_background(token: str, user_uuid: str, exp: int | None) -> None:
+    sampled_debug(logger, "License : refresh_licences_in_background")
+    try:
+        licence_set = await prepare_licences(token, user_uuid)
+        await write_cache_licences(get_redis_api_db(), token, user_uuid, licence_set, exp)
+        LICENCE_REFRESHES.inc("background", "ok")
+    except Exception as e:
+        LICENCE_REFRESHES.inc("background", "error")
+        logger.warning("License : background refresh failed for %s: %s", user_uuid, e)
+
+
+def schedule_licences_refresh(request: Request) -> None:
+    if not is_licences_refresh_due(request):
+        return
+    user_uuid = getattr(request.state, 'user_uuid', None)
+    token_info = getattr(request.state, 'token_info', None) or {}
+    # One refresh per user at a time; the request does not wait for it
+    background_refreshes.start(
+        user_uuid, refresh_licences_in_background, getattr(request.state, 'token', None), user_uuid, token_info.get("exp")
+    )
+
 
+def missing_licence_key(request: Request, licence: str) -> str:
+    return f"{getattr(request.state, 'user_uuid', None)}:{licence}"
 
-def check_licence(request: Request, licence: str) -> None:
-    if not is_licence_found(request, licence):
-        refresh_licences(request)
-        if not is_licence_found(request, licence):
+
+def is_licence_recently_missed(request: Request, licence: str) -> bool:
+    return MISSING_LICENCE_CACHE.get(missing_licence_key(request, licence)) is not None
+
+
+def remember_missing_licence(request: Request, licence: str) -> None:
+    MISSING_LICENCE_CACHE.set(missing_licence_key(request, licence), True)
+
+
+def acquire_licences_refresh(request: Request) -> bool:
+    key = cache_key(getattr(request.state, 'token', None))
+    if LICENCE_REFRESH_CACHE.get(key) is not None:
+        return False
+    # The user is kept so the licence watcher can lift the debounce when the user's licences change
+    LICENCE_REFRESH_CACHE.set(key, getattr(request.state, 'user_uuid', None))
+    return True
+
+
+async def check_licence(request: Request, licence: str) -> None:
+    if is_licence_found(request, licence):
+        return
+    if getattr(request.state, 'licenses', None) is None:
+        # No licence set loaded yet (new token, entry invalidated or expired): always load it
+        await refresh_licences(request)
+    else:
+        if is_licence_recently_missed(request, licence):
             raise HTTPException(status_code=403, detail="Licence not found")
+        user_uuid = getattr(request.state, 'user_uuid', None)
+        # A refresh already running for the user is awaited rather than skipped by the debounce
+        if acquire_licences_refresh(request) or inline_refreshes.is_running(user_uuid):
+            await refresh_licences(request)
+    if is_licence_found(request, licence):
+        return
+    # Only licences missing from a loaded set are remembered, not inactive ones
+    if str(licence) not in (getattr(request.state, 'licenses', None) or {}):
+        remember_missing_licence(request, licence)
+    raise HTTPException(status_code=403, detail="Licence not found")
 
 
-def extract_entity(request: Request) -> str:
-    licenses = getattr(request.state, 'licenses', None)
+def extract_licence_data(request: Request) -> dict:
+    licenses = getattr(request.state, 'licenses', None) or {}
     license_uuid = getattr(request.state, 'licence_uuid', None)
-    for lic in licenses:
-        if str(lic.get('uuid')) == str(license_uuid):
-            return lic.get('entity_uuid')
-    raise HTTPException(status_code=500, detail="Entity not found")
+    licence_data = licenses.get(str(license_uuid))
+    if licence_data is None:
+        raise HTTPException(status_code=500, detail="Entity not found")
+    return licence_data
 
 
-class LicenceVerificationMiddleware(BaseHTTPMiddleware):
-    def __init__(self, app):
-        super().__init__(app)
+def extract_entity(request: Request) -> str:
+    return extract_licence_data(request).get('entity_uuid')
+
+
+class LicenceVerificationMiddleware:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
 
-    @log_time_async
-    async def dispatch(self, request: Request, call_next) -> Response:
-        logging.info("LicenceVerificationMiddleware")
         try:
-            if not is_unprotected_path(request.url.path) and not is_unlicensed_path(request.url.path):
-                check_headers_licence(request)
-                licence_uuid = extract_licence(request)
-                logging.info(f"licence_uuid: {licence_uuid}")
-                check_licence(request, licence_uuid)
-                setattr(request.state, 'licence_uuid', licence_uuid)
-                entity_uuid = extract_entity(request)
-                logging.info(f"entity_uuid: {entity_uuid}")
-                setattr(request.state, 'entity_uuid', entity_uuid)
-            response = await call_next(request)
-            return response
+            await self.verify(Request(scope))
         except HTTPException as exc:
-            return JSONResponse(status_code=exc.status_code, content={"detail": exc.detail})
+            response = JSONResponse(status_code=exc.status_code, content={"detail": exc.detail})
+            await response(scope, receive, send)
+            return
+
+        await self.app(scope, receive, send)
+
+    @MIDDLEWARE_DURATION.time_async("licence")
+    @traced("licence_middleware")
+    @log_time_async
+    async def verify(self, request: Request) -> None:
+        sampled_debug(logger, "LicenceVerificationMiddleware")
+        path = request.scope["path"]
+        if not is_unprotected_path(path) and not is_unlicensed_path(path):
+            check_headers_licence(request)
+            licence_uuid = extract_licence(request)
+            await check_licence(request, licence_uuid)
+            setattr(request.state, 'licence_uuid', licence_uuid)
+            licence_data = extract_licence_data(request)
+            annotate_request(licence_uuid=licence_uuid, entity_uuid=licence_data['entity_uuid'])
+            setattr(request.state, 'entity_uuid', licence_data['entity_uuid'])
+            setattr(request.state, 'licence_roles', licence_data['roles'])
+            schedule_licences_refresh(request)
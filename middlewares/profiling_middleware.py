@@ -0,0 +1,88 @@
+import cProfile
+import hmac
+import os
+import pstats
+import random
+import time
+from urllib.parse import parse_qs
+
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from services.profiling_service import ProfileStore, collapse_stats, render_stats_text, thread_profiles
+
+PROFILES_PATH = "/profiles/"
+
+
+class ProfilingMiddleware:
+    """
+    Profile the requests that carry the profiling secret, and serve the stored profiles
+    under /profiles/{id} to the same secret. Only installed when a secret is configured.
+    """
+
+    def __init__(self, app: ASGIApp, secret: str, header: str, sample_rate: float, store: ProfileStore):
+        self.app = app
+        self.secret = secret.encode()
+        self.header = header.lower().encode("latin-1")
+        self.sample_rate = sample_rate
+        self.store = store
+        # cProfile hooks the whole thread (the whole process from 3.12): one profiled request at a time
+        self.running = False
+
+    def is_authorized(self, scope: Scope) -> bool:
+        for name, value in scope["headers"]:
+            if name == self.header:
+                return hmac.compare_digest(value, self.secret)
+        return False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not self.is_authorized(scope):
+            await self.app(scope, receive, send)
+            return
+
+        if scope["path"].startswith(PROFILES_PATH):
+            await self.serve_profile(scope, receive, send)
+        elif not self.running and random.random() < self.sample_rate:
+            await self.profile(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+    async def profile(self, scope: Scope, receive: Receive, send: Send) -> None:
+        profile_id = os.urandom(8).hex()
+        profiler = cProfile.Profile()
+
+        async def send_with_profile_id(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", profile_id.encode())]
+            await send(message)
+
+        # Coroutines of other requests that run meanwhile on the event loop are profiled too. Before 3.12,
+        # threadpool calls made for this request are profiled in their worker thread and merged in
+        worker_profiles = []
+        token = thread_profiles.set(worker_profiles)
+        self.running = True
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            profiler.disable()
+            self.running = False
+            thread_profiles.reset(token)
+            stats = pstats.Stats(profiler)
+            if worker_profiles:
+                stats.add(*worker_profiles)
+            self.store.add(profile_id, stats, scope["method"], scope["path"], time.perf_counter() - start)
+
+    async def serve_profile(self, scope: Scope, receive: Receive, send: Send) -> None:
+        profile = self.store.get(scope["path"][len(PROFILES_PATH):])
+        if profile is None:
+            response = JSONResponse(status_code=404, content={"detail": "Profile not found"})
+        else:
+            output = parse_qs(scope["query_string"].decode("latin-1")).get("format", ["collapsed"])[0]
+            if output == "text":
+                content = render_stats_text(profile["stats"])
+            else:
+                content = collapse_stats(profile["stats"])
+            response = PlainTextResponse(content)
+        await response(scope, receive, send)
@@ -0,0 +1,39 @@
+import logging
+import time
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from utils.log_util import request_fields
+
+logger = logging.getLogger("access")
+
+
+class RequestLogMiddleware:
+    """Write a single summary line per request, with the fields the other layers attached to it."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not logger.isEnabledFor(logging.INFO):
+            await self.app(scope, receive, send)
+            return
+
+        fields = {}
+        token = request_fields.set(fields)
+        start = time.perf_counter()
+        status = None
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            request_fields.reset(token)
+            duration_ms = (time.perf_counter() - start) * 1000
+            fields.update(method=scope["method"], path=scope["path"], status=status, duration_ms=round(duration_ms, 1))
+            logger.info("%s %s %s %.1fms", scope["method"], scope["path"], status, duration_ms, extra={"fields": fields})
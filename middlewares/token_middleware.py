@@ -1,26 +1,41 @@
+import base64
+import hashlib
 import logging
 import time
-from typing import Any
 
 import httpx
+import orjson
 from fastapi import HTTPException
-from starlette.middleware.base import BaseHTTPMiddleware
+from redis.asyncio import Redis
 from starlette.requests import Request
-from starlette.responses import JSONResponse, Response
-from config.config import API_NAME, KEYCLOAK_HOST, KEYCLOAK_REALM, KEYCLOAK_CLIENT_ID, KEYCLOAK_CLIENT_SECRET
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+from config.config import API_NAME, KEYCLOAK_HOST, KEYCLOAK_REALM, KEYCLOAK_CLIENT_ID, KEYCLOAK_CLIENT_SECRET, \
+    JWKS_CACHE, LICENCE_WATCH_CACHE_TTL, LICENCE_WATCH_ENABLED, TOKEN_AUDIENCE, TOKEN_CACHE, TOKEN_LEEWAY, TOKEN_VERIFICATION_MODE
 from decorators.log_time import log_time_async
+from schemas.cache_token_schema import cache_licence_set_serial, cache_token_serial, index_licence_set
+from services.http_service import get_keycloak_client
 from services.inmemory_service import get_redis_api_db
+from services.jwks_service import JwksUnavailableError, decode_token
+from services.metrics_service import AUTH_CACHE_LOOKUPS, MIDDLEWARE_DURATION
+from services.tracing_service import traced
+from services.single_flight import SingleFlight
+from utils.codec_util import decode, encode
+from utils.log_util import annotate_request, sampled_debug
 from utils.path_util import is_unprotected_path
 
-r = get_redis_api_db()
+logger = logging.getLogger(__name__)
+verifications = SingleFlight()
+
 
 def generate_state_info( token_info: dict ) -> dict:
-    logging.info(f"Token : generate_state_info")
+    sampled_debug(logger, "Token : generate_state_info")
     return {
         "user_uuid": token_info.get("sub"),
         "user_display_name": token_info.get("preferred_username"),
         "user_email": token_info.get("email"),
         "user_audiences": token_info.get("aud"),
+        "exp": token_info.get("exp"),
         "cached_time": token_info.get("cached_time")
     }
 
@@ -28,9 +43,9 @@ def generate_state_info( token_info: dict ) -> dict:
 def is_token_valid_audience( token_info: dict ) -> bool:
     aud = token_info.get("aud")
     if isinstance(aud, str):
-        return "karned" == aud
+        return TOKEN_AUDIENCE == aud
     if isinstance(aud, list):
-        return "karned" in aud
+        return TOKEN_AUDIENCE in aud
     return False
 
 
@@ -40,28 +55,101 @@ def is_token_active( token_info: dict ) -> bool:
     exp = token_info.get("exp")
 
     if iat is not None and exp is not None:
-        return iat < now < exp
+        # Same clock skew allowance as the local JWT verification
+        return iat - TOKEN_LEEWAY < now < exp + TOKEN_LEEWAY
 
     return False
 
 
-def read_cache_token( token: str ) -> Any | None:
-    logging.info(f"Token : read_cache_token")
-    cached_result = r.get(token)
-    if cached_result is not None:
-        return eval(cached_result)
-    return None
-
-
-def write_cache_token( token: str, cache_token: dict ):
-    logging.info(f"Token : write_cache_token")
+def cache_key( token: str ) -> str:
+    return "token:" + hashlib.sha256(token.encode()).hexdigest()
+
+
+def licences_cache_key( user_uuid: str ) -> str:
+    return "licences:user:" + user_uuid
+
+
+def extract_subject( token: str ) -> str | None:
+    # Unverified read of the JWT "sub" claim, only used to address the licences entry;
+    # it is checked against the verified token record before the licences are used
+    try:
+        payload = token.split(".")[1]
+        claims = orjson.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+    except (IndexError, ValueError):
+        return None
+    subject = claims.get("sub") if isinstance(claims, dict) else None
+    return subject if isinstance(subject, str) else None
+
+
+async def read_cache_auth( r: Redis, token: str ) -> tuple[dict | None, dict | None]:
+    """
+    Load the token record and the user's licence set, from the in-process
+    cache or from Redis in a single MGET round trip. The licence set holds
+    the licences indexed by uuid and the time they next need a refresh.
+    On a token miss the licence set read for the token's unverified subject
+    is still returned, see owned_licence_set.
+    """
+    sampled_debug(logger, "Token : read_cache_auth")
+    token_key = cache_key(token)
+    cached = TOKEN_CACHE.get(token_key)
+    if cached is not None:
+        AUTH_CACHE_LOOKUPS.inc("l1", "hit")
+        return cached
+    AUTH_CACHE_LOOKUPS.inc("l1", "miss")
+    subject = extract_subject(token)
+    if subject is None:
+        cached_token, cached_licences = await r.get(token_key), None
+    else:
+        cached_token, cached_licences = await r.mget(token_key, licences_cache_key(subject))
+    cache_token = decode(cached_token)
+    cached_licences = decode(cached_licences)
+    licence_set = index_licence_set(cached_licences) if cached_licences is not None else None
+    if cache_token is None:
+        AUTH_CACHE_LOOKUPS.inc("redis", "miss")
+        return None, licence_set
+    AUTH_CACHE_LOOKUPS.inc("redis", "hit")
+    if subject != cache_token.get("sub"):
+        licence_set = None
+    TOKEN_CACHE.set(token_key, (cache_token, licence_set), exp=cache_token.get("exp"))
+    return cache_token, licence_set
+
+
+async def write_cache_token( r: Redis, token: str, cache_token: dict, licence_set: dict | None = None ):
+    sampled_debug(logger, "Token : write_cache_token")
     if cache_token.get("exp") is not None:
         ttl = cache_token.get("exp") - int(time.time())
-        r.set(token, str(cache_token), ex=ttl)
-
-
-def introspect_token( token: str ) -> dict:
-    logging.info(f"Token : introspect_token")
+        if ttl > 0:
+            key = cache_key(token)
+            cache_token = cache_token_serial(cache_token)
+            await r.set(key, encode(cache_token), ex=ttl)
+            TOKEN_CACHE.set(key, (cache_token, licence_set), exp=cache_token.get("exp"))
+
+
+def licences_expires_at( licence_set: dict, exp: int | None ) -> int | None:
+    # The entry lives until the token expires or the set of active licences changes. With the
+    # change stream watcher invalidating it on writes, it no longer has to die with the token.
+    if LICENCE_WATCH_ENABLED:
+        exp = int(time.time()) + LICENCE_WATCH_CACHE_TTL
+    if exp is None:
+        return None
+    return min(exp, licence_set["refresh_at"] or exp)
+
+
+async def write_cache_licences( r: Redis, token: str, user_uuid: str, licence_set: dict, exp: int | None ):
+    sampled_debug(logger, "Token : write_cache_licences")
+    expires_at = licences_expires_at(licence_set, exp)
+    if expires_at is not None:
+        ttl = expires_at - int(time.time())
+        if ttl > 0:
+            await r.set(licences_cache_key(user_uuid), encode(cache_licence_set_serial(licence_set)), ex=ttl)
+            token_key = cache_key(token)
+            cached = TOKEN_CACHE.get(token_key)
+            if cached is not None:
+                TOKEN_CACHE.set(token_key, (cached[0], licence_set), exp=exp)
+
+
+async def introspect_token( token: str ) -> dict:
+    sampled_debug(logger, "Token : introspect_token")
     url = f"{KEYCLOAK_HOST}/realms/{KEYCLOAK_REALM}/protocol/openid-connect/token/introspect"
     data = {
         "token": token,
@@ -69,30 +157,71 @@ def introspect_token( token: str ) -> dict:
         "client_secret": KEYCLOAK_CLIENT_SECRET
     }
 
-    response = httpx.post(url, data=data)
+    try:
+        response = await get_keycloak_client().post(url, data=data)
+    except httpx.HTTPError:
+        raise HTTPException(status_code=500, detail="Keycloak introspection failed")
     if response.status_code != 200:
         raise HTTPException(status_code=500, detail="Keycloak introspection failed")
     return response.json()
 
 
+async def verify_token_locally( token: str ) -> dict:
+    sampled_debug(logger, "Token : verify_token_locally")
+    return await decode_token(token, JWKS_CACHE, get_keycloak_client(), audience=TOKEN_AUDIENCE, leeway=TOKEN_LEEWAY)
+
+
+async def verify_token( token: str ) -> dict:
+    if TOKEN_VERIFICATION_MODE == "local":
+        try:
+            return await verify_token_locally(token)
+        except JwksUnavailableError as e:
+            logger.warning("Token : local verification unavailable, falling back to introspection (%s)", e)
+    return await introspect_token(token)
+
+
 def prepare_cache_token(token_info: dict ) -> dict:
     cached_time = int(time.time())
     token_info["cached_time"] = cached_time
     return token_info
 
 
-def get_token_info( token: str ) -> dict:
-    response = read_cache_token(token)
-    if not response:
-        response = introspect_token(token)
-        cache_token = prepare_cache_token(response)
-        write_cache_token(token, cache_token)
+def owned_licence_set( token_info: dict, token: str, licence_set: dict | None ) -> dict | None:
+    # The licences were read under the token's unverified subject: kept only once the verified record agrees
+    if licence_set is None or token_info.get("sub") != extract_subject(token):
+        return None
+    return licence_set
+
+
+async def verify_and_cache_token( r: Redis, token: str, licence_set: dict | None = None ) -> dict:
+    response = await verify_token(token)
+    cache_token = prepare_cache_token(response)
+    await write_cache_token(r, token, cache_token, owned_licence_set(response, token, licence_set))
     return response
 
 
-def delete_cache_token( token: str ):
-    logging.info(f"Token : delete_cache_token")
-    r.delete(token)
+async def get_auth_info( token: str ) -> tuple[dict, dict | None]:
+    r = get_redis_api_db()
+    response, licence_set = await read_cache_auth(r, token)
+    annotate_request(auth="cache" if response else "verify")
+    if not response:
+        # Concurrent misses for the same token share a single upstream verification
+        # A new token of a user with cached licences reuses them instead of looking them up again
+        response = await verifications.do(cache_key(token), verify_and_cache_token, r, token, licence_set)
+        licence_set = owned_licence_set(response, token, licence_set)
+    return response, licence_set
+
+
+async def get_token_info( token: str ) -> dict:
+    token_info, _ = await get_auth_info(token)
+    return token_info
+
+
+async def delete_cache_token( r: Redis, token: str ):
+    sampled_debug(logger, "Token : delete_cache_token")
+    token_key = cache_key(token)
+    TOKEN_CACHE.delete(token_key)
+    await r.delete(token_key)
 
 
 def is_headers_token_present( request: Request ) -> bool:
@@ -110,12 +239,12 @@ def extract_token( request: Request ) -> str:
     return token
 
 
-def refresh_cache_token( request: Request ):
-    logging.info(f"Token : refresh_cache_token")
+async def refresh_cache_token( request: Request ):
+    sampled_debug(logger, "Token : refresh_cache_token")
     check_headers_token(request)
     token = extract_token(request)
-    delete_cache_token(token)
-    token_info = get_token_info(token)
+    await delete_cache_token(get_redis_api_db(), token)
+    token_info = await get_token_info(token)
     check_token(token_info)
     state_token_info = generate_state_info(token_info)
     store_token_info_in_state(state_token_info, request)
@@ -127,6 +256,11 @@ def store_token_info_in_state( state_token_info: dict, request: Request ):
     setattr(request.state, 'token', extract_token(request))
 
 
+def store_licences_in_state( licence_set: dict | None, request: Request ):
+    setattr(request.state, 'licenses', licence_set["licences"] if licence_set else None)
+    setattr(request.state, 'licences_refresh_at', licence_set["refresh_at"] if licence_set else None)
+
+
 def check_headers_token( request: Request ):
     if not is_headers_token_present(request):
         raise HTTPException(status_code=401, detail="Token manquant ou invalide")
@@ -140,24 +274,36 @@ def check_token( token_info ):
         raise HTTPException(status_code=401, detail="Token is not valid for this audience")
 
 
-class TokenVerificationMiddleware(BaseHTTPMiddleware):
-    def __init__( self, app ):
-        super().__init__(app)
+class TokenVerificationMiddleware:
+    def __init__( self, app: ASGIApp ):
+        self.app = app
 
-    @log_time_async
-    async def dispatch( self, request: Request, call_next ) -> Response:
-        logging.info("TokenVerificationMiddleware")
+    async def __call__( self, scope: Scope, receive: Receive, send: Send ) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
 
         try:
-            if not is_unprotected_path(request.url.path):
-                check_headers_token(request)
-                token = extract_token(request)
-                token_info = get_token_info(token)
-                check_token(token_info)
-                state_token_info = generate_state_info(token_info)
-                store_token_info_in_state(state_token_info, request)
-            response = await call_next(request)
-            return response
+            await self.verify(Request(scope))
         except HTTPException as exc:
-            return JSONResponse(status_code=exc.status_code, content={"detail": exc.detail})
+            response = JSONResponse(status_code=exc.status_code, content={"detail": exc.detail})
+            await response(scope, receive, send)
+            return
+
+        await self.app(scope, receive, send)
 
+    @MIDDLEWARE_DURATION.time_async("token")
+    @traced("token_middleware")
+    @log_time_async
+    async def verify( self, request: Request ) -> None:
+        sampled_debug(logger, "TokenVerificationMiddleware")
+
+        if not is_unprotected_path(request.scope["path"]):
+            check_headers_token(request)
+            token = extract_token(request)
+            token_info, licence_set = await get_auth_info(token)
+            check_token(token_info)
+            state_token_info = generate_state_info(token_info)
+            store_token_info_in_state(state_token_info, request)
+            store_licences_in_state(licence_set, request)
+            annotate_request(user_uuid=state_token_info.get("user_uuid"))
@@ -0,0 +1,39 @@
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from middlewares.metrics_middleware import route_label
+from services.tracing_service import is_tracing_enabled, start_trace
+from utils.log_util import annotate_request
+
+
+def traceparent_header(scope: Scope) -> str | None:
+    for name, value in scope["headers"]:
+        if name == b"traceparent":
+            return value.decode("latin-1")
+    return None
+
+
+class TracingMiddleware:
+    """Open the root span of sampled requests; the spans below it attach to it through the context."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        root = None
+        if scope["type"] == "http" and is_tracing_enabled():
+            root = start_trace(f"{scope['method']} {scope['path']}", traceparent_header(scope))
+        if root is None:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_status(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                root.set_attribute("status", message["status"])
+            await send(message)
+
+        annotate_request(trace_id=root.trace_id)
+        with root:
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                root.set_attribute("route", route_label(scope))
@@ -1,6 +1,8 @@
+from typing import Optional
+
 from pydantic import BaseModel, Field
 
 class HistoricalModel(BaseModel):
     iat: int = Field(..., description="IAT")
     exp: int = Field(..., description="Exp")
-    user_uuid: str = Field(..., description="User UUID")
+    user_uuid: Optional[str] = Field(default=None, description="User UUID")
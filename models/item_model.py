@@ -12,8 +12,8 @@ class Item(BaseModel):
     auto_renew: bool = Field(default=True, description="Auto renew")
     iat: int = Field(..., description="license iat")
     exp: int = Field(..., description="License exp")
-    user_uuid: str = Field(..., description="User UUID")
-    entity_uuid: str  = Field(..., description="Entity UUID")
+    user_uuid: Optional[str] = Field(default=None, description="User UUID, null while unassigned")
+    entity_uuid: Optional[str] = Field(default=None, description="Entity UUID")
     historical: List[HistoricalModel] = Field(..., description="License assignment historical data")
     sales: List[SalesModel] = Field(..., description="License sales data")
     api_roles: Optional[Dict[str, Dict[str, List[str]]]] = Field(default=None, description="API roles mapping")
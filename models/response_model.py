@@ -16,9 +16,16 @@ class SuccessResponse(BaseModel, Generic[T]):
     data: T
     message: str = "Operation completed successfully"
 
+class PageResponse(SuccessResponse[T], Generic[T]):
+    next_cursor: Optional[str] = None
+
 def create_success_response(data: Any, message: str = "Operation completed successfully") -> Dict:
     return SuccessResponse(data=data, message=message).dict()
 
+def create_page_response(data: Any, next_cursor: Optional[str], message: str = "Operation completed successfully") -> Dict:
+    # Same shape as PageResponse, built without a model so list items are not walked again
+    return {"status": "success", "data": data, "message": message, "next_cursor": next_cursor}
+
 def create_error_response(code: str, message: str) -> Dict:
     return {
         "status": "error",
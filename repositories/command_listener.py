@@ -0,0 +1,17 @@
+from pymongo import monitoring
+
+from services.metrics_service import MONGO_DURATION, MONGO_ERRORS
+
+
+class CommandStatsListener(monitoring.CommandListener):
+    """Record the latency and failures of the commands sent by a MongoClient."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_DURATION.observe(event.duration_micros / 1e6, event.command_name)
+
+    def failed(self, event):
+        MONGO_DURATION.observe(event.duration_micros / 1e6, event.command_name)
+        MONGO_ERRORS.inc(event.command_name)
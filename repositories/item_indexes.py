@@ -0,0 +1,33 @@
+from pymongo import ASCENDING, IndexModel
+
+# Compound indexes for the list endpoint filters: equality fields first, then _id (the pagination
+# sort key), then the iat/exp ranges, so a page is read in index order without an in-memory sort
+ITEM_INDEXES = [
+    # /unassigned and /assigned: entity_uuid, user_uuid (null / not null), current licences
+    IndexModel([("entity_uuid", ASCENDING), ("user_uuid", ASCENDING), ("_id", ASCENDING), ("exp", ASCENDING),
+                ("iat", ASCENDING)], name="entity_user_id_exp_iat"),
+    # /expired: entity_uuid, expired licences
+    IndexModel([("entity_uuid", ASCENDING), ("_id", ASCENDING), ("exp", ASCENDING), ("iat", ASCENDING)],
+               name="entity_id_exp_iat"),
+    # /mine and the licence lookup of the middleware
+    IndexModel([("user_uuid", ASCENDING), ("_id", ASCENDING), ("exp", ASCENDING), ("iat", ASCENDING)],
+               name="user_id_exp_iat"),
+    # /purchase
+    IndexModel([("name", ASCENDING), ("_id", ASCENDING)], name="name_id")
+]
+
+
+def has_collscan(plan: dict) -> bool:
+    """Whether a find explain() output has a COLLSCAN stage in its winning plan."""
+    winning_plan = plan.get("queryPlanner", {}).get("winningPlan", {})
+    stages = [winning_plan]
+    while stages:
+        stage = stages.pop()
+        if stage.get("stage") == "COLLSCAN":
+            return True
+        # Classic plans nest inputStage(s); slot based plans wrap them in queryPlan
+        for key in ("inputStage", "queryPlan"):
+            if isinstance(stage.get(key), dict):
+                stages.append(stage[key])
+        stages.extend(stage.get("inputStages", []))
+    return False
@@ -2,28 +2,45 @@ import logging
 import json
 from typing import List
 from uuid import uuid4
-from pymongo import MongoClient
+from pymongo import ASCENDING, MongoClient
 from interfaces.item_interface import ItemRepository
+from repositories.item_indexes import ITEM_INDEXES
+from repositories.command_listener import CommandStatsListener
+from repositories.pool_listener import PoolStatsListener
 from models.item_model import Item
-from schemas.item_schema import list_item_serial, item_serial
+from schemas.item_schema import item_projection
 
 
 class ItemRepositoryMongo(ItemRepository):
-    def __init__(self, url: str, database: str, collection: str):
+    def __init__(self, url: str, database: str, collection: str, max_pool_size: int = 100, min_pool_size: int = 0):
         self.url = url
         self.database = database
         self.collection = collection
+        self.max_pool_size = max_pool_size
+        self.min_pool_size = min_pool_size
+        self.pool_listener = PoolStatsListener()
+        self.command_listener = CommandStatsListener()
         self.client = None
         self.db = None
 
-    def __enter__(self):
-        self.client = MongoClient(self.url)
-        self.db = self.client[self.database]
+    def open(self):
+        # One long-lived client per worker: MongoClient is thread-safe and pools its own connections
+        if self.client is None:
+            self.client = MongoClient(
+                self.url,
+                maxPoolSize=self.max_pool_size,
+                minPoolSize=self.min_pool_size,
+                event_listeners=[self.pool_listener, self.command_listener]
+            )
+            self.db = self.client[self.database]
         return self
 
+    def __enter__(self):
+        return self.open()
+
     def __exit__(self, exc_type, exc_value, traceback):
-        if self.client:
-            self.client.close()
+        # The client outlives the block; it is closed once, on shutdown
+        pass
 
     def create_item(self, item_create: Item) -> str:
         item_data = item_create.model_dump()
@@ -33,18 +50,29 @@ class ItemRepositoryMongo(ItemRepository):
         return new_uuid.inserted_id
 
     def get_item(self, uuid: str) -> dict:
-        result = self.db[self.collection].find_one({"_id": uuid})
-        if result is None:
-            return None
-        else:
-            item = item_serial(result)
-            return item
-
-    def list_items(self, filters: dict) -> List[dict]:
+        return self.db[self.collection].find_one({"_id": uuid}, item_projection())
+
+    def list_items(self, filters: dict, fields: list[str] | None = None, limit: int | None = None) -> List[dict]:
         query = filters
-        result = self.db[self.collection].find(query)
-        items = list_item_serial(result)
-        return items
+        # Only the requested fields are read, already shaped as the response by the projection
+        projection = item_projection(fields)
+        result = self.db[self.collection].find(query, projection)
+        if limit is not None:
+            # Pages follow _id order, see services.items_service.get_items_page
+            result = result.sort("_id", ASCENDING).limit(limit)
+        return list(result)
+
+    def iter_item_batches(self, filters: dict, fields: list[str] | None = None, batch_size: int = 500):
+        projection = item_projection(fields)
+        cursor = self.db[self.collection].find(filters, projection).sort("_id", ASCENDING).batch_size(batch_size)
+        batch = []
+        for document in cursor:
+            batch.append(document)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
 
     def update_item(self, uuid: str, item_update: Item) -> None:
         update_data = {"$set": item_update.model_dump()}
@@ -53,5 +81,24 @@ class ItemRepositoryMongo(ItemRepository):
     def delete_item(self, uuid: str) -> None:
         self.db[self.collection].delete_one({"_id": uuid})
 
+    def ensure_indexes(self) -> list[str]:
+        return self.db[self.collection].create_indexes(ITEM_INDEXES)
+
+    def explain_items(self, filters: dict, limit: int | None = None) -> dict:
+        cursor = self.db[self.collection].find(filters)
+        if limit is not None:
+            cursor = cursor.sort("_id", ASCENDING).limit(limit)
+        return cursor.explain()
+
+    def pool_stats(self) -> dict:
+        return {
+            "max_pool_size": self.max_pool_size,
+            "min_pool_size": self.min_pool_size,
+            **self.pool_listener.stats()
+        }
+
     def close(self):
-        self.client.close()
\ No newline at end of file
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+            self.db = None
\ No newline at end of file
@@ -0,0 +1,89 @@
+from typing import List
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING
+from interfaces.item_interface import ItemRepository
+from models.item_model import Item
+from repositories.item_indexes import ITEM_INDEXES
+from repositories.command_listener import CommandStatsListener
+from repositories.pool_listener import PoolStatsListener
+from schemas.item_schema import item_projection
+
+
+class ItemRepositoryMotor(ItemRepository):
+    def __init__(self, url: str, database: str, collection: str, max_pool_size: int = 100, min_pool_size: int = 0):
+        self.url = url
+        self.database = database
+        self.collection = collection
+        self.max_pool_size = max_pool_size
+        self.min_pool_size = min_pool_size
+        self.pool_listener = PoolStatsListener()
+        self.command_listener = CommandStatsListener()
+        self.client = None
+        self.db = None
+
+    def open(self):
+        if self.client is None:
+            self.client = AsyncIOMotorClient(
+                self.url,
+                maxPoolSize=self.max_pool_size,
+                minPoolSize=self.min_pool_size,
+                event_listeners=[self.pool_listener, self.command_listener]
+            )
+            self.db = self.client[self.database]
+        return self
+
+    async def create_item(self, item_create: Item) -> str:
+        item_data = item_create.model_dump()
+        item_data["_id"] = str(item_data['uuid'])
+        del(item_data['uuid'])
+        new_uuid = await self.db[self.collection].insert_one(item_data)
+        return new_uuid.inserted_id
+
+    async def get_item(self, uuid: str) -> dict:
+        return await self.db[self.collection].find_one({"_id": uuid}, item_projection())
+
+    async def list_items(self, filters: dict, fields: list[str] | None = None, limit: int | None = None) -> List[dict]:
+        projection = item_projection(fields)
+        cursor = self.db[self.collection].find(filters, projection)
+        if limit is not None:
+            cursor = cursor.sort("_id", ASCENDING).limit(limit)
+        return await cursor.to_list(length=None)
+
+    async def iter_item_batches(self, filters: dict, fields: list[str] | None = None, batch_size: int = 500):
+        projection = item_projection(fields)
+        cursor = self.db[self.collection].find(filters, projection).sort("_id", ASCENDING).batch_size(batch_size)
+        while True:
+            documents = await cursor.to_list(length=batch_size)
+            if not documents:
+                return
+            yield documents
+
+    async def update_item(self, uuid: str, item_update: Item) -> None:
+        update_data = {"$set": item_update.model_dump()}
+        await self.db[self.collection].find_one_and_update({"_id": uuid}, update_data)
+
+    async def delete_item(self, uuid: str) -> None:
+        await self.db[self.collection].delete_one({"_id": uuid})
+
+    async def ensure_indexes(self) -> list[str]:
+        return await self.db[self.collection].create_indexes(ITEM_INDEXES)
+
+    async def explain_items(self, filters: dict, limit: int | None = None) -> dict:
+        cursor = self.db[self.collection].find(filters)
+        if limit is not None:
+            cursor = cursor.sort("_id", ASCENDING).limit(limit)
+        return await cursor.explain()
+
+    def pool_stats(self) -> dict:
+        return {
+            "max_pool_size": self.max_pool_size,
+            "min_pool_size": self.min_pool_size,
+            **self.pool_listener.stats()
+        }
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+            self.db = None
@@ -0,0 +1,62 @@
+import threading
+
+from pymongo import monitoring
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Count connection pool events of a MongoClient across all its servers."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {
+            "open": 0,
+            "in_use": 0,
+            "created": 0,
+            "closed": 0,
+            "checked_out": 0,
+            "checkout_failed": 0,
+            "cleared": 0
+        }
+
+    def increment(self, *names: str, by: int = 1) -> None:
+        with self.lock:
+            for name in names:
+                self.counters[name] += by
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self.increment("cleared")
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self.increment("open", "created")
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self.increment("closed")
+        self.increment("open", by=-1)
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self.increment("checkout_failed")
+
+    def connection_checked_out(self, event):
+        self.increment("in_use", "checked_out")
+
+    def connection_checked_in(self, event):
+        self.increment("in_use", by=-1)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return dict(self.counters)
@@ -1,19 +1,59 @@
 import logging
-from datetime import datetime
 
-from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+from fastapi import APIRouter, Depends, Query, Request, Response, status
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import TypeAdapter
 
-from config.config import API_TAG_NAME, ITEM_REPO
+from config.config import API_TAG_NAME, ITEM_PAGE_LIMIT, ITEM_PAGE_MAX_LIMIT, ITEM_REPO, ITEM_RESPONSE_VALIDATION
 from models.item_model import Item
-from models.response_model import SuccessResponse, create_success_response
-from services.items_service import get_item, get_items
+from models.response_model import PageResponse, SuccessResponse, create_page_response, create_success_response
+from services.items_service import get_assigned_filters, get_expired_filters, get_item_async, get_items_page, \
+    get_mine_filters, get_purchase_filters, get_unassigned_filters, resolve_item_fields, stream_items_ndjson
+from utils.log_util import sampled_debug
+
+logger = logging.getLogger(__name__)
 
 VERSION = "v1"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
 api_group_name = f"/{API_TAG_NAME}/{VERSION}/"
+ITEM_PAGE_ADAPTER = TypeAdapter(PageResponse[list[Item]])
 
 def get_repo():
-    with ITEM_REPO as repo:
-        yield repo
+    # Opened in the app lifespan; open() is a no-op once the client exists
+    return ITEM_REPO.open()
+
+
+def create_items_response(items: list, next_cursor: str | None, fields: list[str] | None) -> Response:
+    content = create_page_response(data=items, next_cursor=next_cursor)
+    if fields is None and ITEM_RESPONSE_VALIDATION:
+        # Validated once against the documented model, serialized by pydantic-core
+        return Response(
+            content=ITEM_PAGE_ADAPTER.dump_json(ITEM_PAGE_ADAPTER.validate_python(content)),
+            media_type="application/json"
+        )
+    # Returning a Response skips the response_model pass: the serialized repository output (full or
+    # projected) is trusted and written with orjson, while response_model still documents the schema
+    return ORJSONResponse(content=content)
+
+
+class PageParams:
+    def __init__(self, limit: int = Query(ITEM_PAGE_LIMIT, ge=1, le=ITEM_PAGE_MAX_LIMIT), cursor: str | None = None):
+        self.limit = limit
+        self.cursor = cursor
+
+
+def is_ndjson_requested(request: Request) -> bool:
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+async def list_items_response(request: Request, filters: dict, repo, fields: str | None, view: str | None,
+                              page: PageParams):
+    item_fields = resolve_item_fields(fields, view)
+    if is_ndjson_requested(request):
+        # Full listing, one item per line, written batch by batch as the cursor is read
+        return StreamingResponse(stream_items_ndjson(filters, repo, item_fields), media_type=NDJSON_MEDIA_TYPE)
+    items, next_cursor = await get_items_page(filters, repo, page.limit, page.cursor, item_fields)
+    return create_items_response(items, next_cursor, item_fields)
 
 
 router = APIRouter(
@@ -50,77 +90,53 @@ router = APIRouter(
 #     }
 #     return get_items(filters, repo)
 
-@router.get(path="/purchase", status_code=status.HTTP_200_OK, response_model=SuccessResponse[list[Item]])
-async def purchase(request: Request, name: str | None = None, repo=Depends(get_repo) ):
-    filters = {
-        "name": name
-    }
-    items = get_items(filters, repo)
-    return create_success_response(data=items)
-
-@router.get(path="/unassigned", status_code=status.HTTP_200_OK, response_model=SuccessResponse[list[Item]])
-async def unassigned_items(request: Request, repo=Depends(get_repo)):
-    now = int(datetime.now().timestamp())
+@router.get(path="/purchase", status_code=status.HTTP_200_OK, response_model=PageResponse[list[Item]])
+async def purchase(request: Request, name: str | None = None, fields: str | None = None, view: str | None = None,
+                   page: PageParams = Depends(), repo=Depends(get_repo) ):
+    filters = get_purchase_filters(name)
+    return await list_items_response(request, filters, repo, fields, view, page)
+
+@router.get(path="/unassigned", status_code=status.HTTP_200_OK, response_model=PageResponse[list[Item]])
+async def unassigned_items(request: Request, fields: str | None = None, view: str | None = None,
+                           page: PageParams = Depends(), repo=Depends(get_repo)):
     entity_uuid = request.state.entity_uuid
-    filters = {
-        "entity_uuid": entity_uuid,
-        "user_uuid": {"$eq": None, "$exists": True},
-        "iat": {"$lt": now},
-        "exp": {"$gt": now},
-    }
-    items = get_items(filters, repo)
-    return create_success_response(data=items)
+    filters = get_unassigned_filters(entity_uuid)
+    return await list_items_response(request, filters, repo, fields, view, page)
 
 # @router.post(path="/assign/{uuid}", status_code=status.HTTP_201_CREATED)
 # async def assign_license( request: Request, repo=Depends(get_repo) ):
 #     return {"status": "WIP"}
 
-@router.get(path="/assigned", status_code=status.HTTP_200_OK, response_model=SuccessResponse[list[Item]])
-async def assigned_items( request: Request, repo=Depends(get_repo) ):
-    now = int(datetime.now().timestamp())
+@router.get(path="/assigned", status_code=status.HTTP_200_OK, response_model=PageResponse[list[Item]])
+async def assigned_items( request: Request, fields: str | None = None, view: str | None = None,
+                          page: PageParams = Depends(), repo=Depends(get_repo) ):
     entity_uuid = request.state.entity_uuid
-    filters = {
-        "entity_uuid": entity_uuid,
-        "user_uuid": {"$ne": None, "$exists": True},
-        "iat": { "$lt": now },
-        "exp": { "$gt": now },
-    }
-    items = get_items(filters, repo)
-    return create_success_response(data=items)
+    filters = get_assigned_filters(entity_uuid)
+    return await list_items_response(request, filters, repo, fields, view, page)
 
 # @router.post(path="/unassign/{uuid}", status_code=status.HTTP_201_CREATED)
 # async def unassign_license( request: Request, repo=Depends(get_repo) ):
 #     return {"status": "WIP"}
 
-@router.get(path="/expired", status_code=status.HTTP_200_OK, response_model=SuccessResponse[list[Item]])
-async def expired_items(request: Request, repo=Depends(get_repo)):
-    now = int(datetime.now().timestamp())
+@router.get(path="/expired", status_code=status.HTTP_200_OK, response_model=PageResponse[list[Item]])
+async def expired_items(request: Request, fields: str | None = None, view: str | None = None,
+                        page: PageParams = Depends(), repo=Depends(get_repo)):
     entity_uuid = request.state.entity_uuid
-    filters = {
-        "entity_uuid": entity_uuid,
-        "iat": {"$lt": now},
-        "exp": {"$lt": now}
-    }
-    items = get_items(filters, repo)
-    return create_success_response(data=items)
+    filters = get_expired_filters(entity_uuid)
+    return await list_items_response(request, filters, repo, fields, view, page)
 
 @router.get(path="/license/{uuid}", status_code=status.HTTP_200_OK, response_model=SuccessResponse[Item])
 async def read_item(request: Request, uuid: str, repo=Depends(get_repo)):
-    logging.info(f"read item {uuid}")
-    item = get_item(uuid, repo)
+    sampled_debug(logger, "read item %s", uuid)
+    item = await get_item_async(uuid, repo)
     if item is None:
         return Response(status_code=404)
-    return create_success_response(data=item)
+    return ORJSONResponse(content=create_success_response(data=item))
 
-@router.get(path="/mine", status_code=status.HTTP_200_OK, response_model=SuccessResponse[list[Item]])
-async def get_mine(request: Request, repo=Depends(get_repo)):
-    now = int(datetime.now().timestamp())
+@router.get(path="/mine", status_code=status.HTTP_200_OK, response_model=PageResponse[list[Item]])
+async def get_mine(request: Request, fields: str | None = None, view: str | None = None,
+                   page: PageParams = Depends(), repo=Depends(get_repo)):
     user_uuid = getattr(request.state, 'user_uuid', None)
-    filters = {
-        "iat": { "$lt": now },
-        "exp": { "$gt": now },
-        "user_uuid": user_uuid
-    }
-    logging.info(f"filters: {filters}")
-    items = get_items(filters, repo)
-    return create_success_response(data=items)
+    filters = get_mine_filters(user_uuid)
+    sampled_debug(logger, "filters: %s", filters)
+    return await list_items_response(request, filters, repo, fields, view, page)
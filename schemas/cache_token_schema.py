@@ -0,0 +1,66 @@
+from config.config import API_NAME
+
+
+def licence_roles(licence) -> list:
+    if "roles" in licence:
+        return licence["roles"]
+    api_roles = licence.get("api_roles") or {}
+    roles = api_roles.get(API_NAME) if isinstance(api_roles, dict) else None
+    if not isinstance(roles, dict):
+        return []
+    return sorted({role for group in roles.values() for role in group})
+
+
+def cache_licence_serial(licence) -> dict:
+    return {
+        "uuid": str(licence["uuid"]),
+        "entity_uuid": licence["entity_uuid"],
+        "iat": licence["iat"],
+        "exp": licence["exp"],
+        "roles": licence_roles(licence)
+    }
+
+
+def list_cache_licence_serial(licences) -> list:
+    return [cache_licence_serial(licence) for licence in licences]
+
+
+def index_licences(licences) -> dict:
+    return {entry["uuid"]: entry for entry in list_cache_licence_serial(licences)}
+
+
+def licences_refresh_at(licences, after: int) -> int | None:
+    # Soonest moment the set of active licences changes: a licence expiring or a future one starting
+    boundaries = [
+        moment
+        for licence in licences
+        for moment in (licence["iat"], licence["exp"])
+        if moment > after
+    ]
+    return min(boundaries, default=None)
+
+
+def cache_licence_set_serial(licence_set) -> dict:
+    return {
+        "refresh_at": licence_set["refresh_at"],
+        "licences": list(licence_set["licences"].values())
+    }
+
+
+def index_licence_set(cached) -> dict:
+    return {
+        "refresh_at": cached.get("refresh_at"),
+        "licences": index_licences(cached.get("licences", []))
+    }
+
+
+def cache_token_serial(token_info) -> dict:
+    return {
+        "sub": token_info.get("sub"),
+        "preferred_username": token_info.get("preferred_username"),
+        "email": token_info.get("email"),
+        "aud": token_info.get("aud"),
+        "iat": token_info.get("iat"),
+        "exp": token_info.get("exp"),
+        "cached_time": token_info.get("cached_time")
+    }
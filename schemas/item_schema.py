@@ -1,26 +1,49 @@
-import logging
-
-from schemas.historical_schema import list_historical_serial
-from schemas.sales_schema import list_sales_serial
-
-
-def item_serial(item) -> dict:
-    return {
-        "uuid": str(item["_id"]),
-        "type_uuid": str(item["type_uuid"]),
-        "name": str(item["name"]),
-        "auto_renew": bool(item["auto_renew"]),
-        "iat": int(item["iat"]),
-        "exp": int(item["exp"]),
-        "user_uuid": str(item["user_uuid"]),
-        "entity_uuid": str(item["entity_uuid"]),
-        "historical": list_historical_serial(item["historical"]),
-        "sales": list_sales_serial(item["sales"]),
-        "api_roles": item.get("api_roles"),
-        "app_roles": item.get("app_roles"),
-        "apps": item.get("apps")
-    }
-
-
-def list_item_serial(items) -> list:
-    return [item_serial(item) for item in items]
+# How Mongo builds each response field. Documents come back from find() already in the response
+# structure and are decoded once, by the driver: there is no per-field rebuild in Python.
+# Scalars are converted on the server as item_serial did with str()/int(), so non-JSON BSON
+# values (ObjectId, Int64...) never reach the JSON encoders. A missing user_uuid or entity_uuid
+# (unassigned licence) comes back as null.
+HISTORICAL_FIELDS = {
+    "iat": {"$toLong": "$$entry.iat"},
+    "exp": {"$toLong": "$$entry.exp"},
+    "user_uuid": {"$toString": "$$entry.user_uuid"}
+}
+
+SALES_FIELDS = {
+    "uuid": {"$toString": "$$entry.uuid"},
+    "iat": {"$toLong": "$$entry.iat"},
+    "status": {"$toString": "$$entry.status"}
+}
+
+
+def map_entries(field: str, entry_fields: dict) -> dict:
+    return {"$map": {"input": {"$ifNull": [f"${field}", []]}, "as": "entry", "in": entry_fields}}
+
+
+ITEM_FIELDS = {
+    "uuid": {"$toString": "$_id"},
+    "type_uuid": {"$toString": "$type_uuid"},
+    "name": {"$toString": "$name"},
+    # Item.auto_renew defaults to True
+    "auto_renew": {"$toBool": {"$ifNull": ["$auto_renew", True]}},
+    "iat": {"$toLong": "$iat"},
+    "exp": {"$toLong": "$exp"},
+    "user_uuid": {"$toString": "$user_uuid"},
+    "entity_uuid": {"$toString": "$entity_uuid"},
+    "historical": map_entries("historical", HISTORICAL_FIELDS),
+    "sales": map_entries("sales", SALES_FIELDS),
+    "api_roles": {"$ifNull": ["$api_roles", None]},
+    "app_roles": {"$ifNull": ["$app_roles", None]},
+    "apps": {"$ifNull": ["$apps", None]}
+}
+
+# Named field sets for list endpoints (?view=...)
+ITEM_VIEWS = {
+    "summary": ["uuid", "type_uuid", "name", "iat", "exp"],
+    "assignment": ["uuid", "type_uuid", "name", "iat", "exp", "user_uuid", "entity_uuid", "auto_renew"]
+}
+
+
+def item_projection(fields=None) -> dict:
+    # Expressions in find() projections need MongoDB 4.4+
+    return {"_id": 0, **{field: ITEM_FIELDS[field] for field in (fields or ITEM_FIELDS)}}
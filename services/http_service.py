@@ -0,0 +1,82 @@
+import time
+
+import httpx
+from config.config import GATEWAY_HTTP_MAX_CONNECTIONS, GATEWAY_HTTP_MAX_KEEPALIVE, GATEWAY_HTTP_TIMEOUT, \
+    HTTP_KEEPALIVE_EXPIRY, KEYCLOAK_HTTP_MAX_CONNECTIONS, KEYCLOAK_HTTP_MAX_KEEPALIVE, KEYCLOAK_HTTP_TIMEOUT
+from services.metrics_service import UPSTREAM_DURATION, UPSTREAM_ERRORS
+from services.tracing_service import span
+
+UPSTREAMS = {
+    "keycloak": (KEYCLOAK_HTTP_MAX_CONNECTIONS, KEYCLOAK_HTTP_MAX_KEEPALIVE, KEYCLOAK_HTTP_TIMEOUT),
+    "gateway": (GATEWAY_HTTP_MAX_CONNECTIONS, GATEWAY_HTTP_MAX_KEEPALIVE, GATEWAY_HTTP_TIMEOUT),
+}
+
+clients: dict[str, httpx.AsyncClient] = {}
+
+
+class InstrumentedTransport(httpx.AsyncHTTPTransport):
+    """Record the latency, failures and a trace span of every call made to an upstream."""
+
+    def __init__(self, upstream: str, **kwargs):
+        super().__init__(**kwargs)
+        self.upstream = upstream
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        start = time.perf_counter()
+        try:
+            with span(f"http {self.upstream}", method=request.method, url=str(request.url.copy_with(query=None))) as current:
+                if current is not None:
+                    # W3C trace context: the upstream call becomes a child of this span
+                    request.headers["traceparent"] = current.traceparent()
+                response = await super().handle_async_request(request)
+                if current is not None:
+                    current.set_attribute("status", response.status_code)
+        except httpx.HTTPError:
+            UPSTREAM_ERRORS.inc(self.upstream)
+            raise
+        finally:
+            UPSTREAM_DURATION.observe(time.perf_counter() - start, self.upstream)
+        if response.status_code >= 500:
+            UPSTREAM_ERRORS.inc(self.upstream)
+        return response
+
+
+def create_http_client(upstream: str) -> httpx.AsyncClient:
+    max_connections, max_keepalive, timeout = UPSTREAMS[upstream]
+    limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+    )
+    return httpx.AsyncClient(
+        # The pool lives in the transport, so the limits are given to it
+        transport=InstrumentedTransport(upstream, limits=limits),
+        timeout=httpx.Timeout(timeout)
+    )
+
+
+def get_http_client(upstream: str) -> httpx.AsyncClient:
+    client = clients.get(upstream)
+    if client is None or client.is_closed:
+        client = create_http_client(upstream)
+        clients[upstream] = client
+    return client
+
+
+def get_keycloak_client() -> httpx.AsyncClient:
+    return get_http_client("keycloak")
+
+
+def get_gateway_client() -> httpx.AsyncClient:
+    return get_http_client("gateway")
+
+
+def open_http_clients() -> None:
+    for upstream in UPSTREAMS:
+        get_http_client(upstream)
+
+
+async def close_http_clients() -> None:
+    for client in list(clients.values()):
+        await client.aclose()
+    clients.clear()
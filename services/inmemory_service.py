@@ -1,14 +1,56 @@
-import redis
-from config.config import REDIS_DB, REDIS_HOST, REDIS_PASSWORD, REDIS_PORT
+import time
 
+import redis.asyncio as redis
+from config.config import REDIS_DB, REDIS_HOST, REDIS_PASSWORD, REDIS_POOL_SIZE, REDIS_POOL_TIMEOUT, REDIS_PORT
+from services.metrics_service import REDIS_DURATION, REDIS_ERRORS
+from services.tracing_service import span
 
-def get_redis_api_db():
-    return redis.Redis(
+r: redis.Redis | None = None
+
+
+class InstrumentedRedis(redis.Redis):
+    """Redis client recording the latency, errors and a trace span of each command."""
+
+    async def execute_command(self, *args, **options):
+        command = str(args[0]).upper()
+        start = time.perf_counter()
+        try:
+            with span(f"redis {command}"):
+                return await super().execute_command(*args, **options)
+        except redis.RedisError:
+            REDIS_ERRORS.inc(command)
+            raise
+        finally:
+            REDIS_DURATION.observe(time.perf_counter() - start, command)
+
+
+def create_redis_api_db() -> redis.Redis:
+    pool = redis.BlockingConnectionPool(
         host=REDIS_HOST,
         db=REDIS_DB,
         port=REDIS_PORT,
         password=REDIS_PASSWORD,
-        decode_responses=True
+        decode_responses=False,
+        max_connections=REDIS_POOL_SIZE,
+        timeout=REDIS_POOL_TIMEOUT
     )
+    return InstrumentedRedis(connection_pool=pool)
+
+
+def get_redis_api_db() -> redis.Redis:
+    global r
+    if r is None:
+        r = create_redis_api_db()
+    return r
+
+
+def open_redis_api_db() -> None:
+    get_redis_api_db()
+
 
-r = get_redis_api_db()
\ No newline at end of file
+async def close_redis_api_db() -> None:
+    global r
+    if r is not None:
+        await r.aclose()
+        await r.connection_pool.disconnect()
+        r = None
@@ -1,10 +1,24 @@
+import inspect
 import logging
+from typing import AsyncIterator, Iterator
 from urllib.request import Request
 
+import orjson
 from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
 from models.item_model import Item
+from pymongo.errors import PyMongoError
+from repositories.item_indexes import has_collscan
+from schemas.item_schema import ITEM_FIELDS, ITEM_VIEWS
+from config.config import ITEM_PAGE_LIMIT, ITEM_STREAM_BATCH_SIZE
+from utils.cursor_util import decode_cursor, encode_cursor
+from utils.log_util import sampled_debug
+from services.tracing_service import span
+from services.profiling_service import profile_thread_call
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
+
 def create_item(new_item, repository) -> str:
     try:
         new_uuid = repository.create_item(new_item)
@@ -15,12 +29,67 @@ def create_item(new_item, repository) -> str:
 
     return new_uuid
 
+def get_purchase_filters(name: str | None) -> dict:
+    return {
+        "name": name
+    }
+
+def get_unassigned_filters(entity_uuid: str) -> dict:
+    now = int(datetime.now().timestamp())
+    return {
+        "entity_uuid": entity_uuid,
+        "user_uuid": {"$eq": None, "$exists": True},
+        "iat": {"$lt": now},
+        "exp": {"$gt": now},
+    }
+
+def get_assigned_filters(entity_uuid: str) -> dict:
+    now = int(datetime.now().timestamp())
+    return {
+        "entity_uuid": entity_uuid,
+        "user_uuid": {"$ne": None, "$exists": True},
+        "iat": { "$lt": now },
+        "exp": { "$gt": now },
+    }
+
+def get_expired_filters(entity_uuid: str) -> dict:
+    now = int(datetime.now().timestamp())
+    return {
+        "entity_uuid": entity_uuid,
+        "iat": {"$lt": now},
+        "exp": {"$lt": now}
+    }
+
+def get_mine_filters(user_uuid: str) -> dict:
+    now = int(datetime.now().timestamp())
+    return {
+        "iat": { "$lt": now },
+        "exp": { "$gt": now },
+        "user_uuid": user_uuid
+    }
+
+def get_licence_lookup_filters(user_uuid: str) -> dict:
+    # Like /mine, plus the licences that have not started yet: the licence cache schedules a
+    # refresh for their start instead of waiting for a miss
+    now = int(datetime.now().timestamp())
+    return {
+        "exp": { "$gt": now },
+        "user_uuid": user_uuid
+    }
+
+# One sample query per list endpoint, used to check their plans against the declared indexes
+ENDPOINT_QUERIES = {
+    "purchase": lambda: get_purchase_filters("sample"),
+    "unassigned": lambda: get_unassigned_filters("sample"),
+    "assigned": lambda: get_assigned_filters("sample"),
+    "expired": lambda: get_expired_filters("sample"),
+    "mine": lambda: get_mine_filters("sample")
+}
+
 def get_items(filters, repository) -> list[Item]:
-    logging.info("Getting all items")
+    sampled_debug(logger, "Getting all items")
     #try:
     items = repository.list_items(filters)
-    logging.info(f"Found {len(items)} items")
-    logging.info(items)
     try:
         if not isinstance(items, list):
             raise TypeError("The method list_items did not return a list.")
@@ -30,6 +99,72 @@ def get_items(filters, repository) -> list[Item]:
     return items
 
 
+async def call_repository(method, *args):
+    with span(f"mongo {getattr(method, '__name__', 'call')}"):
+        if inspect.iscoroutinefunction(method):
+            return await method(*args)
+        # Blocking drivers run in the threadpool so one slow query does not stall the event loop
+        return await run_in_threadpool(profile_thread_call, method, *args)
+
+
+def resolve_item_fields(fields: str | None, view: str | None) -> list[str] | None:
+    if fields is None and view is None:
+        return None
+    if view is not None and view not in ITEM_VIEWS:
+        raise HTTPException(status_code=400, detail=f"Unknown view: {view}")
+    requested = list(ITEM_VIEWS[view]) if view is not None else ["uuid"]
+    for field in (fields or "").split(","):
+        field = field.strip()
+        if not field or field in requested:
+            continue
+        if field not in ITEM_FIELDS:
+            raise HTTPException(status_code=400, detail=f"Unknown field: {field}")
+        requested.append(field)
+    return requested
+
+
+async def get_items_async(filters, repository, fields: list[str] | None = None) -> list[Item]:
+    sampled_debug(logger, "Getting all items")
+    if fields is None:
+        items = await call_repository(repository.list_items, filters)
+    else:
+        items = await call_repository(repository.list_items, filters, fields)
+    try:
+        if not isinstance(items, list):
+            raise TypeError("The method list_items did not return a list.")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An error occurred while get the list of items: {e}")
+    sampled_debug(logger, "Found %d items", len(items))
+
+    return items
+
+
+async def ensure_item_indexes(repository) -> None:
+    try:
+        await call_repository(repository.ensure_indexes)
+    except PyMongoError as e:
+        logger.warning("Could not ensure item indexes: %s", e)
+
+
+async def find_collscan_endpoints(repository) -> list[str]:
+    endpoints = []
+    for endpoint, query in ENDPOINT_QUERIES.items():
+        plan = await call_repository(repository.explain_items, query(), ITEM_PAGE_LIMIT + 1)
+        if has_collscan(plan):
+            endpoints.append(endpoint)
+    return endpoints
+
+
+async def check_item_query_plans(repository) -> None:
+    try:
+        endpoints = await find_collscan_endpoints(repository)
+    except PyMongoError as e:
+        logger.warning("Could not check item query plans: %s", e)
+        return
+    for endpoint in endpoints:
+        logger.warning("Query plan of /%s is a COLLSCAN", endpoint)
+
+
 def get_item(uuid: str, repository) -> Item:
     try:
         item = repository.get_item(uuid)
@@ -41,6 +176,60 @@ def get_item(uuid: str, repository) -> Item:
 
     return item
 
+async def get_items_page(filters, repository, limit: int, cursor: str | None = None,
+                         fields: list[str] | None = None) -> tuple[list[Item], str | None]:
+    sampled_debug(logger, "Getting a page of items")
+    if cursor is not None:
+        try:
+            after = decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        filters = dict(filters, _id={"$gt": after})
+    # One extra item tells whether there is a next page
+    items = await call_repository(repository.list_items, filters, fields, limit + 1)
+    try:
+        if not isinstance(items, list):
+            raise TypeError("The method list_items did not return a list.")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An error occurred while get the list of items: {e}")
+
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor(items[-1]["uuid"])
+    return items, next_cursor
+
+
+def ndjson_lines(items: list) -> bytes:
+    return b"".join(orjson.dumps(item) + b"\n" for item in items)
+
+
+async def stream_ndjson_async(batches) -> AsyncIterator[bytes]:
+    async for batch in batches:
+        yield ndjson_lines(batch)
+
+
+def stream_items_ndjson(filters, repository, fields: list[str] | None = None,
+                        batch_size: int = ITEM_STREAM_BATCH_SIZE) -> Iterator[bytes] | AsyncIterator[bytes]:
+    """One NDJSON chunk per cursor batch, so memory stays bounded by the batch size."""
+    batches = repository.iter_item_batches(filters, fields, batch_size)
+    if inspect.isasyncgen(batches):
+        return stream_ndjson_async(batches)
+    # A blocking cursor is iterated in the threadpool by StreamingResponse
+    return (ndjson_lines(batch) for batch in batches)
+
+
+async def get_item_async(uuid: str, repository) -> Item:
+    try:
+        item = await call_repository(repository.get_item, uuid)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An error occurred while get item: {e}")
+
+    if item is None:
+        raise HTTPException(status_code=404, detail="Item not found")
+
+    return item
+
 def update_item(uuid: str, item_update: Item, repository) -> None:
     try:
         repository.update_item(uuid, item_update)
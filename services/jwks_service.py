@@ -0,0 +1,92 @@
+import asyncio
+import logging
+import time
+
+import httpx
+import jwt
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+
+class JwksUnavailableError(Exception):
+    """Raised when the realm signing keys cannot be obtained for a token."""
+
+
+class JwksCache:
+    def __init__(self, url: str, ttl: int, min_refresh_interval: int):
+        self.url = url
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.keys = {}
+        self.fetched_at = 0.0
+        self.lock = asyncio.Lock()
+
+    def is_expired(self) -> bool:
+        return time.monotonic() - self.fetched_at >= self.ttl
+
+    def can_refresh(self) -> bool:
+        return time.monotonic() - self.fetched_at >= self.min_refresh_interval
+
+    async def refresh(self, client: httpx.AsyncClient) -> None:
+        logger.info("JWKS : refresh %s", self.url)
+        try:
+            response = await client.get(self.url)
+        except httpx.HTTPError as e:
+            raise JwksUnavailableError(f"JWKS request failed: {e}")
+        if response.status_code != 200:
+            raise JwksUnavailableError(f"JWKS request failed with status {response.status_code}")
+        self.keys = parse_jwks(response.json())
+        self.fetched_at = time.monotonic()
+
+    async def get_key(self, kid: str, client: httpx.AsyncClient) -> jwt.PyJWK:
+        if not self.keys or self.is_expired():
+            async with self.lock:
+                if not self.keys or self.is_expired():
+                    await self.refresh(client)
+        key = self.keys.get(kid)
+        if key is None and self.can_refresh():
+            # Unknown kid: the realm keys have probably been rotated
+            async with self.lock:
+                if kid not in self.keys and self.can_refresh():
+                    await self.refresh(client)
+            key = self.keys.get(kid)
+        if key is None:
+            raise JwksUnavailableError(f"No signing key found for kid {kid}")
+        return key
+
+
+def parse_jwks(jwks: dict) -> dict:
+    keys = {}
+    for jwk in jwks.get("keys", []):
+        if jwk.get("use", "sig") != "sig" or "kid" not in jwk:
+            continue
+        try:
+            keys[jwk["kid"]] = jwt.PyJWK(jwk)
+        except jwt.PyJWTError as e:
+            logger.warning("JWKS : ignoring key %s: %s", jwk.get('kid'), e)
+    return keys
+
+
+async def decode_token(token: str, jwks: JwksCache, client: httpx.AsyncClient, audience: str, leeway: int = 0) -> dict:
+    try:
+        header = jwt.get_unverified_header(token)
+    except jwt.DecodeError:
+        raise JwksUnavailableError("Token is not a JWT")
+
+    key = await jwks.get_key(header.get("kid"), client)
+    try:
+        return jwt.decode(
+            token,
+            key.key,
+            algorithms=[key.algorithm_name],
+            audience=audience,
+            leeway=leeway,
+            options={"require": ["exp", "iat"]}
+        )
+    except (jwt.ExpiredSignatureError, jwt.ImmatureSignatureError):
+        raise HTTPException(status_code=401, detail="Token is not active")
+    except jwt.InvalidAudienceError:
+        raise HTTPException(status_code=401, detail="Token is not valid for this audience")
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=401, detail="Token manquant ou invalide")
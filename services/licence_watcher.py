@@ -0,0 +1,184 @@
+import asyncio
+import logging
+from contextlib import suppress
+from typing import AsyncIterator
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import OperationFailure
+
+from config.config import DB_COLLECTION, DB_DATABASE, DB_URL, LICENCE_REFRESH_CACHE, LICENCE_WATCH_RETRY_DELAY, \
+    MISSING_LICENCE_CACHE, TOKEN_CACHE
+from middlewares.token_middleware import licences_cache_key
+from services.inmemory_service import get_redis_api_db
+from utils.codec_util import decode, encode
+
+logger = logging.getLogger(__name__)
+
+RESUME_TOKEN_KEY = "licences:watch:resume"
+LICENCE_OPERATIONS = ("insert", "update", "replace", "delete")
+# ChangeStreamFatalError / ChangeStreamHistoryLost: the stored resume token is no longer in the oplog
+HISTORY_LOST_CODES = (280, 286)
+
+
+class MotorChangeSource:
+    """
+    Change stream on the licence collection, with pre-images when the collection has them enabled
+    (MongoDB 6.0+, changeStreamPreAndPostImages). Without them, deletes drop every cached licence.
+    """
+
+    def __init__(self, url: str, database: str, collection: str):
+        self.client = AsyncIOMotorClient(url)
+        self.collection = self.client[database][collection]
+
+    async def __call__(self, resume_after: dict | None = None) -> AsyncIterator[dict]:
+        async with self.collection.watch(
+            full_document="updateLookup",
+            full_document_before_change="whenAvailable",
+            resume_after=resume_after
+        ) as stream:
+            async for event in stream:
+                yield event
+
+    def close(self) -> None:
+        self.client.close()
+
+
+class InMemoryChangeSource:
+    """Change source fed by publish(), for tests and local runs without a replica set."""
+
+    def __init__(self):
+        self.events: list[dict] = []
+        self.published = asyncio.Event()
+
+    def publish(self, event: dict) -> None:
+        self.events.append(event)
+        self.published.set()
+
+    async def __call__(self, resume_after: dict | None = None) -> AsyncIterator[dict]:
+        position = 0
+        if resume_after is not None:
+            position = next((i + 1 for i, event in enumerate(self.events) if event["_id"] == resume_after), 0)
+        while True:
+            while position < len(self.events):
+                yield self.events[position]
+                position += 1
+            self.published.clear()
+            await self.published.wait()
+
+    def close(self) -> None:
+        pass
+
+
+def previous_owners(document: dict) -> set[str]:
+    # The assignment history lists the users the licence was assigned to before
+    return {entry["user_uuid"] for entry in document.get("historical") or [] if entry.get("user_uuid")}
+
+
+def affected_users(event: dict) -> set[str] | None:
+    """Users whose cached licences an event touches, or None when they cannot be told apart."""
+    operation = event.get("operationType")
+    if operation not in LICENCE_OPERATIONS:
+        return None
+    users = {
+        document["user_uuid"]
+        for document in (event.get("fullDocument"), event.get("fullDocumentBeforeChange"))
+        if document and document.get("user_uuid")
+    }
+    if operation == "insert" or event.get("fullDocumentBeforeChange") is not None:
+        return users
+    document = event.get("fullDocument")
+    if document is None:
+        return None
+    # Without a pre-image the previous owner is known when the update left it alone, or else from
+    # the assignment history of the document
+    changes = event.get("updateDescription") or {}
+    owner_changed = operation == "replace" or "user_uuid" in (changes.get("updatedFields") or {}) or \
+        "user_uuid" in (changes.get("removedFields") or [])
+    if not owner_changed:
+        return users
+    owners = previous_owners(document)
+    if owners:
+        return users | owners
+    return None
+
+
+class LicenceChangeWatcher:
+    """Tail licence change events and drop the cached licences of the users they touch."""
+
+    def __init__(self, source, retry_delay: float = LICENCE_WATCH_RETRY_DELAY):
+        self.source = source
+        self.retry_delay = retry_delay
+        self.task: asyncio.Task | None = None
+
+    async def load_resume_token(self) -> dict | None:
+        return decode(await get_redis_api_db().get(RESUME_TOKEN_KEY))
+
+    async def save_resume_token(self, resume_token: dict) -> None:
+        await get_redis_api_db().set(RESUME_TOKEN_KEY, encode(resume_token))
+
+    async def clear_resume_token(self) -> None:
+        await get_redis_api_db().delete(RESUME_TOKEN_KEY)
+
+    async def invalidate_users(self, users: set[str]) -> None:
+        logger.info("Licence watcher : invalidating licences of %d user(s)", len(users))
+        await get_redis_api_db().delete(*(licences_cache_key(user) for user in users))
+        TOKEN_CACHE.delete_where(lambda key, value: value[0].get("sub") in users)
+        MISSING_LICENCE_CACHE.delete_where(lambda key, value: key.partition(":")[0] in users)
+        LICENCE_REFRESH_CACHE.delete_where(lambda key, value: value in users)
+
+    async def invalidate_all(self) -> None:
+        r = get_redis_api_db()
+        keys = [key async for key in r.scan_iter(match=licences_cache_key("*"), count=1000)]
+        for start in range(0, len(keys), 1000):
+            await r.delete(*keys[start:start + 1000])
+        TOKEN_CACHE.clear()
+        MISSING_LICENCE_CACHE.clear()
+        LICENCE_REFRESH_CACHE.clear()
+
+    async def handle(self, event: dict) -> None:
+        users = affected_users(event)
+        if users is None:
+            logger.warning("Licence watcher : %s event, dropping all cached licences", event.get('operationType'))
+            await self.invalidate_all()
+        elif users:
+            await self.invalidate_users(users)
+        if event.get("operationType") == "invalidate":
+            # The stream is closed and cannot be resumed after this event
+            await self.clear_resume_token()
+        else:
+            await self.save_resume_token(event["_id"])
+
+    async def watch(self) -> None:
+        resume_token = await self.load_resume_token()
+        try:
+            async for event in self.source(resume_token):
+                await self.handle(event)
+        except OperationFailure as e:
+            if e.code not in HISTORY_LOST_CODES:
+                raise
+            logger.warning("Licence watcher : resume token expired, dropping all cached licences")
+            await self.invalidate_all()
+            await self.clear_resume_token()
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.watch()
+            except Exception as e:
+                logger.warning("Licence watcher : %s, retrying in %ss", e, self.retry_delay)
+                await asyncio.sleep(self.retry_delay)
+
+    def start(self) -> None:
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self.task
+            self.task = None
+        self.source.close()
+
+
+def create_licence_watcher() -> LicenceChangeWatcher:
+    return LicenceChangeWatcher(MotorChangeSource(DB_URL, DB_DATABASE, DB_COLLECTION))
@@ -0,0 +1,64 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable
+
+
+class LocalCache:
+    """Bounded in-process LRU cache whose entries expire at an absolute epoch time."""
+
+    def __init__(self, max_size: int, max_staleness: int):
+        self.max_size = max_size
+        self.max_staleness = max_staleness
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Any | None:
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value = entry
+        if expires_at <= time.time():
+            del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any, exp: int | None = None) -> None:
+        if self.max_size <= 0:
+            return
+        expires_at = time.time() + self.max_staleness
+        if exp is not None:
+            expires_at = min(expires_at, exp)
+        self.entries[key] = (expires_at, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key: str) -> None:
+        self.entries.pop(key, None)
+
+    def delete_where(self, predicate: Callable[[str, Any], bool]) -> int:
+        keys = [key for key, (_, value) in self.entries.items() if predicate(key, value)]
+        for key in keys:
+            del self.entries[key]
+        return len(keys)
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0
+        }
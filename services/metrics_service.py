@@ -0,0 +1,208 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable
+
+# Latency buckets in seconds, from in-process cache hits to slow upstream calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.lock = threading.Lock()
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, *labels, by: float = 1) -> None:
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + by
+
+    def get(self, *labels) -> float:
+        return self.values.get(labels, 0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for labels, value in self.values.items():
+                lines.append(f"{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        # labels -> [per-bucket counts (last one is +Inf), sum]
+        self.values: dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(labels)
+            if series is None:
+                series = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def count(self, *labels) -> int:
+        series = self.values.get(labels)
+        return sum(series[0]) if series else 0
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def time_async(self, *labels):
+        def decorator(func):
+            @wraps(func)
+            async def wrapper(*args, **kwargs):
+                with self.time(*labels):
+                    return await func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for labels, (counts, total) in self.values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    bucket_labels = format_labels(self.labelnames, labels, f'le="{format_value(bound)}"')
+                    lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+                label_text = format_labels(self.labelnames, labels)
+                lines.append(f"{self.name}_sum{label_text} {format_value(total)}")
+                lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+class GaugeCallback:
+    """Gauge read at scrape time from a function returning {label values: value}."""
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: tuple, func: Callable[[], dict]):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.func = func
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for labels, value in self.func().items():
+            lines.append(f"{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}")
+        return lines
+
+
+class CounterCallback(GaugeCallback):
+    """Counter read at scrape time, for totals kept by another component."""
+    type = "counter"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self.metrics for line in metric.render()) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUEST_DURATION = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "Request latency by route", ("method", "route", "status")
+))
+MIDDLEWARE_DURATION = REGISTRY.register(Histogram(
+    "middleware_duration_seconds", "Time spent in the token and licence middlewares", ("middleware",)
+))
+UPSTREAM_DURATION = REGISTRY.register(Histogram(
+    "upstream_request_duration_seconds", "Keycloak and gateway call latency", ("upstream",)
+))
+UPSTREAM_ERRORS = REGISTRY.register(Counter(
+    "upstream_request_errors_total", "Keycloak and gateway calls that failed or answered 5xx", ("upstream",)
+))
+REDIS_DURATION = REGISTRY.register(Histogram(
+    "redis_command_duration_seconds", "Redis command latency", ("command",)
+))
+REDIS_ERRORS = REGISTRY.register(Counter(
+    "redis_command_errors_total", "Redis commands that raised", ("command",)
+))
+MONGO_DURATION = REGISTRY.register(Histogram(
+    "mongo_command_duration_seconds", "MongoDB command latency", ("command",)
+))
+MONGO_ERRORS = REGISTRY.register(Counter(
+    "mongo_command_errors_total", "MongoDB commands that failed", ("command",)
+))
+AUTH_CACHE_LOOKUPS = REGISTRY.register(Counter(
+    "auth_cache_lookups_total", "Token cache lookups by layer (l1, redis) and result (hit, miss)", ("layer", "result")
+))
+LICENCE_REFRESHES = REGISTRY.register(Counter(
+    "licence_refreshes_total", "Licence refreshes by mode (inline, background) and result (ok, error)", ("mode", "result")
+))
+
+
+def register_cache_stats(caches: dict) -> None:
+    """Expose the size and hit ratio of in-process caches, given as {name: LocalCache}."""
+    REGISTRY.register(GaugeCallback(
+        "local_cache_entries", "Entries held by in-process caches", ("cache",),
+        lambda: {(name,): cache.stats()["size"] for name, cache in caches.items()}
+    ))
+    REGISTRY.register(GaugeCallback(
+        "local_cache_hit_ratio", "Hit ratio of in-process caches since start", ("cache",),
+        lambda: {(name,): cache.stats()["hit_ratio"] for name, cache in caches.items()}
+    ))
+
+
+# PoolStatsListener counters that only ever grow, exposed as counters; the others are gauges
+POOL_EVENTS = ("created", "closed", "checked_out", "checkout_failed", "cleared")
+
+
+def register_pool_stats(pool_stats: Callable[[], dict]) -> None:
+    """Expose the MongoDB connection pool stats, read from pool_stats() at scrape time."""
+    REGISTRY.register(GaugeCallback(
+        "mongo_pool_connections", "Connections held by the MongoDB pool, open or checked out (in_use)", ("state",),
+        lambda: {(state,): value for state, value in pool_stats().items() if state in ("open", "in_use")}
+    ))
+    REGISTRY.register(GaugeCallback(
+        "mongo_pool_size_limit", "Configured MongoDB pool size bounds", ("bound",),
+        lambda: {("max",): pool_stats()["max_pool_size"], ("min",): pool_stats()["min_pool_size"]}
+    ))
+    REGISTRY.register(CounterCallback(
+        "mongo_pool_events_total", "MongoDB pool events since start", ("event",),
+        lambda: {(event,): value for event, value in pool_stats().items() if event in POOL_EVENTS}
+    ))
+
+
+def render_metrics() -> str:
+    return REGISTRY.render()
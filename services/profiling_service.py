@@ -0,0 +1,115 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from contextvars import ContextVar
+
+# Deeper call paths are cut off in the collapsed output
+MAX_STACK_DEPTH = 128
+
+# Before 3.12 cProfile hooks a single thread. From 3.12 it is built on sys.monitoring: the request
+# profiler already records every thread, and a second profiler cannot be enabled while it runs
+PER_THREAD_PROFILES = sys.version_info < (3, 12)
+
+# Set by the profiling middleware for the request being profiled: threadpool calls made for it
+# append their own profiler here, to be merged into the request profile
+thread_profiles: ContextVar[list | None] = ContextVar("thread_profiles", default=None)
+
+
+class ProfileStore:
+    """Keep the last profiles taken, by id."""
+
+    def __init__(self, max_size: int = 20):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.profiles: OrderedDict[str, dict] = OrderedDict()
+
+    def add(self, profile_id: str, stats: pstats.Stats, method: str, path: str, duration: float) -> None:
+        with self.lock:
+            self.profiles[profile_id] = {
+                "id": profile_id,
+                "method": method,
+                "path": path,
+                "created": int(time.time()),
+                "duration_ms": round(duration * 1000, 1),
+                "stats": stats
+            }
+            while len(self.profiles) > self.max_size:
+                self.profiles.popitem(last=False)
+
+    def get(self, profile_id: str) -> dict | None:
+        with self.lock:
+            return self.profiles.get(profile_id)
+
+
+def profile_thread_call(func, *args):
+    """
+    Run func from a threadpool worker, under its own profiler when the calling request is profiled
+    and cProfile only sees the thread it was enabled in (Python < 3.12).
+    Never call it on the event loop thread: a second profiler would replace the request one there.
+    """
+    profiles = thread_profiles.get()
+    if profiles is None or not PER_THREAD_PROFILES:
+        return func(*args)
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        return func(*args)
+    finally:
+        profiler.disable()
+        profiles.append(profiler)
+
+
+def frame_label(func: tuple) -> str:
+    filename, line, name = func
+    if filename == "~":
+        # Built-ins are reported as ('~', 0, '<built-in method ...>')
+        return name
+    return f"{os.path.basename(filename)}:{name}:{line}"
+
+
+def collapse_stats(stats: pstats.Stats) -> str:
+    """
+    Render a profile as collapsed stacks ("a;b;c <microseconds>" lines) for flamegraph tools.
+    cProfile only keeps caller/callee pairs: the time of a function called from several
+    places is split between its callers in proportion to the time each of them spent in it.
+    """
+    entries = stats.stats
+    callees = defaultdict(dict)
+    for func, (_, _, _, _, callers) in entries.items():
+        for caller, caller_stats in callers.items():
+            callees[caller][func] = caller_stats[3]
+
+    samples = defaultdict(float)
+
+    def walk(func, stack, share):
+        _, _, own_time, total_time, _ = entries[func]
+        stack = stack + (frame_label(func),)
+        samples[";".join(stack)] += own_time * share
+        if len(stack) >= MAX_STACK_DEPTH:
+            return
+        for callee, time_from_caller in callees[func].items():
+            callee_total = entries[callee][3]
+            if callee_total <= 0 or frame_label(callee) in stack:
+                continue
+            walk(callee, stack, share * min(time_from_caller / callee_total, 1.0))
+
+    for func, (_, _, _, _, callers) in entries.items():
+        if not callers:
+            walk(func, (), 1.0)
+
+    lines = [f"{stack} {round(value * 1e6)}" for stack, value in samples.items() if round(value * 1e6) > 0]
+    return "\n".join(sorted(lines)) + "\n"
+
+
+def render_stats_text(stats: pstats.Stats, limit: int = 50) -> str:
+    stream = io.StringIO()
+    # Printed from a copy so the stored profile keeps its order and stream
+    output = pstats.Stats(stream=stream)
+    output.add(stats)
+    output.sort_stats("cumulative").print_stats(limit)
+    return stream.getvalue()
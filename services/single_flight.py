@@ -0,0 +1,32 @@
+import asyncio
+from typing import Any, Awaitable, Callable
+
+
+class SingleFlight:
+    """Coalesce concurrent calls sharing a key into a single in-flight call."""
+
+    def __init__(self):
+        self.calls: dict[str, asyncio.Task] = {}
+
+    def start(self, key: str, func: Callable[..., Awaitable[Any]], *args) -> asyncio.Task:
+        task = self.calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func(*args))
+            self.calls[key] = task
+            task.add_done_callback(lambda done: self.forget(key, done))
+        return task
+
+    def is_running(self, key: str) -> bool:
+        return key in self.calls
+
+    async def do(self, key: str, func: Callable[..., Awaitable[Any]], *args) -> Any:
+        task = self.start(key, func, *args)
+        # Shielded so a cancelled caller does not cancel the call the others wait on
+        return await asyncio.shield(task)
+
+    def forget(self, key: str, task: asyncio.Task) -> None:
+        if self.calls.get(key) is task:
+            del self.calls[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved even if every waiter went away
+            task.exception()
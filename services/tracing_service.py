@@ -0,0 +1,169 @@
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from functools import wraps
+
+import orjson
+
+TRACEPARENT_PATTERN = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+current_span: ContextVar["Span | None"] = ContextVar("current_span", default=None)
+# Set by configure_tracing; tracing is off while sample_rate is 0 or no exporter is set
+sample_rate = 0.0
+exporter = None
+
+
+class Span:
+    """A timed operation of a trace, current for the code running inside its with block."""
+
+    def __init__(self, name: str, trace_id: str, parent_id: str | None = None, attributes: dict | None = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.attributes = attributes or {}
+        self.status = "ok"
+        self.start = 0
+        self.end = 0
+        self.token = None
+
+    def set_attribute(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_ns": self.start,
+            "duration_ms": (self.end - self.start) / 1e6,
+            "status": self.status,
+            "attributes": self.attributes
+        }
+
+    def __enter__(self) -> "Span":
+        self.start = time.time_ns()
+        self.token = current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> bool:
+        self.end = time.time_ns()
+        current_span.reset(self.token)
+        if exc_value is not None:
+            self.status = "error"
+            self.attributes["error"] = repr(exc_value)
+        if exporter is not None:
+            exporter.export(self)
+        return False
+
+
+class NoopSpan:
+    def __enter__(self) -> None:
+        return None
+
+    def __exit__(self, exc_type, exc_value, traceback) -> bool:
+        return False
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class InMemoryExporter:
+    """Keep the last finished spans, for tests and local inspection."""
+
+    def __init__(self, max_spans: int = 1000):
+        self.spans = deque(maxlen=max_spans)
+
+    def export(self, span: Span) -> None:
+        self.spans.append(span.to_dict())
+
+    def get_trace(self, trace_id: str) -> list[dict]:
+        return [span for span in self.spans if span["trace_id"] == trace_id]
+
+    def clear(self) -> None:
+        self.spans.clear()
+
+    def close(self) -> None:
+        pass
+
+
+class FileExporter:
+    """Append finished spans to a file, one JSON object per line. Meant for local runs."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, "ab")
+
+    def export(self, span: Span) -> None:
+        line = orjson.dumps(span.to_dict(), default=str) + b"\n"
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def create_exporter(kind: str, path: str = "traces.jsonl", max_spans: int = 1000):
+    if kind == "file":
+        return FileExporter(path)
+    return InMemoryExporter(max_spans)
+
+
+def configure_tracing(rate: float, span_exporter) -> None:
+    global sample_rate, exporter
+    sample_rate = rate
+    exporter = span_exporter
+
+
+def is_tracing_enabled() -> bool:
+    return sample_rate > 0 and exporter is not None
+
+
+def parse_traceparent(header: str | None) -> tuple[str, str, bool] | None:
+    match = TRACEPARENT_PATTERN.match(header or "")
+    if match is None or match.group(1) == "0" * 32 or match.group(2) == "0" * 16:
+        return None
+    return match.group(1), match.group(2), bool(int(match.group(3), 16) & 1)
+
+
+def start_trace(name: str, traceparent: str | None = None, **attributes) -> Span | None:
+    """Root span of a request, or None when the request is not sampled."""
+    if not is_tracing_enabled():
+        return None
+    parent = parse_traceparent(traceparent)
+    if parent is not None:
+        # Follow the caller's decision so its trace is either complete or absent
+        trace_id, parent_id, sampled = parent
+    else:
+        trace_id, parent_id, sampled = os.urandom(16).hex(), None, random.random() < sample_rate
+    if not sampled:
+        return None
+    return Span(name, trace_id, parent_id, attributes)
+
+
+def span(name: str, **attributes):
+    # Outside a sampled trace this is a single context variable read
+    parent = current_span.get()
+    if parent is None:
+        return NOOP_SPAN
+    return Span(name, parent.trace_id, parent.span_id, attributes)
+
+
+def traced(name: str):
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
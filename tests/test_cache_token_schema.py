@@ -0,0 +1,102 @@
+from schemas.cache_token_schema import cache_licence_set_serial, cache_token_serial, index_licence_set, \
+    index_licences, licence_roles, licences_refresh_at, list_cache_licence_serial
+
+
+# Test cache_token_serial function
+def test_cache_token_serial():
+    token_info = {
+        "active": True,
+        "sub": "user-123",
+        "preferred_username": "testuser",
+        "email": "test@example.com",
+        "aud": ["karned"],
+        "iat": 1000000,
+        "exp": 1000600,
+        "realm_access": {"roles": ["offline_access"]},
+        "cached_time": 1000001
+    }
+
+    result = cache_token_serial(token_info)
+
+    # Only the fields used by the middlewares are kept
+    assert result == {
+        "sub": "user-123",
+        "preferred_username": "testuser",
+        "email": "test@example.com",
+        "aud": ["karned"],
+        "iat": 1000000,
+        "exp": 1000600,
+        "cached_time": 1000001
+    }
+
+
+# Test list_cache_licence_serial function
+def test_list_cache_licence_serial():
+    licences = [
+        {
+            "uuid": "license-1",
+            "type_uuid": "type-1",
+            "name": "License 1",
+            "iat": 1000000,
+            "exp": 1000600,
+            "entity_uuid": "entity-1",
+            "api_roles": {"api": {"roles": ["read"]}},
+            "app_roles": None,
+            "apps": None
+        }
+    ]
+
+    assert list_cache_licence_serial(licences) == [
+        {"uuid": "license-1", "entity_uuid": "entity-1", "iat": 1000000, "exp": 1000600, "roles": []}
+    ]
+
+
+# Test licence_roles function
+def test_licence_roles():
+    from config.config import API_NAME
+
+    # Roles of this API are flattened and deduplicated
+    licence = {"api_roles": {API_NAME: {"admin": ["read", "write"], "user": ["read"]}, "other": {"x": ["y"]}}}
+    assert licence_roles(licence) == ["read", "write"]
+
+    # Already computed roles are kept as is
+    assert licence_roles({"roles": ["read"]}) == ["read"]
+
+    # Missing or malformed roles
+    assert licence_roles({"api_roles": None}) == []
+    assert licence_roles({"api_roles": ["role1"]}) == []
+
+
+# Test index_licences function
+def test_index_licences():
+    licences = [
+        {"uuid": "license-1", "entity_uuid": "entity-1", "iat": 1, "exp": 2},
+        {"uuid": "license-2", "entity_uuid": "entity-2", "iat": 1, "exp": 2}
+    ]
+    index = index_licences(licences)
+
+    assert list(index.keys()) == ["license-1", "license-2"]
+    assert index["license-2"]["entity_uuid"] == "entity-2"
+    assert index["license-2"]["roles"] == []
+
+
+# Test licences_refresh_at function
+def test_licences_refresh_at():
+    licences = [
+        {"uuid": "license-1", "iat": 100, "exp": 500},
+        {"uuid": "license-2", "iat": 300, "exp": 900}
+    ]
+
+    assert licences_refresh_at(licences, 200) == 300
+    assert licences_refresh_at(licences, 300) == 500
+    assert licences_refresh_at(licences, 900) is None
+    assert licences_refresh_at([], 0) is None
+
+
+# Test licence set serialization round trip
+def test_licence_set_round_trip():
+    licence_set = {"refresh_at": 500, "licences": index_licences([{"uuid": "license-1", "entity_uuid": "entity-1", "iat": 100, "exp": 500}])}
+    cached = cache_licence_set_serial(licence_set)
+
+    assert cached["licences"] == list(licence_set["licences"].values())
+    assert index_licence_set(cached) == licence_set
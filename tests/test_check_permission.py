@@ -55,9 +55,7 @@ def test_check_roles_with_empty_permissions():
 async def test_check_permissions_decorator_with_valid_permissions():
     # Create a mock request
     mock_request = MagicMock(spec=Request)
-    mock_request.state.token_info = {
-        'license_roles': ['admin', 'user']
-    }
+    mock_request.state.licence_roles = ['admin', 'user']
     
     # Create a mock async function
     mock_func = AsyncMock()
@@ -79,9 +77,7 @@ async def test_check_permissions_decorator_with_valid_permissions():
 async def test_check_permissions_decorator_with_invalid_permissions():
     # Create a mock request
     mock_request = MagicMock(spec=Request)
-    mock_request.state.token_info = {
-        'license_roles': ['user', 'editor']
-    }
+    mock_request.state.licence_roles = ['user', 'editor']
     
     # Create a mock async function
     mock_func = AsyncMock()
@@ -98,4 +94,37 @@ async def test_check_permissions_decorator_with_invalid_permissions():
     assert "Insufficient permissions" in excinfo.value.detail
     
     # Verify the function was not called
-    mock_func.assert_not_called()
\ No newline at end of file
+    mock_func.assert_not_called()
+
+# Test the decorator checks the roles the licence middleware stored for the request licence
+@pytest.mark.asyncio
+async def test_check_permissions_after_licence_middleware():
+    from middlewares.licence_middleware import LicenceVerificationMiddleware
+
+    @check_permissions(["write"])
+    async def endpoint(request: Request):
+        return "ok"
+
+    results = []
+
+    async def app(scope, receive, send):
+        try:
+            results.append(await endpoint(Request(scope)))
+        except HTTPException as e:
+            results.append(e.status_code)
+
+    licences = {
+        "license-1": {"uuid": "license-1", "entity_uuid": "entity-1", "iat": 0, "exp": 4102444800, "roles": ["read", "write"]},
+        "license-2": {"uuid": "license-2", "entity_uuid": "entity-1", "iat": 0, "exp": 4102444800, "roles": ["read"]}
+    }
+    for licence_uuid in ("license-1", "license-2"):
+        scope = {
+            "type": "http", "method": "GET", "path": "/license/v1/assigned", "query_string": b"",
+            "headers": [(b"x-license-key", licence_uuid.encode())],
+            "state": {"licenses": licences}
+        }
+        with patch("middlewares.licence_middleware.is_unlicensed_path", return_value=False), \
+                patch("middlewares.licence_middleware.schedule_licences_refresh"):
+            await LicenceVerificationMiddleware(app)(scope, AsyncMock(), AsyncMock())
+
+    assert results == ["ok", 403]
@@ -0,0 +1,38 @@
+import pytest
+
+from utils.codec_util import decode, encode, validate_codec
+
+token_info = {
+    "sub": "user-123",
+    "aud": ["karned", "other_api"],
+    "exp": 1000600,
+    "licenses": [{"uuid": "license-1", "entity_uuid": "entity-1", "iat": 1000000, "exp": 1000600}]
+}
+
+
+# Test encode/decode round trip for every codec
+@pytest.mark.parametrize("codec, version", [("orjson", 1), ("msgpack", 2)])
+def test_encode_decode(codec, version):
+    payload = encode(token_info, codec=codec)
+    assert payload[0] == version
+    assert decode(payload) == token_info
+
+
+# Test decode with empty or unknown payloads
+def test_decode_unknown_version():
+    assert decode(b"") is None
+    assert decode(None) is None
+    assert decode(bytes([99]) + b"{}") is None
+
+
+# Test that the encoded payload is smaller than the previous repr format
+def test_encode_is_compact():
+    assert len(encode(token_info, codec="msgpack")) < len(str(token_info))
+    assert len(encode(token_info, codec="orjson")) < len(str(token_info))
+
+
+# Test an unknown codec is rejected with the accepted names
+def test_validate_codec():
+    assert validate_codec("msgpack") == "msgpack"
+    with pytest.raises(ValueError, match="orjson, msgpack"):
+        validate_codec("json")
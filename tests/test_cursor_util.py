@@ -0,0 +1,17 @@
+import pytest
+
+from utils.cursor_util import decode_cursor, encode_cursor
+
+
+# Test cursor round trip
+def test_cursor_round_trip():
+    cursor = encode_cursor("7f1c2a90-0000-4000-8000-000000000001")
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == "7f1c2a90-0000-4000-8000-000000000001"
+
+
+# Test invalid cursors
+def test_decode_cursor_invalid():
+    for cursor in ("not-a-cursor", encode_cursor("x")[:-3], "e30"):
+        with pytest.raises(ValueError):
+            decode_cursor(cursor)
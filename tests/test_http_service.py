@@ -0,0 +1,26 @@
+import pytest
+import httpx
+
+from services import http_service
+from services.http_service import close_http_clients, get_gateway_client, get_keycloak_client, open_http_clients
+
+
+# Test shared client lifecycle
+@pytest.mark.asyncio
+async def test_http_clients_are_shared_per_upstream():
+    open_http_clients()
+    keycloak = get_keycloak_client()
+    gateway = get_gateway_client()
+
+    # The same pooled client is returned on every call
+    assert isinstance(keycloak, httpx.AsyncClient)
+    assert get_keycloak_client() is keycloak
+    assert gateway is not keycloak
+
+    await close_http_clients()
+    assert keycloak.is_closed
+    assert http_service.clients == {}
+
+    # A client is recreated on demand after shutdown
+    assert not get_keycloak_client().is_closed
+    await close_http_clients()
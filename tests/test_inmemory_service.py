@@ -0,0 +1,21 @@
+import pytest
+import redis.asyncio as redis
+
+from services import inmemory_service
+from services.inmemory_service import close_redis_api_db, get_redis_api_db, open_redis_api_db
+
+
+# Test shared Redis client lifecycle
+@pytest.mark.asyncio
+async def test_redis_api_db_is_shared():
+    open_redis_api_db()
+    client = get_redis_api_db()
+
+    # A single async client backed by one bounded pool
+    assert isinstance(client, redis.Redis)
+    assert get_redis_api_db() is client
+    assert isinstance(client.connection_pool, redis.BlockingConnectionPool)
+    assert client.connection_pool.max_connections == inmemory_service.REDIS_POOL_SIZE
+
+    await close_redis_api_db()
+    assert inmemory_service.r is None
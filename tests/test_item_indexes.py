@@ -0,0 +1,24 @@
+from repositories.item_indexes import ITEM_INDEXES, has_collscan
+
+
+# Test has_collscan function
+def test_has_collscan():
+    # Classic plan using an index
+    ixscan = {"queryPlanner": {"winningPlan": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN", "indexName": "name"}}}}
+    assert has_collscan(ixscan) is False
+
+    # Plain collection scan
+    assert has_collscan({"queryPlanner": {"winningPlan": {"stage": "COLLSCAN"}}}) is True
+
+    # Slot based plan with an $or branch scanning the collection
+    sbe = {"queryPlanner": {"winningPlan": {"queryPlan": {"stage": "OR", "inputStages": [
+        {"stage": "IXSCAN"},
+        {"stage": "COLLSCAN"}
+    ]}}}}
+    assert has_collscan(sbe) is True
+
+
+# Test every index has a stable name
+def test_item_indexes_are_named():
+    names = [index.document["name"] for index in ITEM_INDEXES]
+    assert len(names) == len(set(names))
@@ -0,0 +1,138 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from repositories.item_repository import ItemRepositoryMongo
+from repositories.item_repository_motor import ItemRepositoryMotor
+from repositories.pool_listener import PoolStatsListener
+
+
+# Test that the client is created once and reused
+def test_item_repository_open_once():
+    repo = ItemRepositoryMongo(url="mongodb://localhost:27017/", database="karned", collection="license",
+                               max_pool_size=20, min_pool_size=2)
+
+    with patch("repositories.item_repository.MongoClient") as mock_client:
+        assert repo.open() is repo
+        with repo as entered:
+            assert entered is repo
+        repo.open()
+
+        mock_client.assert_called_once_with(
+            "mongodb://localhost:27017/",
+            maxPoolSize=20,
+            minPoolSize=2,
+            event_listeners=[repo.pool_listener, repo.command_listener]
+        )
+        # Leaving the with block keeps the client open
+        mock_client.return_value.close.assert_not_called()
+
+        repo.close()
+        mock_client.return_value.close.assert_called_once()
+        assert repo.client is None
+
+
+# Test pool statistics
+def test_pool_stats_listener():
+    listener = PoolStatsListener()
+    event = MagicMock()
+
+    listener.connection_created(event)
+    listener.connection_created(event)
+    listener.connection_checked_out(event)
+    listener.connection_checked_out(event)
+    listener.connection_checked_in(event)
+    listener.connection_closed(event)
+    listener.connection_check_out_failed(event)
+
+    stats = listener.stats()
+    assert stats["open"] == 1
+    assert stats["in_use"] == 1
+    assert stats["created"] == 2
+    assert stats["checked_out"] == 2
+    assert stats["closed"] == 1
+    assert stats["checkout_failed"] == 1
+
+    repo = ItemRepositoryMongo(url="mongodb://localhost:27017/", database="karned", collection="license")
+    assert repo.pool_stats()["max_pool_size"] == 100
+
+
+# Test the motor repository awaits the driver
+@pytest.mark.asyncio
+async def test_item_repository_motor_list_items():
+    repo = ItemRepositoryMotor(url="mongodb://localhost:27017/", database="karned", collection="license")
+    document = {
+        "uuid": "item-1", "type_uuid": "type-1", "name": "Item 1", "auto_renew": True, "iat": 1, "exp": 2,
+        "user_uuid": "user-1", "entity_uuid": "entity-1", "historical": [], "sales": []
+    }
+    collection = MagicMock()
+    collection.find.return_value.to_list = AsyncMock(return_value=[document])
+    collection.find_one = AsyncMock(return_value=None)
+    repo.db = {"license": collection}
+
+    items = await repo.list_items({"entity_uuid": "entity-1"})
+    assert [item["uuid"] for item in items] == ["item-1"]
+    projection = collection.find.call_args.args[1]
+    assert projection["_id"] == 0 and projection["uuid"] == {"$toString": "$_id"}
+    assert projection["apps"] == {"$ifNull": ["$apps", None]}
+    # Nested entries are converted field by field too
+    assert projection["sales"]["$map"]["in"]["status"] == {"$toString": "$$entry.status"}
+    assert projection["auto_renew"] == {"$toBool": {"$ifNull": ["$auto_renew", True]}}
+
+    assert await repo.get_item("missing") is None
+
+
+# Test projected listing reads only the requested fields, shaped by Mongo
+def test_item_repository_list_items_projection():
+    repo = ItemRepositoryMongo(url="mongodb://localhost:27017/", database="karned", collection="license")
+    collection = MagicMock()
+    collection.find.return_value = [{"uuid": "item-1", "name": "Item 1", "exp": 2}]
+    repo.db = {"license": collection}
+
+    items = repo.list_items({"entity_uuid": "entity-1"}, ["uuid", "name", "exp"])
+
+    collection.find.assert_called_once_with({"entity_uuid": "entity-1"}, {
+        "_id": 0, "uuid": {"$toString": "$_id"}, "name": {"$toString": "$name"}, "exp": {"$toLong": "$exp"}
+    })
+    assert items == [{"uuid": "item-1", "name": "Item 1", "exp": 2}]
+
+
+# Test a limited listing follows _id order
+def test_item_repository_list_items_limit():
+    repo = ItemRepositoryMongo(url="mongodb://localhost:27017/", database="karned", collection="license")
+    collection = MagicMock()
+    collection.find.return_value.sort.return_value.limit.return_value = [{"uuid": "item-1", "name": "Item 1"}]
+    repo.db = {"license": collection}
+
+    items = repo.list_items({}, ["uuid", "name"], 11)
+
+    collection.find.return_value.sort.assert_called_once_with("_id", 1)
+    collection.find.return_value.sort.return_value.limit.assert_called_once_with(11)
+    assert items == [{"uuid": "item-1", "name": "Item 1"}]
+
+
+# Test batched iteration for streaming
+def test_item_repository_iter_item_batches():
+    repo = ItemRepositoryMongo(url="mongodb://localhost:27017/", database="karned", collection="license")
+    collection = MagicMock()
+    documents = [{"uuid": f"item-{i}", "name": f"Item {i}"} for i in range(5)]
+    collection.find.return_value.sort.return_value.batch_size.return_value = iter(documents)
+    repo.db = {"license": collection}
+
+    batches = list(repo.iter_item_batches({}, ["uuid", "name"], 2))
+
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    assert batches[2] == [{"uuid": "item-4", "name": "Item 4"}]
+    collection.find.return_value.sort.return_value.batch_size.assert_called_once_with(2)
+
+
+@pytest.mark.asyncio
+async def test_item_repository_motor_iter_item_batches():
+    repo = ItemRepositoryMotor(url="mongodb://localhost:27017/", database="karned", collection="license")
+    collection = MagicMock()
+    cursor = collection.find.return_value.sort.return_value.batch_size.return_value
+    cursor.to_list = AsyncMock(side_effect=[[{"uuid": "item-1"}, {"uuid": "item-2"}], [{"uuid": "item-3"}], []])
+    repo.db = {"license": collection}
+
+    batches = [batch async for batch in repo.iter_item_batches({}, ["uuid"], 2)]
+
+    assert batches == [[{"uuid": "item-1"}, {"uuid": "item-2"}], [{"uuid": "item-3"}]]
@@ -1,9 +1,11 @@
 import pytest
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 from datetime import datetime
 from fastapi import HTTPException
 
-from services.items_service import get_item, get_items
+from services.items_service import get_item, get_item_async, get_items, get_items_async, get_mine_filters, \
+    resolve_item_fields, get_items_page, stream_items_ndjson, get_assigned_filters, get_expired_filters, get_unassigned_filters, ensure_item_indexes, \
+    find_collscan_endpoints
 
 # Mock data for tests
 mock_items = [
@@ -79,3 +81,150 @@ def test_get_item(mock_repo):
     assert excinfo.value.status_code == 404
     assert excinfo.value.detail == "Item not found"
     mock_repo.get_item.assert_called_once_with("non-existing")
+
+# Test get_mine_filters function
+def test_get_mine_filters():
+    filters = get_mine_filters("user-1")
+
+    assert filters["user_uuid"] == "user-1"
+    assert filters["iat"]["$lt"] == filters["exp"]["$gt"]
+
+# Test get_items_async with a blocking repository
+@pytest.mark.asyncio
+async def test_get_items_async_sync_repository(mock_repo):
+    items = await get_items_async({"name": "Item 1"}, mock_repo)
+    assert items == mock_items
+    mock_repo.list_items.assert_called_once_with({"name": "Item 1"})
+
+# Test get_items_async and get_item_async with an async repository
+@pytest.mark.asyncio
+async def test_items_async_async_repository():
+    repo = MagicMock()
+    repo.list_items = AsyncMock(return_value=mock_items)
+    repo.get_item = AsyncMock(return_value=mock_items[0])
+
+    assert await get_items_async({}, repo) == mock_items
+    repo.list_items.assert_awaited_once_with({})
+    assert await get_item_async("item-1", repo) == mock_items[0]
+
+    # Missing item
+    repo.get_item.return_value = None
+    with pytest.raises(HTTPException) as excinfo:
+        await get_item_async("non-existing", repo)
+    assert excinfo.value.status_code == 404
+
+    # Repository returning something other than a list
+    repo.list_items.return_value = None
+    with pytest.raises(HTTPException) as excinfo:
+        await get_items_async({}, repo)
+    assert excinfo.value.status_code == 500
+
+# Test resolve_item_fields function
+def test_resolve_item_fields():
+    # No projection requested
+    assert resolve_item_fields(None, None) is None
+
+    # Explicit fields always include the uuid
+    assert resolve_item_fields("name, exp", None) == ["uuid", "name", "exp"]
+
+    # A view can be extended with extra fields
+    assert resolve_item_fields("user_uuid,name", "summary") == ["uuid", "type_uuid", "name", "iat", "exp", "user_uuid"]
+
+    with pytest.raises(HTTPException) as excinfo:
+        resolve_item_fields("password", None)
+    assert excinfo.value.status_code == 400
+
+    with pytest.raises(HTTPException) as excinfo:
+        resolve_item_fields(None, "unknown")
+    assert excinfo.value.status_code == 400
+
+# Test get_items_async forwards the projection
+@pytest.mark.asyncio
+async def test_get_items_async_with_fields(mock_repo):
+    await get_items_async({}, mock_repo, ["uuid", "name"])
+    mock_repo.list_items.assert_called_once_with({}, ["uuid", "name"])
+
+# Test the entity list filters
+def test_entity_filters():
+    unassigned = get_unassigned_filters("entity-1")
+    assert unassigned["entity_uuid"] == "entity-1"
+    assert unassigned["user_uuid"] == {"$eq": None, "$exists": True}
+    assert unassigned["iat"]["$lt"] == unassigned["exp"]["$gt"]
+
+    assigned = get_assigned_filters("entity-1")
+    assert assigned["user_uuid"] == {"$ne": None, "$exists": True}
+
+    expired = get_expired_filters("entity-1")
+    assert expired["exp"]["$lt"] == expired["iat"]["$lt"]
+
+# Test ensure_item_indexes does not fail the startup
+@pytest.mark.asyncio
+async def test_ensure_item_indexes():
+    from pymongo.errors import ServerSelectionTimeoutError
+    repo = MagicMock()
+    await ensure_item_indexes(repo)
+    repo.ensure_indexes.assert_called_once()
+
+    repo.ensure_indexes.side_effect = ServerSelectionTimeoutError("no server")
+    await ensure_item_indexes(repo)
+
+# Test find_collscan_endpoints function
+@pytest.mark.asyncio
+async def test_find_collscan_endpoints():
+    def explain(filters, limit):
+        stage = "COLLSCAN" if "name" in filters else "IXSCAN"
+        return {"queryPlanner": {"winningPlan": {"stage": stage}}}
+
+    repo = MagicMock()
+    repo.explain_items.side_effect = explain
+    assert await find_collscan_endpoints(repo) == ["purchase"]
+    assert repo.explain_items.call_count == 5
+
+# Test get_items_page function
+@pytest.mark.asyncio
+async def test_get_items_page():
+    from utils.cursor_util import decode_cursor
+    repo = MagicMock()
+    repo.list_items.return_value = [{"uuid": f"item-{i}"} for i in range(3)]
+
+    # More items than the limit: a cursor on the last returned item
+    items, next_cursor = await get_items_page({"entity_uuid": "entity-1"}, repo, 2)
+    assert [item["uuid"] for item in items] == ["item-0", "item-1"]
+    assert decode_cursor(next_cursor) == "item-1"
+    repo.list_items.assert_called_once_with({"entity_uuid": "entity-1"}, None, 3)
+
+    # Following the cursor continues after the last _id
+    repo.reset_mock()
+    repo.list_items.return_value = [{"uuid": "item-2"}]
+    items, next_cursor = await get_items_page({"entity_uuid": "entity-1"}, repo, 2, next_cursor, ["uuid"])
+    assert items == [{"uuid": "item-2"}]
+    assert next_cursor is None
+    repo.list_items.assert_called_once_with({"entity_uuid": "entity-1", "_id": {"$gt": "item-1"}}, ["uuid"], 3)
+
+    # Tampered cursor
+    with pytest.raises(HTTPException) as excinfo:
+        await get_items_page({}, repo, 2, "not-a-cursor")
+    assert excinfo.value.status_code == 400
+
+# Test stream_items_ndjson with a blocking repository
+def test_stream_items_ndjson_sync_repository():
+    repo = MagicMock()
+    repo.iter_item_batches.return_value = iter([[{"uuid": "item-1"}, {"uuid": "item-2"}], [{"uuid": "item-3"}]])
+
+    chunks = list(stream_items_ndjson({"entity_uuid": "entity-1"}, repo, ["uuid"], 2))
+
+    assert chunks == [b'{"uuid":"item-1"}\n{"uuid":"item-2"}\n', b'{"uuid":"item-3"}\n']
+    repo.iter_item_batches.assert_called_once_with({"entity_uuid": "entity-1"}, ["uuid"], 2)
+
+# Test stream_items_ndjson with an async repository
+@pytest.mark.asyncio
+async def test_stream_items_ndjson_async_repository():
+    async def batches(filters, fields, batch_size):
+        yield [{"uuid": "item-1"}]
+        yield [{"uuid": "item-2"}]
+
+    repo = MagicMock()
+    repo.iter_item_batches = batches
+
+    chunks = [chunk async for chunk in stream_items_ndjson({}, repo)]
+    assert chunks == [b'{"uuid":"item-1"}\n', b'{"uuid":"item-2"}\n']
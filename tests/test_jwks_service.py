@@ -0,0 +1,124 @@
+import json
+import time
+import pytest
+import jwt
+from unittest.mock import AsyncMock, MagicMock
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import HTTPException
+
+from services.jwks_service import JwksCache, JwksUnavailableError, decode_token, parse_jwks
+
+# Signing keys for tests
+private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+other_private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+def make_jwk(key, kid):
+    jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(key.public_key()))
+    jwk.update({"kid": kid, "use": "sig", "alg": "RS256"})
+    return jwk
+
+
+def make_token(key=private_key, kid="kid-1", **claims):
+    now = int(time.time())
+    payload = {"sub": "user-123", "aud": "karned", "iat": now - 10, "exp": now + 3600}
+    payload.update(claims)
+    return jwt.encode(payload, key, algorithm="RS256", headers={"kid": kid})
+
+
+def mock_jwks_response(*jwks):
+    response = MagicMock()
+    response.status_code = 200
+    response.json.return_value = {"keys": list(jwks)}
+    return response
+
+
+def mock_client(response):
+    client = MagicMock()
+    client.get = AsyncMock(return_value=response)
+    return client
+
+
+# Test parse_jwks function
+def test_parse_jwks():
+    jwks = {
+        "keys": [
+            make_jwk(private_key, "kid-1"),
+            dict(make_jwk(other_private_key, "kid-enc"), use="enc"),
+            {"kty": "RSA", "kid": "broken"}
+        ]
+    }
+    keys = parse_jwks(jwks)
+    assert list(keys.keys()) == ["kid-1"]
+
+
+# Test JwksCache key lookup and rotation
+@pytest.mark.asyncio
+async def test_jwks_cache_get_key():
+    cache = JwksCache(url="http://keycloak/certs", ttl=3600, min_refresh_interval=0)
+    client = mock_client(mock_jwks_response(make_jwk(private_key, "kid-1")))
+
+    # First lookup fetches the keys
+    assert (await cache.get_key("kid-1", client)).key_id == "kid-1"
+    client.get.assert_called_once_with("http://keycloak/certs")
+
+    # Second lookup is served from the cache
+    await cache.get_key("kid-1", client)
+    assert client.get.call_count == 1
+
+    # Unknown kid triggers a refresh (key rotation)
+    client.get.return_value = mock_jwks_response(make_jwk(other_private_key, "kid-2"))
+    assert (await cache.get_key("kid-2", client)).key_id == "kid-2"
+    assert client.get.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_jwks_cache_unknown_kid_is_rate_limited():
+    cache = JwksCache(url="http://keycloak/certs", ttl=3600, min_refresh_interval=60)
+    client = mock_client(mock_jwks_response(make_jwk(private_key, "kid-1")))
+    await cache.get_key("kid-1", client)
+
+    # Refresh is not allowed again so soon: the unknown kid is rejected without a new request
+    with pytest.raises(JwksUnavailableError):
+        await cache.get_key("kid-unknown", client)
+    assert client.get.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_jwks_cache_refresh_failure():
+    cache = JwksCache(url="http://keycloak/certs", ttl=3600, min_refresh_interval=0)
+    client = mock_client(MagicMock(status_code=503))
+
+    with pytest.raises(JwksUnavailableError):
+        await cache.get_key("kid-1", client)
+
+
+# Test decode_token function
+@pytest.mark.asyncio
+async def test_decode_token():
+    cache = JwksCache(url="http://keycloak/certs", ttl=3600, min_refresh_interval=0)
+    client = mock_client(mock_jwks_response(make_jwk(private_key, "kid-1")))
+
+    # Valid token
+    claims = await decode_token(make_token(), cache, client, audience="karned")
+    assert claims["sub"] == "user-123"
+
+    # Expired token
+    with pytest.raises(HTTPException) as excinfo:
+        await decode_token(make_token(exp=int(time.time()) - 60), cache, client, audience="karned")
+    assert excinfo.value.status_code == 401
+    assert excinfo.value.detail == "Token is not active"
+
+    # Wrong audience
+    with pytest.raises(HTTPException) as excinfo:
+        await decode_token(make_token(aud="other_api"), cache, client, audience="karned")
+    assert excinfo.value.detail == "Token is not valid for this audience"
+
+    # Signed by a key that does not match the published kid
+    with pytest.raises(HTTPException) as excinfo:
+        await decode_token(make_token(key=other_private_key), cache, client, audience="karned")
+    assert excinfo.value.status_code == 401
+
+    # Opaque tokens cannot be verified locally
+    with pytest.raises(JwksUnavailableError):
+        await decode_token("not-a-jwt", cache, client, audience="karned")
@@ -8,10 +8,27 @@ from middlewares.licence_middleware import (
     is_headers_licence_present,
     check_headers_licence,
     is_licence_found,
+    extract_entity,
     filter_licences,
+    get_licences,
+    get_licences_from_gateway,
+    get_licences_from_repository,
+    prepare_licences,
+    refresh_licences,
+    licences_refresh_ahead,
+    schedule_licences_refresh,
+    check_licence,
     LicenceVerificationMiddleware
 )
 
+@pytest.fixture(autouse=True)
+def licence_caches():
+    # Isolate the negative and refresh caches between tests
+    from services.local_cache import LocalCache
+    with patch("middlewares.licence_middleware.MISSING_LICENCE_CACHE", LocalCache(max_size=100, max_staleness=60)), \
+         patch("middlewares.licence_middleware.LICENCE_REFRESH_CACHE", LocalCache(max_size=100, max_staleness=10)):
+        yield
+
 # Test extract_licence function
 def test_extract_licence():
     # Create a mock request with a license header
@@ -60,12 +77,15 @@ def test_check_headers_licence():
 
 # Test is_licence_found function
 def test_is_licence_found():
-    # Create a mock request with licenses in state
+    import time
+    now = int(time.time())
+
+    # Create a mock request with indexed licenses in state
     mock_request = MagicMock(spec=Request)
-    mock_request.state.licenses = [
-        {"uuid": "license-1", "name": "License 1"},
-        {"uuid": "license-2", "name": "License 2"}
-    ]
+    mock_request.state.licenses = {
+        "license-1": {"uuid": "license-1", "entity_uuid": "entity-1", "iat": now - 60, "exp": now + 3600},
+        "license-2": {"uuid": "license-2", "entity_uuid": "entity-1", "iat": now - 60, "exp": now - 1}
+    }
 
     # Test with existing license
     result = is_licence_found(mock_request, "license-1")
@@ -75,11 +95,33 @@ def test_is_licence_found():
     result = is_licence_found(mock_request, "license-3")
     assert result is False
 
+    # Test with a license that expired since the cache was filled
+    result = is_licence_found(mock_request, "license-2")
+    assert result is False
+
+    # Test with a cached license that has not started yet
+    mock_request.state.licenses["license-3"] = {"uuid": "license-3", "entity_uuid": "entity-1", "iat": now + 60, "exp": now + 3600}
+    result = is_licence_found(mock_request, "license-3")
+    assert result is False
+
     # Test with no licenses in state
     mock_request.state.licenses = None
     result = is_licence_found(mock_request, "license-1")
     assert result is False
 
+# Test extract_entity function
+def test_extract_entity():
+    mock_request = MagicMock(spec=Request)
+    mock_request.state.licenses = {"license-1": {"uuid": "license-1", "entity_uuid": "entity-1"}}
+
+    mock_request.state.licence_uuid = "license-1"
+    assert extract_entity(mock_request) == "entity-1"
+
+    mock_request.state.licence_uuid = "license-2"
+    with pytest.raises(HTTPException) as excinfo:
+        extract_entity(mock_request)
+    assert excinfo.value.status_code == 500
+
 # Test filter_licences function
 def test_filter_licences():
     from datetime import datetime, timezone
@@ -145,17 +187,284 @@ def test_filter_licences():
     assert "app_roles" in filtered[0]
     assert "apps" in filtered[0]
 
+    # Licences starting later can be kept, expired ones never are
+    filtered = filter_licences(licenses, include_future=True)
+    assert [lic["uuid"] for lic in filtered] == ["license-1", "license-3"]
+
+# Test get_licences function
+@pytest.mark.asyncio
+async def test_get_licences_from_repository_mode():
+    licences = [{"uuid": "license-1"}]
+    with patch("middlewares.licence_middleware.LICENCE_LOOKUP", "repository"), \
+         patch("middlewares.licence_middleware.get_licences_from_repository", return_value=licences) as mock_repo, \
+         patch("middlewares.licence_middleware.get_licences_from_gateway") as mock_gateway:
+        result = await get_licences("test-token", "user-123")
+
+        assert result == licences
+        mock_repo.assert_called_once_with("user-123")
+        mock_gateway.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_get_licences_from_gateway_mode():
+    licences = [{"uuid": "license-1"}]
+    with patch("middlewares.licence_middleware.LICENCE_LOOKUP", "gateway"), \
+         patch("middlewares.licence_middleware.get_licences_from_repository") as mock_repo, \
+         patch("middlewares.licence_middleware.get_licences_from_gateway", return_value=licences) as mock_gateway:
+        result = await get_licences("test-token", "user-123")
+
+        assert result == licences
+        mock_gateway.assert_called_once_with("test-token")
+        mock_repo.assert_not_called()
+
+# Test get_licences_from_gateway follows the pages of /mine
+@pytest.mark.asyncio
+async def test_get_licences_from_gateway():
+    first = MagicMock(status_code=200)
+    first.json.return_value = {"data": [{"uuid": "license-1"}], "next_cursor": "cursor-1"}
+    last = MagicMock(status_code=200)
+    last.json.return_value = {"data": [{"uuid": "license-2"}], "next_cursor": None}
+    client = MagicMock()
+    client.get = AsyncMock(side_effect=[first, last])
+
+    with patch("middlewares.licence_middleware.get_gateway_client", return_value=client):
+        result = await get_licences_from_gateway("test-token")
+
+    assert result == [{"uuid": "license-1"}, {"uuid": "license-2"}]
+    assert client.get.call_count == 2
+    assert client.get.call_args.kwargs["params"]["cursor"] == "cursor-1"
+
+    # Upstream failure
+    client.get = AsyncMock(return_value=MagicMock(status_code=502))
+    with patch("middlewares.licence_middleware.get_gateway_client", return_value=client):
+        with pytest.raises(HTTPException) as excinfo:
+            await get_licences_from_gateway("test-token")
+    assert excinfo.value.status_code == 500
+
+# Test get_licences_from_repository function
+@pytest.mark.asyncio
+async def test_get_licences_from_repository():
+    mock_repo = MagicMock()
+    mock_repo.open.return_value = mock_repo
+    mock_repo.list_items.return_value = [{"uuid": "license-1"}]
+
+    with patch("middlewares.licence_middleware.ITEM_REPO", mock_repo):
+        result = await get_licences_from_repository("user-123")
+
+    assert result == [{"uuid": "license-1"}]
+    filters = mock_repo.list_items.call_args[0][0]
+    assert filters["user_uuid"] == "user-123"
+    # Licences starting later are read too, so their start is a refresh boundary
+    assert "iat" not in filters
+    assert "$gt" in filters["exp"]
+    # Only the fields the licence set is built from are read
+    fields = mock_repo.list_items.call_args[0][1]
+    assert "historical" not in fields and "sales" not in fields
+    assert {"uuid", "iat", "exp", "entity_uuid", "api_roles"} <= set(fields)
+
+# Test prepare_licences function
+@pytest.mark.asyncio
+async def test_prepare_licences():
+    import time
+    now = int(time.time())
+    licences = [
+        {"uuid": "license-1", "type_uuid": "t", "name": "n", "iat": now - 60, "exp": now + 3600, "entity_uuid": "entity-1"},
+        {"uuid": "license-2", "type_uuid": "t", "name": "n", "iat": now + 1800, "exp": now + 7200, "entity_uuid": "entity-1"},
+        {"uuid": "license-3", "type_uuid": "t", "name": "n", "iat": now - 60, "exp": now + 10, "entity_uuid": "entity-1"},
+        {"uuid": "license-4", "type_uuid": "t", "name": "n", "iat": now - 60, "exp": now - 10, "entity_uuid": "entity-1"}
+    ]
+
+    with patch("middlewares.licence_middleware.get_licences", return_value=licences), \
+         patch("middlewares.licence_middleware.LICENCE_REFRESH_AHEAD", 300):
+        licence_set = await prepare_licences("test-token", "user-123")
+
+    # Future licences are cached, expired ones are dropped
+    assert list(licence_set["licences"]) == ["license-1", "license-2", "license-3"]
+    # The next boundary is the future licence starting; the one expiring inside the refresh window is skipped
+    assert licence_set["refresh_at"] == now + 1800
+
+# Test refresh_licences function
+@pytest.mark.asyncio
+async def test_refresh_licences():
+    mock_request = MagicMock(spec=Request)
+    mock_request.state.token = "test-token"
+    mock_request.state.user_uuid = "user-123"
+    mock_request.state.token_info = {"user_uuid": "user-123", "exp": 1000600}
+    index = {"license-1": {"uuid": "license-1", "entity_uuid": "entity-1", "iat": 1, "exp": 1000600, "roles": []}}
+    licence_set = {"refresh_at": 1000600, "licences": index}
+    mock_redis = MagicMock()
+
+    with patch("middlewares.licence_middleware.prepare_licences", return_value=licence_set) as mock_prepare, \
+         patch("middlewares.licence_middleware.get_redis_api_db", return_value=mock_redis), \
+         patch("middlewares.licence_middleware.write_cache_licences") as mock_write:
+        await refresh_licences(mock_request)
+
+        mock_prepare.assert_called_once_with("test-token", "user-123")
+        # The licence set is stored in state, then written back alone under the user's key
+        assert mock_request.state.licenses == index
+        assert mock_request.state.licences_refresh_at == 1000600
+        mock_write.assert_called_once_with(mock_redis, "test-token", "user-123", licence_set, 1000600)
+
+# Test licences_refresh_ahead function
+def test_licences_refresh_ahead():
+    with patch("middlewares.licence_middleware.LICENCE_REFRESH_AHEAD", 300):
+        aheads = {licences_refresh_ahead(f"user-{i}") for i in range(100)}
+
+    # Spread over the second half of the window, stable per user
+    assert all(150 <= ahead <= 300 for ahead in aheads)
+    assert len(aheads) > 10
+    with patch("middlewares.licence_middleware.LICENCE_REFRESH_AHEAD", 300):
+        assert licences_refresh_ahead("user-1") == licences_refresh_ahead("user-1")
+
+# Test schedule_licences_refresh function
+@pytest.mark.asyncio
+async def test_schedule_licences_refresh():
+    import asyncio
+    import time
+    now = int(time.time())
+    mock_request = MagicMock(spec=Request)
+    mock_request.state.token = "test-token"
+    mock_request.state.user_uuid = "user-123"
+    mock_request.state.token_info = {"exp": now + 600}
+
+    with patch("middlewares.licence_middleware.refresh_licences_in_background") as mock_refresh:
+        # Boundary far away: nothing to do
+        mock_request.state.licences_refresh_at = now + 3600
+        schedule_licences_refresh(mock_request)
+        # No boundary at all
+        mock_request.state.licences_refresh_at = None
+        schedule_licences_refresh(mock_request)
+        mock_refresh.assert_not_called()
+
+        # Boundary within the refresh window: one refresh for concurrent requests
+        mock_request.state.licences_refresh_at = now + 10
+        schedule_licences_refresh(mock_request)
+        schedule_licences_refresh(mock_request)
+        await asyncio.sleep(0)
+        mock_refresh.assert_called_once_with("test-token", "user-123", now + 600)
+
+# Test check_licence function
+@pytest.mark.asyncio
+async def test_check_licence_found():
+    mock_request = MagicMock(spec=Request)
+    mock_request.state.licenses = {"license-1": {"uuid": "license-1", "iat": 0, "exp": 4102444800}}
+
+    with patch("middlewares.licence_middleware.refresh_licences") as mock_refresh:
+        await check_licence(mock_request, "license-1")
+        mock_refresh.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_check_licence_unknown_is_negatively_cached():
+    mock_request = MagicMock(spec=Request)
+    mock_request.state.token = "test-token"
+    mock_request.state.user_uuid = "user-123"
+    mock_request.state.licenses = {}
+
+    with patch("middlewares.licence_middleware.refresh_licences") as mock_refresh:
+        # First miss refreshes the licences once
+        with pytest.raises(HTTPException) as excinfo:
+            await check_licence(mock_request, "wrong-licence")
+        assert excinfo.value.status_code == 403
+        assert excinfo.value.detail == "Licence not found"
+        mock_refresh.assert_called_once()
+
+        # Same unknown licence again: rejected without a new refresh
+        with pytest.raises(HTTPException):
+            await check_licence(mock_request, "wrong-licence")
+        mock_refresh.assert_called_once()
+
+        # Another unknown licence within the refresh interval: still no refresh
+        with pytest.raises(HTTPException):
+            await check_licence(mock_request, "other-licence")
+        mock_refresh.assert_called_once()
+
+@pytest.mark.asyncio
+async def test_check_licence_found_after_refresh():
+    mock_request = MagicMock(spec=Request)
+    mock_request.state.token = "test-token"
+    mock_request.state.user_uuid = "user-123"
+    mock_request.state.licenses = {}
+
+    async def refresh(request):
+        request.state.licenses = {"license-1": {"uuid": "license-1", "iat": 0, "exp": 4102444800}}
+
+    with patch("middlewares.licence_middleware.refresh_licences", side_effect=refresh) as mock_refresh:
+        await check_licence(mock_request, "license-1")
+        mock_refresh.assert_called_once()
+
+def make_licence_request(licenses=None):
+    from types import SimpleNamespace
+    request = MagicMock(spec=Request)
+    request.state = SimpleNamespace(token="test-token", user_uuid="user-123", token_info={"exp": 4102444800},
+                                    licenses=licenses, licences_refresh_at=None)
+    return request
+
+@pytest.mark.asyncio
+async def test_check_licence_concurrent_cold_start():
+    import asyncio
+    index = {"license-1": {"uuid": "license-1", "iat": 0, "exp": 4102444800}}
+    requests = [make_licence_request(), make_licence_request()]
+
+    async def prepare(token, user_uuid):
+        await asyncio.sleep(0.01)
+        return {"refresh_at": None, "licences": index}
+
+    with patch("middlewares.licence_middleware.prepare_licences", side_effect=prepare) as mock_prepare, \
+         patch("middlewares.licence_middleware.get_redis_api_db"), \
+         patch("middlewares.licence_middleware.write_cache_licences"):
+        # Both requests for a new token share one lookup and both pass
+        await asyncio.gather(*(check_licence(request, "license-1") for request in requests))
+        mock_prepare.assert_called_once()
+        assert all(request.state.licenses == index for request in requests)
+
+        # Nothing was negatively cached: the licence set missing again later is reloaded
+        await check_licence(make_licence_request(), "license-1")
+        assert mock_prepare.call_count == 2
+
+@pytest.mark.asyncio
+async def test_check_licence_after_invalidation():
+    index = {"license-1": {"uuid": "license-1", "iat": 0, "exp": 4102444800}}
+
+    with patch("middlewares.licence_middleware.prepare_licences",
+               return_value={"refresh_at": None, "licences": index}) as mock_prepare, \
+         patch("middlewares.licence_middleware.get_redis_api_db"), \
+         patch("middlewares.licence_middleware.write_cache_licences"):
+        # A refresh for an unknown licence starts the debounce interval
+        with pytest.raises(HTTPException):
+            await check_licence(make_licence_request({}), "license-2")
+        assert mock_prepare.call_count == 1
+
+        # The licences entry is dropped within the interval: the next request still loads it
+        await check_licence(make_licence_request(), "license-1")
+        assert mock_prepare.call_count == 2
+
+def make_scope(path, headers=None, state=None):
+    return {
+        "type": "http",
+        "method": "GET",
+        "path": path,
+        "query_string": b"",
+        "headers": [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()],
+        "state": state or {}
+    }
+
+async def call_middleware(middleware, scope):
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    await middleware(scope, receive, send)
+    return messages
+
 # Test LicenceVerificationMiddleware
 @pytest.mark.asyncio
 async def test_licence_verification_middleware_unprotected_path():
-    # Create mock app and request
+    # Create mock app and scope
     mock_app = AsyncMock()
-    mock_request = MagicMock(spec=Request)
-    mock_request.url.path = "/docs"  # Typically an unprotected path
-
-    # Create mock response
-    mock_response = MagicMock()
-    mock_app.return_value = mock_response
+    scope = make_scope("/docs")  # Typically an unprotected path
 
     # Create middleware instance
     middleware = LicenceVerificationMiddleware(mock_app)
@@ -163,10 +472,43 @@ async def test_licence_verification_middleware_unprotected_path():
     # Mock is_unprotected_path to return True
     with patch("middlewares.licence_middleware.is_unprotected_path", return_value=True):
         with patch("middlewares.licence_middleware.is_unlicensed_path", return_value=False):
-            # Call dispatch
-            response = await middleware.dispatch(mock_request, mock_app)
+            messages = await call_middleware(middleware, scope)
+
+            # Verify that the downstream app received the untouched scope
+            mock_app.assert_called_once()
+            assert mock_app.call_args[0][0] is scope
+            assert messages == []
+
+# Test LicenceVerificationMiddleware with a known licence
+@pytest.mark.asyncio
+async def test_licence_verification_middleware_protected_path():
+    mock_app = AsyncMock()
+    scope = make_scope(
+        "/license/v1/assigned",
+        {"X-License-Key": "license-1"},
+        {"licenses": {"license-1": {"uuid": "license-1", "entity_uuid": "entity-1", "iat": 0, "exp": 4102444800, "roles": ["read"]}}}
+    )
+    middleware = LicenceVerificationMiddleware(mock_app)
+
+    with patch("middlewares.licence_middleware.refresh_licences") as mock_refresh:
+        await call_middleware(middleware, scope)
+
+        # The licence is already in state: no refresh needed
+        mock_refresh.assert_not_called()
+        assert scope["state"]["licence_uuid"] == "license-1"
+        assert scope["state"]["entity_uuid"] == "entity-1"
+        assert scope["state"]["licence_roles"] == ["read"]
+        mock_app.assert_called_once()
+
+# Test LicenceVerificationMiddleware with missing header
+@pytest.mark.asyncio
+async def test_licence_verification_middleware_missing_header():
+    mock_app = AsyncMock()
+    scope = make_scope("/license/v1/assigned")
+    middleware = LicenceVerificationMiddleware(mock_app)
+
+    messages = await call_middleware(middleware, scope)
 
-            # Verify response
-            assert response == mock_response
-            # Verify that call_next was called with the request
-            mock_app.assert_called_once_with(mock_request)
+    assert messages[0]["status"] == 403
+    assert messages[1]["body"] == b'{"detail":"Licence header missing"}'
+    mock_app.assert_not_called()
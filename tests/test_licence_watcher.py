@@ -0,0 +1,158 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+from pymongo.errors import OperationFailure
+
+from middlewares.token_middleware import licences_cache_key
+from services.licence_watcher import InMemoryChangeSource, LicenceChangeWatcher, RESUME_TOKEN_KEY, affected_users
+from services.local_cache import LocalCache
+from utils.codec_util import encode
+
+
+@pytest.fixture
+def mock_redis():
+    mock_redis = MagicMock()
+    mock_redis.get = AsyncMock(return_value=None)
+    mock_redis.set = AsyncMock()
+    mock_redis.delete = AsyncMock()
+    with patch("services.licence_watcher.get_redis_api_db", return_value=mock_redis):
+        yield mock_redis
+
+
+@pytest.fixture
+def caches():
+    token_cache = LocalCache(max_size=100, max_staleness=30)
+    missing_cache = LocalCache(max_size=100, max_staleness=60)
+    refresh_cache = LocalCache(max_size=100, max_staleness=10)
+    with patch("services.licence_watcher.TOKEN_CACHE", token_cache), \
+         patch("services.licence_watcher.MISSING_LICENCE_CACHE", missing_cache), \
+         patch("services.licence_watcher.LICENCE_REFRESH_CACHE", refresh_cache):
+        yield token_cache, missing_cache, refresh_cache
+
+
+def update_event(resume, user_uuid, before=None, fields=None):
+    event = {
+        "_id": {"_data": resume},
+        "operationType": "update",
+        "fullDocument": {"_id": "license-1", "user_uuid": user_uuid},
+        "updateDescription": {"updatedFields": fields or {"exp": 1}, "removedFields": []}
+    }
+    if before is not None:
+        event["fullDocumentBeforeChange"] = {"_id": "license-1", "user_uuid": before}
+    return event
+
+
+# Test affected_users function
+def test_affected_users():
+    # Assignment with a pre-image: old and new owners
+    assert affected_users(update_event("1", "user-2", before="user-1", fields={"user_uuid": "user-2"})) == {"user-1", "user-2"}
+
+    # Update that does not change the owner, without a pre-image
+    assert affected_users(update_event("1", "user-1")) == {"user-1"}
+
+    # Owner changed but the previous one is unknown
+    assert affected_users(update_event("1", None, fields={"user_uuid": None})) is None
+
+    # Owner changed without a pre-image: previous owners come from the assignment history
+    event = update_event("1", "user-3", fields={"user_uuid": "user-3"})
+    event["fullDocument"]["historical"] = [{"iat": 1, "exp": 2, "user_uuid": "user-1"}, {"iat": 2, "exp": 3, "user_uuid": "user-2"}]
+    assert affected_users(event) == {"user-1", "user-2", "user-3"}
+    event["fullDocument"]["user_uuid"] = None
+    assert affected_users(event) == {"user-1", "user-2"}
+
+    # Replaces may change the owner too
+    replace = {"operationType": "replace", "fullDocument": {"user_uuid": "user-2", "historical": [{"user_uuid": "user-1"}]}}
+    assert affected_users(replace) == {"user-1", "user-2"}
+    assert affected_users({"operationType": "replace", "fullDocument": {"user_uuid": "user-2"}}) is None
+
+    # Inserts only concern the new document
+    assert affected_users({"operationType": "insert", "fullDocument": {"user_uuid": "user-1"}}) == {"user-1"}
+
+    # Deletes need a pre-image
+    assert affected_users({"operationType": "delete", "fullDocumentBeforeChange": {"user_uuid": "user-1"}}) == {"user-1"}
+    assert affected_users({"operationType": "delete"}) is None
+
+    # Collection level events
+    assert affected_users({"operationType": "drop"}) is None
+
+
+# Test event handling
+@pytest.mark.asyncio
+async def test_watcher_handle_invalidates_affected_users(mock_redis, caches):
+    token_cache, missing_cache, refresh_cache = caches
+    token_cache.set("token:1", ({"sub": "user-1"}, None))
+    token_cache.set("token:2", ({"sub": "user-3"}, None))
+    missing_cache.set("user-1:license-9", True)
+    refresh_cache.set("token:1", "user-1")
+    refresh_cache.set("token:2", "user-3")
+    watcher = LicenceChangeWatcher(InMemoryChangeSource())
+
+    await watcher.handle(update_event("1", "user-2", before="user-1", fields={"user_uuid": "user-2"}))
+
+    deleted = set(mock_redis.delete.call_args.args)
+    assert deleted == {licences_cache_key("user-1"), licences_cache_key("user-2")}
+    assert token_cache.get("token:1") is None
+    assert token_cache.get("token:2") is not None
+    assert missing_cache.get("user-1:license-9") is None
+    assert refresh_cache.get("token:1") is None
+    assert refresh_cache.get("token:2") is not None
+    mock_redis.set.assert_called_once_with(RESUME_TOKEN_KEY, encode({"_data": "1"}))
+
+
+@pytest.mark.asyncio
+async def test_watcher_handle_unknown_owner_drops_everything(mock_redis, caches):
+    token_cache, _, _ = caches
+    token_cache.set("token:1", ({"sub": "user-1"}, None))
+
+    async def scan_iter(match, count):
+        for key in (b"licences:user:user-1", b"licences:user:user-2"):
+            yield key
+
+    mock_redis.scan_iter = scan_iter
+    watcher = LicenceChangeWatcher(InMemoryChangeSource())
+    await watcher.handle({"_id": {"_data": "1"}, "operationType": "delete"})
+
+    mock_redis.delete.assert_called_once_with(b"licences:user:user-1", b"licences:user:user-2")
+    assert token_cache.stats()["size"] == 0
+
+
+# Test the watcher loop against the in-memory source, resuming after a restart
+@pytest.mark.asyncio
+async def test_watcher_run_and_resume(mock_redis, caches):
+    source = InMemoryChangeSource()
+    source.publish(update_event("1", "user-1"))
+    watcher = LicenceChangeWatcher(source, retry_delay=0)
+    watcher.start()
+    await asyncio.sleep(0.01)
+
+    source.publish(update_event("2", "user-2"))
+    await asyncio.sleep(0.01)
+    await watcher.stop()
+
+    invalidated = [call.args for call in mock_redis.delete.call_args_list]
+    assert invalidated == [(licences_cache_key("user-1"),), (licences_cache_key("user-2"),)]
+
+    # A new watcher starts after the stored resume token
+    mock_redis.reset_mock()
+    mock_redis.get.return_value = encode({"_data": "1"})
+    source.publish(update_event("3", "user-3"))
+    watcher = LicenceChangeWatcher(source, retry_delay=0)
+    watcher.start()
+    await asyncio.sleep(0.01)
+    await watcher.stop()
+
+    invalidated = [call.args for call in mock_redis.delete.call_args_list]
+    assert invalidated == [(licences_cache_key("user-2"),), (licences_cache_key("user-3"),)]
+
+
+# Test an expired resume token
+@pytest.mark.asyncio
+async def test_watcher_history_lost(mock_redis, caches):
+    def source(resume_after):
+        raise OperationFailure("resume point lost", code=286)
+
+    watcher = LicenceChangeWatcher(MagicMock(side_effect=source))
+    with patch.object(watcher, "invalidate_all", AsyncMock()) as mock_invalidate_all:
+        await watcher.watch()
+        mock_invalidate_all.assert_called_once()
+    mock_redis.delete.assert_called_once_with(RESUME_TOKEN_KEY)
@@ -0,0 +1,69 @@
+from unittest.mock import patch
+
+from services.local_cache import LocalCache
+
+
+# Test get/set and hit/miss counters
+def test_local_cache_get_set():
+    cache = LocalCache(max_size=10, max_staleness=30)
+
+    assert cache.get("key-1") is None
+    cache.set("key-1", {"sub": "user-1"})
+    assert cache.get("key-1") == {"sub": "user-1"}
+
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["hit_ratio"] == 0.5
+
+
+# Test expiry bounded by max staleness and by exp
+def test_local_cache_expiry():
+    cache = LocalCache(max_size=10, max_staleness=30)
+
+    with patch("services.local_cache.time.time", return_value=1000):
+        cache.set("stale", "value")
+        cache.set("expiring", "value", exp=1010)
+
+    with patch("services.local_cache.time.time", return_value=1015):
+        # Still within max staleness, but past the token exp
+        assert cache.get("stale") == "value"
+        assert cache.get("expiring") is None
+
+    with patch("services.local_cache.time.time", return_value=1031):
+        assert cache.get("stale") is None
+
+
+# Test LRU eviction
+def test_local_cache_eviction():
+    cache = LocalCache(max_size=2, max_staleness=30)
+    cache.set("key-1", 1)
+    cache.set("key-2", 2)
+
+    # Touch key-1 so key-2 becomes the least recently used
+    cache.get("key-1")
+    cache.set("key-3", 3)
+
+    assert cache.get("key-2") is None
+    assert cache.get("key-1") == 1
+    assert cache.get("key-3") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+# Test a disabled cache
+def test_local_cache_disabled():
+    cache = LocalCache(max_size=0, max_staleness=30)
+    cache.set("key-1", 1)
+    assert cache.get("key-1") is None
+
+
+# Test deleting the entries matching a predicate
+def test_local_cache_delete_where():
+    cache = LocalCache(max_size=10, max_staleness=30)
+    cache.set("token-1", {"sub": "user-1"})
+    cache.set("token-2", {"sub": "user-2"})
+    cache.set("token-3", {"sub": "user-1"})
+
+    assert cache.delete_where(lambda key, value: value["sub"] == "user-1") == 2
+    assert cache.get("token-1") is None
+    assert cache.get("token-2") == {"sub": "user-2"}
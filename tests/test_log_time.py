@@ -8,33 +8,26 @@ def test_log_time():
     # Create a mock function to decorate
     mock_func = MagicMock(return_value="test result")
     mock_func.__name__ = "mock_func"
-    
+
     # Apply the decorator
     decorated_func = log_time(mock_func)
-    
-    # Mock the logging and time functions
-    with patch('decorators.log_time.logging.info') as mock_logging, \
-         patch('decorators.log_time.time.time', side_effect=[100, 105]):  # Start time, end time
-        
+
+    # Mock the logger and time functions, keeping every sampled event
+    with patch('decorators.log_time.logger') as mock_logger, \
+         patch('utils.log_util.sample_rate', 1.0), \
+         patch('decorators.log_time.time.perf_counter', side_effect=[100, 105]):  # Start time, end time
+
         # Call the decorated function
         result = decorated_func("arg1", kwarg1="value1")
-        
+
         # Verify the result
         assert result == "test result"
-        
+
         # Verify that the original function was called with the correct arguments
         mock_func.assert_called_once_with("arg1", kwarg1="value1")
-        
-        # Verify that logging.info was called twice (start and end)
-        assert mock_logging.call_count == 2
-        
-        # Verify the content of the log messages
-        start_call_args = mock_logging.call_args_list[0][0]
-        assert "mock_func: Start" in start_call_args[0]
-        
-        end_call_args = mock_logging.call_args_list[1][0]
-        assert "mock_func: End" in end_call_args[0]
-        assert "Execution time: 5.0000 seconds" in end_call_args[0]
+
+        # Verify a single lazily formatted debug line
+        mock_logger.debug.assert_called_once_with("%s: Execution time: %.4f seconds", "mock_func", 5)
 
 # Test log_time_async decorator
 @pytest.mark.asyncio
@@ -42,29 +35,36 @@ async def test_log_time_async():
     # Create a mock async function to decorate
     async def mock_async_func(*args, **kwargs):
         return "async test result"
-    
+
     mock_async_func.__name__ = "mock_async_func"
-    
+
     # Apply the decorator
     decorated_func = log_time_async(mock_async_func)
-    
-    # Mock the logging and time functions
-    with patch('decorators.log_time.logging.info') as mock_logging, \
-         patch('decorators.log_time.time.time', side_effect=[200, 207]):  # Start time, end time
-        
+
+    # Mock the logger and time functions, keeping every sampled event
+    with patch('decorators.log_time.logger') as mock_logger, \
+         patch('utils.log_util.sample_rate', 1.0), \
+         patch('decorators.log_time.time.perf_counter', side_effect=[200, 207]):  # Start time, end time
+
         # Call the decorated function
         result = await decorated_func("arg1", kwarg1="value1")
-        
+
         # Verify the result
         assert result == "async test result"
-        
-        # Verify that logging.info was called twice (start and end)
-        assert mock_logging.call_count == 2
-        
-        # Verify the content of the log messages
-        start_call_args = mock_logging.call_args_list[0][0]
-        assert "mock_async_func: Start" in start_call_args[0]
-        
-        end_call_args = mock_logging.call_args_list[1][0]
-        assert "mock_async_func: End" in end_call_args[0]
-        assert "Execution time: 7.0000 seconds" in end_call_args[0]
\ No newline at end of file
+
+        # Verify a single lazily formatted debug line
+        mock_logger.debug.assert_called_once_with("%s: Execution time: %.4f seconds", "mock_async_func", 7)
+
+# Test nothing is logged when debug is off or the event is not sampled
+def test_log_time_disabled():
+    decorated_func = log_time(MagicMock(__name__="mock_func", return_value=None))
+
+    with patch('decorators.log_time.logger') as mock_logger:
+        mock_logger.isEnabledFor.return_value = False
+        decorated_func()
+        mock_logger.debug.assert_not_called()
+
+    with patch('decorators.log_time.logger') as mock_logger, \
+         patch('utils.log_util.sample_rate', 0.0):
+        decorated_func()
+        mock_logger.debug.assert_not_called()
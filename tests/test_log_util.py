@@ -0,0 +1,80 @@
+import json
+import logging
+import pytest
+from unittest.mock import AsyncMock, patch
+
+from middlewares.request_log_middleware import RequestLogMiddleware
+from utils.log_util import StructuredFormatter, annotate_request, configure_logging, parse_levels, request_fields
+
+
+def make_record(msg, *args, fields=None):
+    record = logging.LogRecord("access", logging.INFO, __file__, 1, msg, args, None)
+    if fields is not None:
+        record.fields = fields
+    return record
+
+
+# Test parse_levels function
+def test_parse_levels():
+    assert parse_levels("middlewares=debug, services.jwks_service=WARNING") == {
+        "middlewares": "DEBUG", "services.jwks_service": "WARNING"
+    }
+    assert parse_levels("") == {}
+    assert parse_levels("middlewares") == {}
+
+
+# Test configure_logging applies per-module levels
+def test_configure_logging():
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    try:
+        configure_logging("warning", "tests.module=DEBUG", json=True)
+        assert root.level == logging.WARNING
+        assert logging.getLogger("tests.module").level == logging.DEBUG
+        assert root.handlers[0].formatter.json
+    finally:
+        root.handlers[:] = handlers
+        root.setLevel(level)
+        logging.getLogger("tests.module").setLevel(logging.NOTSET)
+
+
+# Test StructuredFormatter output
+def test_structured_formatter():
+    record = make_record("%s %s", "GET", "/mine", fields={"status": 200})
+
+    assert StructuredFormatter().format(record) == "INFO:access:GET /mine status=200"
+
+    entry = json.loads(StructuredFormatter(json=True).format(record))
+    assert entry["message"] == "GET /mine"
+    assert entry["logger"] == "access"
+    assert entry["status"] == 200
+
+    assert StructuredFormatter().format(make_record("plain")) == "INFO:access:plain"
+
+
+# Test annotate_request outside of a request
+def test_annotate_request_outside_request():
+    annotate_request(user_uuid="user-1")
+    assert request_fields.get() is None
+
+
+# Test the per-request summary line
+@pytest.mark.asyncio
+async def test_request_log_middleware():
+    async def app(scope, receive, send):
+        annotate_request(user_uuid="user-1")
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"{}"})
+
+    send = AsyncMock()
+    middleware = RequestLogMiddleware(app)
+    with patch("middlewares.request_log_middleware.logger") as mock_logger:
+        await middleware({"type": "http", "method": "GET", "path": "/license/v1/mine"}, AsyncMock(), send)
+
+    assert send.call_count == 2
+    mock_logger.info.assert_called_once()
+    fields = mock_logger.info.call_args.kwargs["extra"]["fields"]
+    assert fields["user_uuid"] == "user-1"
+    assert fields["status"] == 200
+    assert fields["path"] == "/license/v1/mine"
+    assert request_fields.get() is None
@@ -56,3 +56,13 @@ def test_root_not_found():
 # def test_assign_license():
 #     response = client.post("/license/v1/assign/some-uuid")
 #     assert response.status_code in (201, 401, 403, 422)
+
+def test_metrics():
+    # /metrics is served without a token, in Prometheus text format
+    client.get("/license/v1/unassigned")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "# TYPE http_request_duration_seconds histogram" in response.text
+    assert 'route="unmatched"' in response.text
+    assert 'local_cache_hit_ratio{cache="token"}' in response.text
@@ -0,0 +1,131 @@
+import pytest
+import httpx
+from unittest.mock import AsyncMock, MagicMock
+
+from middlewares.metrics_middleware import MetricsMiddleware, route_label
+from repositories.command_listener import CommandStatsListener
+from services.http_service import InstrumentedTransport
+from services.metrics_service import Counter, GaugeCallback, Histogram, MONGO_DURATION, MONGO_ERRORS, \
+    REQUEST_DURATION, UPSTREAM_DURATION, UPSTREAM_ERRORS
+
+
+# Test Counter rendering
+def test_counter():
+    counter = Counter("test_total", "Test counter", ("layer", "result"))
+    counter.inc("l1", "hit")
+    counter.inc("l1", "hit")
+    counter.inc("redis", 'mi"ss', by=3)
+
+    assert counter.get("l1", "hit") == 2
+    assert counter.render() == [
+        "# HELP test_total Test counter",
+        "# TYPE test_total counter",
+        'test_total{layer="l1",result="hit"} 2',
+        'test_total{layer="redis",result="mi\\"ss"} 3'
+    ]
+
+
+# Test Histogram buckets are cumulative
+def test_histogram():
+    histogram = Histogram("test_seconds", "Test histogram", ("route",), buckets=(0.1, 1.0))
+    histogram.observe(0.05, "/mine")
+    histogram.observe(0.1, "/mine")
+    histogram.observe(5, "/mine")
+
+    assert histogram.count("/mine") == 3
+    assert histogram.render()[2:] == [
+        'test_seconds_bucket{route="/mine",le="0.1"} 2',
+        'test_seconds_bucket{route="/mine",le="1.0"} 2',
+        'test_seconds_bucket{route="/mine",le="+Inf"} 3',
+        'test_seconds_sum{route="/mine"} 5.15',
+        'test_seconds_count{route="/mine"} 3'
+    ]
+
+
+@pytest.mark.asyncio
+async def test_histogram_time_async():
+    histogram = Histogram("test_seconds", "Test histogram", ("middleware",))
+
+    @histogram.time_async("token")
+    async def verify():
+        raise ValueError("failed")
+
+    with pytest.raises(ValueError):
+        await verify()
+    assert histogram.count("token") == 1
+
+
+# Test GaugeCallback is read at scrape time
+def test_gauge_callback():
+    gauge = GaugeCallback("test_ratio", "Test gauge", ("cache",), lambda: {("token",): 0.5})
+    assert gauge.render()[2] == 'test_ratio{cache="token"} 0.5'
+
+
+# Test the MongoDB pool stats are exposed at scrape time
+def test_register_pool_stats():
+    from unittest.mock import patch
+    from repositories.pool_listener import PoolStatsListener
+    from services.metrics_service import Registry, register_pool_stats
+
+    listener = PoolStatsListener()
+    registry = Registry()
+    with patch("services.metrics_service.REGISTRY", registry):
+        register_pool_stats(lambda: {"max_pool_size": 100, "min_pool_size": 0, **listener.stats()})
+
+    listener.connection_created(None)
+    listener.connection_checked_out(None)
+    output = registry.render()
+
+    assert 'mongo_pool_connections{state="in_use"} 1' in output
+    assert 'mongo_pool_size_limit{bound="max"} 100' in output
+    assert "# TYPE mongo_pool_events_total counter" in output
+    assert 'mongo_pool_events_total{event="created"} 1' in output
+    assert 'event="open"' not in output
+
+
+# Test the request latency middleware
+@pytest.mark.asyncio
+async def test_metrics_middleware():
+    route = MagicMock(path="/license/v1/mine")
+
+    async def app(scope, receive, send):
+        scope["route"] = route
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+
+    before = REQUEST_DURATION.count("GET", "/license/v1/mine", "200")
+    await MetricsMiddleware(app)({"type": "http", "method": "GET", "path": "/license/v1/mine"}, AsyncMock(), AsyncMock())
+
+    assert REQUEST_DURATION.count("GET", "/license/v1/mine", "200") == before + 1
+    assert route_label({}) == "unmatched"
+
+
+# Test upstream calls are timed and failures counted
+@pytest.mark.asyncio
+async def test_instrumented_transport():
+    transport = InstrumentedTransport("test-upstream")
+    request = httpx.Request("GET", "http://keycloak/certs")
+    errors = UPSTREAM_ERRORS.get("test-upstream")
+
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(httpx.AsyncHTTPTransport, "handle_async_request",
+                            AsyncMock(return_value=httpx.Response(503)))
+        await transport.handle_async_request(request)
+        monkeypatch.setattr(httpx.AsyncHTTPTransport, "handle_async_request",
+                            AsyncMock(side_effect=httpx.ConnectError("refused")))
+        with pytest.raises(httpx.ConnectError):
+            await transport.handle_async_request(request)
+
+    assert UPSTREAM_DURATION.count("test-upstream") == 2
+    assert UPSTREAM_ERRORS.get("test-upstream") == errors + 2
+
+
+# Test Mongo command events
+def test_command_stats_listener():
+    listener = CommandStatsListener()
+    count = MONGO_DURATION.count("testFind")
+
+    listener.succeeded(MagicMock(duration_micros=1500, command_name="testFind"))
+    listener.failed(MagicMock(duration_micros=2000, command_name="testFind"))
+
+    assert MONGO_DURATION.count("testFind") == count + 2
+    assert MONGO_ERRORS.get("testFind") == 1
@@ -0,0 +1,153 @@
+import cProfile
+import pstats
+import pytest
+from unittest.mock import AsyncMock
+
+from middlewares.profiling_middleware import ProfilingMiddleware
+from services.profiling_service import ProfileStore, collapse_stats, frame_label, render_stats_text
+
+
+def leaf():
+    return sum(range(20000))
+
+
+def branch():
+    return leaf() + leaf()
+
+
+def profile_branch() -> pstats.Stats:
+    profiler = cProfile.Profile()
+    profiler.enable()
+    branch()
+    profiler.disable()
+    return pstats.Stats(profiler)
+
+
+def http_scope(path="/license/v1/mine", headers=None, query_string=b""):
+    return {"type": "http", "method": "GET", "path": path, "headers": headers or [], "query_string": query_string}
+
+
+async def ok_app(scope, receive, send):
+    leaf()
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"{}"})
+
+
+def response_start(send: AsyncMock) -> dict:
+    return next(call.args[0] for call in send.call_args_list if call.args[0]["type"] == "http.response.start")
+
+
+def response_body(send: AsyncMock) -> bytes:
+    return b"".join(call.args[0].get("body", b"") for call in send.call_args_list if call.args[0]["type"] == "http.response.body")
+
+
+# Test ProfileStore keeps the last profiles
+def test_profile_store():
+    store = ProfileStore(max_size=2)
+    for profile_id in ("a", "b", "c"):
+        store.add(profile_id, None, "GET", "/mine", 0.01)
+
+    assert store.get("a") is None
+    assert store.get("c")["duration_ms"] == 10.0
+
+
+# Test collapsed stacks follow the call tree
+def test_collapse_stats():
+    collapsed = collapse_stats(profile_branch())
+    stacks = [line.rsplit(" ", 1)[0] for line in collapsed.splitlines()]
+    leaf_label = next(stack for stack in stacks if stack.endswith(":leaf:" + str(leaf.__code__.co_firstlineno)))
+
+    assert ":branch:" in leaf_label.split(";")[-2]
+    assert all(int(line.rsplit(" ", 1)[1]) > 0 for line in collapsed.splitlines())
+    assert frame_label(("~", 0, "<built-in method builtins.sum>")) == "<built-in method builtins.sum>"
+    assert "cumulative" in render_stats_text(profile_branch())
+
+
+# Test requests without the secret are not profiled
+@pytest.mark.asyncio
+async def test_profiling_middleware_without_secret():
+    store = ProfileStore()
+    middleware = ProfilingMiddleware(ok_app, secret="s3cret", header="X-Profile-Token", sample_rate=1.0, store=store)
+
+    for headers in ([], [(b"x-profile-token", b"wrong")]):
+        send = AsyncMock()
+        await middleware(http_scope(headers=headers), AsyncMock(), send)
+        assert all(name != b"x-profile-id" for name, _ in response_start(send)["headers"])
+
+    # Profiles are not served without the secret either
+    app = AsyncMock()
+    await ProfilingMiddleware(app, "s3cret", "X-Profile-Token", 1.0, store)(http_scope("/profiles/x"), AsyncMock(), AsyncMock())
+    app.assert_called_once()
+    assert store.profiles == {}
+
+
+# Test a profiled request and retrieving its profile
+@pytest.mark.asyncio
+async def test_profiling_middleware_profile_and_serve():
+    store = ProfileStore()
+    middleware = ProfilingMiddleware(ok_app, secret="s3cret", header="X-Profile-Token", sample_rate=1.0, store=store)
+    headers = [(b"x-profile-token", b"s3cret")]
+
+    send = AsyncMock()
+    await middleware(http_scope(headers=headers), AsyncMock(), send)
+    profile_id = dict(response_start(send)["headers"])[b"x-profile-id"].decode()
+    assert store.get(profile_id)["path"] == "/license/v1/mine"
+    assert not middleware.running
+
+    send = AsyncMock()
+    await middleware(http_scope(f"/profiles/{profile_id}", headers), AsyncMock(), send)
+    assert response_start(send)["status"] == 200
+    assert b":leaf:" in response_body(send)
+
+    send = AsyncMock()
+    await middleware(http_scope(f"/profiles/{profile_id}", headers, b"format=text"), AsyncMock(), send)
+    assert b"cumulative" in response_body(send)
+
+    send = AsyncMock()
+    await middleware(http_scope("/profiles/unknown", headers), AsyncMock(), send)
+    assert response_start(send)["status"] == 404
+
+
+def blocking_query():
+    return sum(range(20000))
+
+
+# Test threadpool calls made for a profiled request are part of its profile
+@pytest.mark.asyncio
+async def test_profiling_middleware_threadpool_calls():
+    from services.items_service import call_repository
+
+    async def threadpool_app(scope, receive, send):
+        await call_repository(blocking_query)
+        await ok_app(scope, receive, send)
+
+    store = ProfileStore()
+    middleware = ProfilingMiddleware(threadpool_app, "s3cret", "X-Profile-Token", 1.0, store)
+    send = AsyncMock()
+    await middleware(http_scope(headers=[(b"x-profile-token", b"s3cret")]), AsyncMock(), send)
+
+    profile_id = dict(response_start(send)["headers"])[b"x-profile-id"].decode()
+    assert ":blocking_query:" in collapse_stats(store.get(profile_id)["stats"])
+
+    # Outside a profiled request the call is not profiled
+    assert await call_repository(blocking_query) == blocking_query()
+
+
+# Test no second profiler is started where cProfile already covers every thread (Python 3.12+)
+@pytest.mark.asyncio
+async def test_profile_thread_call_single_profiler():
+    from unittest.mock import patch
+    from services.profiling_service import profile_thread_call, thread_profiles
+
+    profiles = []
+    token = thread_profiles.set(profiles)
+    try:
+        with patch("services.profiling_service.PER_THREAD_PROFILES", False):
+            assert profile_thread_call(blocking_query) == blocking_query()
+        assert profiles == []
+
+        with patch("services.profiling_service.PER_THREAD_PROFILES", True):
+            profile_thread_call(blocking_query)
+        assert len(profiles) == 1
+    finally:
+        thread_profiles.reset(token)
@@ -0,0 +1,83 @@
+import asyncio
+import pytest
+
+from services.single_flight import SingleFlight
+
+
+# Test that concurrent callers share one call
+@pytest.mark.asyncio
+async def test_single_flight_coalesces_concurrent_calls():
+    flights = SingleFlight()
+    calls = []
+
+    async def fetch(value):
+        calls.append(value)
+        await asyncio.sleep(0.01)
+        return {"sub": value}
+
+    results = await asyncio.gather(*(flights.do("token", fetch, "user-123") for _ in range(10)))
+
+    assert calls == ["user-123"]
+    assert all(result == {"sub": "user-123"} for result in results)
+    assert flights.calls == {}
+
+    # Once finished, a new call goes upstream again
+    await flights.do("token", fetch, "user-123")
+    assert len(calls) == 2
+
+
+# Test that errors are propagated to every waiter
+@pytest.mark.asyncio
+async def test_single_flight_propagates_errors():
+    flights = SingleFlight()
+    calls = []
+
+    async def fail():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream failed")
+
+    results = await asyncio.gather(*(flights.do("token", fail) for _ in range(5)), return_exceptions=True)
+
+    assert len(calls) == 1
+    assert all(isinstance(result, ValueError) for result in results)
+    assert flights.calls == {}
+
+
+# Test that a cancelled waiter does not cancel the shared call
+@pytest.mark.asyncio
+async def test_single_flight_cancelled_waiter():
+    flights = SingleFlight()
+
+    async def fetch():
+        await asyncio.sleep(0.02)
+        return "result"
+
+    first = asyncio.ensure_future(flights.do("token", fetch))
+    second = asyncio.ensure_future(flights.do("token", fetch))
+    await asyncio.sleep(0)
+    first.cancel()
+
+    assert await second == "result"
+    with pytest.raises(asyncio.CancelledError):
+        await first
+
+
+# Test that start runs a call in the background without waiting for it
+@pytest.mark.asyncio
+async def test_single_flight_start():
+    flights = SingleFlight()
+    calls = []
+
+    async def refresh(value):
+        calls.append(value)
+        await asyncio.sleep(0.01)
+
+    task = flights.start("user-123", refresh, "user-123")
+    assert flights.start("user-123", refresh, "user-123") is task
+    assert "user-123" in flights.calls
+
+    await task
+    await asyncio.sleep(0)
+    assert calls == ["user-123"]
+    assert flights.calls == {}
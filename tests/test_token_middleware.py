@@ -1,8 +1,11 @@
+import httpx
 import pytest
 from unittest.mock import MagicMock, patch, AsyncMock
 from fastapi import HTTPException
 from starlette.requests import Request
 
+from schemas.cache_token_schema import cache_token_serial
+from utils.codec_util import encode
 from middlewares.token_middleware import (
     extract_token,
     is_headers_token_present,
@@ -10,11 +13,18 @@ from middlewares.token_middleware import (
     is_token_active,
     is_token_valid_audience,
     generate_state_info,
-    read_cache_token,
+    cache_key,
+    licences_cache_key,
+    extract_subject,
+    read_cache_auth,
     write_cache_token,
+    write_cache_licences,
+    licences_expires_at,
     delete_cache_token,
     prepare_cache_token,
     introspect_token,
+    verify_token,
+    get_auth_info,
     get_token_info,
     refresh_cache_token,
     store_token_info_in_state,
@@ -104,6 +114,24 @@ def test_is_token_active():
     result = is_token_active(token_info)
     assert result is False
 
+    # Test the leeway covers a small clock skew on both ends
+    with patch('middlewares.token_middleware.TOKEN_LEEWAY', 30):
+        assert is_token_active({"iat": now + 10, "exp": now + 3600}) is True
+        assert is_token_active({"iat": now - 3600, "exp": now - 10}) is True
+        assert is_token_active({"iat": now + 60, "exp": now + 3600}) is False
+
+# Test check_token accepts a token issued slightly in the future when TOKEN_LEEWAY allows it
+def test_check_token_leeway():
+    import time
+    now = int(time.time())
+    token_info = {"iat": now + 10, "exp": now + 3600, "aud": "karned"}
+
+    with patch('middlewares.token_middleware.TOKEN_AUDIENCE', 'karned'):
+        with pytest.raises(HTTPException):
+            check_token(token_info)
+        with patch('middlewares.token_middleware.TOKEN_LEEWAY', 30):
+            check_token(token_info)
+
 # Test is_token_valid_audience function
 def test_is_token_valid_audience():
     # Test with valid audience as string
@@ -161,49 +189,186 @@ def test_generate_state_info():
     assert state_info["user_audiences"] == ["api1", "api2"]
     assert state_info["cached_time"] == 1234567890
 
-# Test read_cache_token function
-def test_read_cache_token():
-    # Mock Redis get method
-    with patch('middlewares.token_middleware.r') as mock_redis:
-        # Test with existing cache entry
-        mock_redis.get.return_value = "{'sub': 'user-123', 'exp': 1234567890}"
-        result = read_cache_token("test-token")
-        assert result == {'sub': 'user-123', 'exp': 1234567890}
-        mock_redis.get.assert_called_once_with("test-token")
-
-        # Reset mock
-        mock_redis.reset_mock()
+@pytest.fixture(autouse=True)
+def token_cache():
+    # Isolate the in-process token cache between tests
+    from services.local_cache import LocalCache
+    cache = LocalCache(max_size=100, max_staleness=30)
+    with patch('middlewares.token_middleware.TOKEN_CACHE', cache):
+        yield cache
+
+def mock_redis_client():
+    mock_redis = MagicMock()
+    mock_redis.get = AsyncMock()
+    mock_redis.set = AsyncMock()
+    mock_redis.mget = AsyncMock()
+    mock_redis.delete = AsyncMock()
+    return mock_redis
+
+def make_jwt(sub):
+    import base64, json
+    payload = base64.urlsafe_b64encode(json.dumps({"sub": sub}).encode()).decode().rstrip("=")
+    return f"eyJhbGciOiJSUzI1NiJ9.{payload}.signature"
+
+# Test cache_key function
+def test_cache_key():
+    key = cache_key("eyJhbGciOiJSUzI1NiJ9.payload.signature")
+
+    # Fixed length, stable, and never contains the raw token
+    assert len(key) == len(cache_key("short"))
+    assert key == cache_key("eyJhbGciOiJSUzI1NiJ9.payload.signature")
+    assert "payload" not in key
+
+# Test extract_subject function
+def test_extract_subject():
+    assert extract_subject(make_jwt("user-123")) == "user-123"
+    assert extract_subject("opaque-token") is None
+    assert extract_subject("not.base64!.jwt") is None
+    assert extract_subject(make_jwt(None)) is None
+
+# Test read_cache_auth function
+@pytest.mark.asyncio
+async def test_read_cache_auth():
+    mock_redis = mock_redis_client()
+    token = make_jwt("user-123")
+    licences = [{"uuid": "license-1", "entity_uuid": "entity-1", "iat": 1, "exp": 2, "roles": []}]
+    cached_licences = {"refresh_at": 2, "licences": licences}
+
+    # Test with existing cache entries: one MGET for the token and the user's licences, indexed by uuid
+    mock_redis.mget.return_value = [encode({'sub': 'user-123', 'exp': 1234567890}), encode(cached_licences)]
+    result = await read_cache_auth(mock_redis, token)
+    assert result == ({'sub': 'user-123', 'exp': 1234567890}, {"refresh_at": 2, "licences": {"license-1": licences[0]}})
+    mock_redis.mget.assert_called_once_with(cache_key(token), licences_cache_key("user-123"))
+
+    # Reset mock
+    mock_redis.reset_mock()
+
+    # Test with a cached token without licences
+    mock_redis.mget.return_value = [encode({'sub': 'user-123', 'exp': 1234567890}), None]
+    result = await read_cache_auth(mock_redis, make_jwt("user-123") + "-without-licences")
+    assert result == ({'sub': 'user-123', 'exp': 1234567890}, None)
+
+    # Licences are ignored when the unverified subject does not match the cached token
+    mock_redis.mget.return_value = [encode({'sub': 'user-123', 'exp': 1234567890}), encode(cached_licences)]
+    result = await read_cache_auth(mock_redis, make_jwt("user-456"))
+    assert result == ({'sub': 'user-123', 'exp': 1234567890}, None)
+
+    # Test with non-existing cache entry
+    mock_redis.mget.return_value = [None, None]
+    result = await read_cache_auth(mock_redis, make_jwt("user-789"))
+    assert result == (None, None)
+
+    # A new token keeps the licences of its unverified subject for after verification
+    mock_redis.mget.return_value = [None, encode(cached_licences)]
+    result = await read_cache_auth(mock_redis, make_jwt("user-123") + "-new")
+    assert result == (None, {"refresh_at": 2, "licences": {"license-1": licences[0]}})
+
+    # Opaque tokens only read the token record
+    mock_redis.get.return_value = encode({'sub': 'user-123', 'exp': 1234567890})
+    result = await read_cache_auth(mock_redis, "opaque-token")
+    assert result == ({'sub': 'user-123', 'exp': 1234567890}, None)
+    mock_redis.get.assert_called_once_with(cache_key("opaque-token"))
+
+# Test read_cache_auth is served from the in-process cache
+@pytest.mark.asyncio
+async def test_read_cache_auth_local_hit(token_cache):
+    import time
+    mock_redis = mock_redis_client()
+    token = make_jwt("user-123")
+    exp = int(time.time()) + 600
+    mock_redis.mget.return_value = [encode({'sub': 'user-123', 'exp': exp}), None]
+
+    # First read goes to Redis and fills the in-process cache
+    await read_cache_auth(mock_redis, token)
+    # Second read does not touch Redis
+    result = await read_cache_auth(mock_redis, token)
+    assert result == ({'sub': 'user-123', 'exp': exp}, None)
+    mock_redis.mget.assert_called_once()
+    assert token_cache.stats()["hits"] == 1
+
+    # Writing licences updates the in-process entry without re-reading the token
+    licence_set = {
+        "refresh_at": None,
+        "licences": {"license-1": {"uuid": "license-1", "entity_uuid": "entity-1", "iat": 1, "exp": 2, "roles": []}}
+    }
+    await write_cache_licences(mock_redis, token, "user-123", licence_set, exp)
+    result = await read_cache_auth(mock_redis, token)
+    assert result[1] is licence_set
+    mock_redis.mget.assert_called_once()
 
-        # Test with non-existing cache entry
-        mock_redis.get.return_value = None
-        result = read_cache_token("test-token")
-        assert result is None
-        mock_redis.get.assert_called_once_with("test-token")
+    # Deleting the token evicts it from both tiers, the user's licences are kept
+    await delete_cache_token(mock_redis, token)
+    assert token_cache.get(cache_key(token)) is None
+    mock_redis.delete.assert_called_once_with(cache_key(token))
 
 # Test write_cache_token function
-def test_write_cache_token():
-    # Mock Redis set method and time.time
-    with patch('middlewares.token_middleware.r') as mock_redis, \
-         patch('middlewares.token_middleware.time.time', return_value=1000000):
+@pytest.mark.asyncio
+async def test_write_cache_token():
+    mock_redis = mock_redis_client()
+    # Mock time.time
+    with patch('middlewares.token_middleware.time.time', return_value=1000000):
         # Test with valid expiration
         cache_token = {"exp": 1000600}  # 10 minutes from now
-        write_cache_token("test-token", cache_token)
-        mock_redis.set.assert_called_once_with("test-token", str(cache_token), ex=600)
+        await write_cache_token(mock_redis, "test-token", cache_token)
+        mock_redis.set.assert_called_once_with(cache_key("test-token"), encode(cache_token_serial(cache_token)), ex=600)
 
         # Reset mock
         mock_redis.reset_mock()
 
         # Test with no expiration
         cache_token = {}
-        write_cache_token("test-token", cache_token)
+        await write_cache_token(mock_redis, "test-token", cache_token)
+        mock_redis.set.assert_not_called()
+
+        # Test with an already expired token
+        cache_token = {"exp": 999000}
+        await write_cache_token(mock_redis, "test-token", cache_token)
+        mock_redis.set.assert_not_called()
+
+# Test write_cache_licences function
+@pytest.mark.asyncio
+async def test_write_cache_licences():
+    mock_redis = mock_redis_client()
+    licence = {"uuid": "license-1", "entity_uuid": "entity-1", "iat": 1, "exp": 1000300, "roles": []}
+    licence_set = {"refresh_at": 1000300, "licences": {"license-1": licence}}
+    with patch('middlewares.token_middleware.time.time', return_value=1000000):
+        # The entry expires with the soonest licence boundary
+        await write_cache_licences(mock_redis, "test-token", "user-123", licence_set, 1000600)
+        mock_redis.set.assert_called_once_with(
+            licences_cache_key("user-123"),
+            encode({"refresh_at": 1000300, "licences": [licence]}),
+            ex=300
+        )
+
+        # Or with the token when no licence changes before it expires
+        mock_redis.reset_mock()
+        await write_cache_licences(mock_redis, "test-token", "user-123", dict(licence_set, refresh_at=None), 1000600)
+        assert mock_redis.set.call_args.kwargs["ex"] == 600
+
+        # Without a token expiry nothing is written
+        mock_redis.reset_mock()
+        await write_cache_licences(mock_redis, "test-token", "user-123", licence_set, None)
         mock_redis.set.assert_not_called()
 
+# Test licences_expires_at function
+def test_licences_expires_at():
+    with patch('middlewares.token_middleware.time.time', return_value=1000000):
+        assert licences_expires_at({"refresh_at": 1000300}, 1000600) == 1000300
+        assert licences_expires_at({"refresh_at": None}, 1000600) == 1000600
+        assert licences_expires_at({"refresh_at": None}, None) is None
+
+        # While the change stream watcher runs, the entry outlives the token
+        with patch('middlewares.token_middleware.LICENCE_WATCH_ENABLED', True), \
+             patch('middlewares.token_middleware.LICENCE_WATCH_CACHE_TTL', 86400):
+            assert licences_expires_at({"refresh_at": None}, 1000600) == 1086400
+            assert licences_expires_at({"refresh_at": 1000300}, 1000600) == 1000300
+
 # Test delete_cache_token function
-def test_delete_cache_token():
-    # Mock Redis delete method
-    with patch('middlewares.token_middleware.r') as mock_redis:
-        delete_cache_token("test-token")
-        mock_redis.delete.assert_called_once_with("test-token")
+@pytest.mark.asyncio
+async def test_delete_cache_token():
+    mock_redis = mock_redis_client()
+    await delete_cache_token(mock_redis, "test-token")
+    mock_redis.delete.assert_called_once_with(cache_key("test-token"))
 
 # Test prepare_cache_token function
 def test_prepare_cache_token():
@@ -220,53 +385,107 @@ def test_prepare_cache_token():
         assert result == {"sub": "user-123", "exp": 1000600, "cached_time": 1000000}
 
 # Test introspect_token function
-def test_introspect_token():
-    # Mock httpx.post
-    with patch('middlewares.token_middleware.httpx.post') as mock_post:
+@pytest.mark.asyncio
+async def test_introspect_token():
+    # Mock the shared Keycloak client
+    mock_client = MagicMock()
+    mock_client.post = AsyncMock()
+    with patch('middlewares.token_middleware.get_keycloak_client', return_value=mock_client):
         # Test successful introspection
         mock_response = MagicMock()
         mock_response.status_code = 200
         mock_response.json.return_value = {"active": True, "sub": "user-123"}
-        mock_post.return_value = mock_response
+        mock_client.post.return_value = mock_response
 
-        result = introspect_token("test-token")
+        result = await introspect_token("test-token")
         assert result == {"active": True, "sub": "user-123"}
 
         # Verify the correct URL and data were used
-        mock_post.assert_called_once()
-        args, kwargs = mock_post.call_args
+        mock_client.post.assert_called_once()
+        args, kwargs = mock_client.post.call_args
         assert "token/introspect" in args[0]
         assert kwargs["data"]["token"] == "test-token"
 
         # Reset mock
-        mock_post.reset_mock()
+        mock_client.post.reset_mock()
 
         # Test failed introspection
         mock_response.status_code = 500
-        mock_post.return_value = mock_response
+        mock_client.post.return_value = mock_response
 
         with pytest.raises(HTTPException) as excinfo:
-            introspect_token("test-token")
+            await introspect_token("test-token")
         assert excinfo.value.status_code == 500
         assert excinfo.value.detail == "Keycloak introspection failed"
 
-# Test get_token_info function
-def test_get_token_info():
+        # Test unreachable Keycloak
+        mock_client.post.side_effect = httpx.ConnectError("unreachable")
+
+        with pytest.raises(HTTPException) as excinfo:
+            await introspect_token("test-token")
+        assert excinfo.value.status_code == 500
+
+# Test verify_token function
+@pytest.mark.asyncio
+async def test_verify_token_introspection_mode():
+    with patch('middlewares.token_middleware.TOKEN_VERIFICATION_MODE', 'introspection'), \
+         patch('middlewares.token_middleware.verify_token_locally') as mock_local, \
+         patch('middlewares.token_middleware.introspect_token', return_value={"sub": "user-123"}) as mock_introspect:
+        result = await verify_token("test-token")
+        assert result == {"sub": "user-123"}
+        mock_local.assert_not_called()
+        mock_introspect.assert_called_once_with("test-token")
+
+@pytest.mark.asyncio
+async def test_verify_token_local_mode():
+    with patch('middlewares.token_middleware.TOKEN_VERIFICATION_MODE', 'local'), \
+         patch('middlewares.token_middleware.verify_token_locally', return_value={"sub": "user-123"}) as mock_local, \
+         patch('middlewares.token_middleware.introspect_token') as mock_introspect:
+        result = await verify_token("test-token")
+        assert result == {"sub": "user-123"}
+        mock_local.assert_called_once_with("test-token")
+        mock_introspect.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_verify_token_local_mode_fallback():
+    from services.jwks_service import JwksUnavailableError
+
+    with patch('middlewares.token_middleware.TOKEN_VERIFICATION_MODE', 'local'), \
+         patch('middlewares.token_middleware.verify_token_locally', side_effect=JwksUnavailableError("down")), \
+         patch('middlewares.token_middleware.introspect_token', return_value={"sub": "user-123"}) as mock_introspect:
+        result = await verify_token("test-token")
+        assert result == {"sub": "user-123"}
+        mock_introspect.assert_called_once_with("test-token")
+
+    # An invalid token is rejected without falling back
+    with patch('middlewares.token_middleware.TOKEN_VERIFICATION_MODE', 'local'), \
+         patch('middlewares.token_middleware.verify_token_locally', side_effect=HTTPException(status_code=401, detail="Token is not active")), \
+         patch('middlewares.token_middleware.introspect_token') as mock_introspect:
+        with pytest.raises(HTTPException) as excinfo:
+            await verify_token("test-token")
+        assert excinfo.value.status_code == 401
+        mock_introspect.assert_not_called()
+
+# Test get_auth_info function
+@pytest.mark.asyncio
+async def test_get_auth_info():
     # Test with cached token
-    with patch('middlewares.token_middleware.read_cache_token') as mock_read_cache, \
+    mock_redis = mock_redis_client()
+    with patch('middlewares.token_middleware.get_redis_api_db', return_value=mock_redis), \
+         patch('middlewares.token_middleware.read_cache_auth') as mock_read_cache, \
          patch('middlewares.token_middleware.introspect_token') as mock_introspect, \
          patch('middlewares.token_middleware.prepare_cache_token') as mock_prepare, \
          patch('middlewares.token_middleware.write_cache_token') as mock_write:
 
         # Set up mocks for cached token
-        mock_read_cache.return_value = {"sub": "user-123", "exp": 1000600}
+        mock_read_cache.return_value = ({"sub": "user-123", "exp": 1000600}, [{"uuid": "license-1"}])
 
         # Call the function
-        result = get_token_info("test-token")
+        result = await get_auth_info("test-token")
 
-        # Verify the result and that only read_cache_token was called
-        assert result == {"sub": "user-123", "exp": 1000600}
-        mock_read_cache.assert_called_once_with("test-token")
+        # Verify the result and that only read_cache_auth was called
+        assert result == ({"sub": "user-123", "exp": 1000600}, [{"uuid": "license-1"}])
+        mock_read_cache.assert_called_once_with(mock_redis, "test-token")
         mock_introspect.assert_not_called()
         mock_prepare.assert_not_called()
         mock_write.assert_not_called()
@@ -275,19 +494,71 @@ def test_get_token_info():
         mock_read_cache.reset_mock()
 
         # Test with non-cached token
-        mock_read_cache.return_value = None
+        mock_read_cache.return_value = (None, None)
         mock_introspect.return_value = {"sub": "user-123", "exp": 1000600}
         mock_prepare.return_value = {"sub": "user-123", "exp": 1000600, "cached_time": 1000000}
 
         # Call the function
-        result = get_token_info("test-token")
+        result = await get_auth_info("test-token")
 
         # Verify the result and that all functions were called
-        assert result == {"sub": "user-123", "exp": 1000600}
-        mock_read_cache.assert_called_once_with("test-token")
+        assert result == ({"sub": "user-123", "exp": 1000600}, None)
+        mock_read_cache.assert_called_once_with(mock_redis, "test-token")
         mock_introspect.assert_called_once_with("test-token")
         mock_prepare.assert_called_once_with({"sub": "user-123", "exp": 1000600})
-        mock_write.assert_called_once_with("test-token", {"sub": "user-123", "exp": 1000600, "cached_time": 1000000})
+        mock_write.assert_called_once_with(mock_redis, "test-token", {"sub": "user-123", "exp": 1000600, "cached_time": 1000000}, None)
+
+# Test a new token reuses the user's cached licences
+@pytest.mark.asyncio
+async def test_get_auth_info_new_token_with_cached_licences(token_cache):
+    import time
+    mock_redis = mock_redis_client()
+    exp = int(time.time()) + 600
+    licence = {"uuid": "license-1", "entity_uuid": "entity-1", "iat": 1, "exp": exp, "roles": []}
+    mock_redis.mget.return_value = [None, encode({"refresh_at": None, "licences": [licence]})]
+    token = make_jwt("user-123")
+    expected = {"refresh_at": None, "licences": {"license-1": licence}}
+
+    with patch('middlewares.token_middleware.get_redis_api_db', return_value=mock_redis), \
+         patch('middlewares.token_middleware.verify_token', return_value={"sub": "user-123", "exp": exp}):
+        assert (await get_auth_info(token))[1] == expected
+        # L1 is seeded with the licences: the next request needs neither Redis nor a lookup
+        assert (await get_auth_info(token))[1] == expected
+        mock_redis.mget.assert_called_once()
+
+    # Licences of another subject than the verified one are dropped
+    token_cache.clear()
+    with patch('middlewares.token_middleware.get_redis_api_db', return_value=mock_redis), \
+         patch('middlewares.token_middleware.verify_token', return_value={"sub": "user-456", "exp": exp}):
+        assert (await get_auth_info(make_jwt("user-123") + "-forged"))[1] is None
+
+# Test get_token_info function
+@pytest.mark.asyncio
+async def test_get_token_info():
+    with patch('middlewares.token_middleware.get_auth_info', return_value=({"sub": "user-123"}, None)):
+        result = await get_token_info("test-token")
+        assert result == {"sub": "user-123"}
+
+# Test get_token_info coalesces concurrent misses
+@pytest.mark.asyncio
+async def test_get_token_info_single_flight():
+    import asyncio
+
+    async def slow_verify(token):
+        await asyncio.sleep(0.01)
+        return {"sub": "user-123", "exp": 1000600}
+
+    mock_redis = mock_redis_client()
+    mock_redis.get.return_value = None
+    with patch('middlewares.token_middleware.get_redis_api_db', return_value=mock_redis), \
+         patch('middlewares.token_middleware.verify_token', side_effect=slow_verify) as mock_verify, \
+         patch('middlewares.token_middleware.write_cache_token') as mock_write:
+        results = await asyncio.gather(*(get_token_info("test-token") for _ in range(10)))
+        mock_redis.get.assert_called()
+
+        assert all(result["sub"] == "user-123" for result in results)
+        mock_verify.assert_called_once_with("test-token")
+        mock_write.assert_called_once()
 
 # Test store_token_info_in_state function
 def test_store_token_info_in_state():
@@ -336,13 +607,16 @@ def test_check_token():
         assert excinfo.value.detail == "Token is not valid for this audience"
 
 # Test refresh_cache_token function
-def test_refresh_cache_token():
+@pytest.mark.asyncio
+async def test_refresh_cache_token():
     # Create a mock request
     mock_request = MagicMock(spec=Request)
     mock_request.headers = {"Authorization": "Bearer test-token"}
 
     # Mock all the functions called by refresh_cache_token
-    with patch('middlewares.token_middleware.check_headers_token') as mock_check_headers, \
+    mock_redis = mock_redis_client()
+    with patch('middlewares.token_middleware.get_redis_api_db', return_value=mock_redis), \
+         patch('middlewares.token_middleware.check_headers_token') as mock_check_headers, \
          patch('middlewares.token_middleware.extract_token', return_value="test-token") as mock_extract, \
          patch('middlewares.token_middleware.delete_cache_token') as mock_delete, \
          patch('middlewares.token_middleware.get_token_info', return_value={"sub": "user-123"}) as mock_get_info, \
@@ -351,92 +625,94 @@ def test_refresh_cache_token():
          patch('middlewares.token_middleware.store_token_info_in_state') as mock_store:
 
         # Call the function
-        refresh_cache_token(mock_request)
+        await refresh_cache_token(mock_request)
 
         # Verify that all functions were called with the correct arguments
         mock_check_headers.assert_called_once_with(mock_request)
         mock_extract.assert_called_once_with(mock_request)
-        mock_delete.assert_called_once_with("test-token")
+        mock_delete.assert_called_once_with(mock_redis, "test-token")
         mock_get_info.assert_called_once_with("test-token")
         mock_check_token.assert_called_once_with({"sub": "user-123"})
         mock_generate.assert_called_once_with({"sub": "user-123"})
         mock_store.assert_called_once_with({"user_uuid": "user-123"}, mock_request)
 
+def make_scope(path, headers=None):
+    return {
+        "type": "http",
+        "method": "GET",
+        "path": path,
+        "query_string": b"",
+        "headers": [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]
+    }
+
+async def call_middleware(middleware, scope):
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    await middleware(scope, receive, send)
+    return messages
+
 # Test TokenVerificationMiddleware
 @pytest.mark.asyncio
 async def test_token_verification_middleware_unprotected_path():
-    # Create mock app and request
+    # Create mock app and scope
     mock_app = AsyncMock()
-    mock_request = MagicMock(spec=Request)
-    mock_request.url.path = "/docs"  # Typically an unprotected path
-
-    # Create mock response
-    mock_response = MagicMock()
-    mock_app.return_value = mock_response
+    scope = make_scope("/docs")  # Typically an unprotected path
 
     # Create middleware instance
     middleware = TokenVerificationMiddleware(mock_app)
 
     # Mock is_unprotected_path to return True
     with patch("middlewares.token_middleware.is_unprotected_path", return_value=True):
-        # Call dispatch
-        response = await middleware.dispatch(mock_request, mock_app)
+        messages = await call_middleware(middleware, scope)
 
-        # Verify response
-        assert response == mock_response
-        # Verify that call_next was called with the request
-        mock_app.assert_called_once_with(mock_request)
+        # Verify that the downstream app received the untouched scope
+        mock_app.assert_called_once()
+        assert mock_app.call_args[0][0] is scope
+        assert messages == []
 
 # Test TokenVerificationMiddleware with protected path
 @pytest.mark.asyncio
 async def test_token_verification_middleware_protected_path():
-    # Create mock app and request
+    # Create mock app and scope
     mock_app = AsyncMock()
-    mock_request = MagicMock(spec=Request)
-    mock_request.url.path = "/api/protected"  # A protected path
-    mock_request.headers = {"Authorization": "Bearer test-token"}
-
-    # Create mock response
-    mock_response = MagicMock()
-    mock_app.return_value = mock_response
+    scope = make_scope("/api/protected", {"Authorization": "Bearer test-token"})
 
     # Create middleware instance
     middleware = TokenVerificationMiddleware(mock_app)
 
-    # Mock all the functions called by the middleware
+    # Mock the functions called by the middleware
     with patch("middlewares.token_middleware.is_unprotected_path", return_value=False), \
-         patch("middlewares.token_middleware.check_headers_token") as mock_check_headers, \
-         patch("middlewares.token_middleware.extract_token", return_value="test-token") as mock_extract, \
-         patch("middlewares.token_middleware.get_token_info", return_value={"sub": "user-123"}) as mock_get_info, \
+         patch("middlewares.token_middleware.get_auth_info", return_value=({"sub": "user-123"}, {"refresh_at": 1000600, "licences": {"license-1": {"uuid": "license-1"}}})) as mock_get_info, \
          patch("middlewares.token_middleware.check_token") as mock_check_token, \
-         patch("middlewares.token_middleware.generate_state_info", return_value={"user_uuid": "user-123"}) as mock_generate, \
-         patch("middlewares.token_middleware.store_token_info_in_state") as mock_store:
+         patch("middlewares.token_middleware.generate_state_info", return_value={"user_uuid": "user-123"}) as mock_generate:
 
-        # Call dispatch
-        response = await middleware.dispatch(mock_request, mock_app)
-
-        # Verify response
-        assert response == mock_response
+        await call_middleware(middleware, scope)
 
         # Verify that all functions were called with the correct arguments
-        mock_check_headers.assert_called_once_with(mock_request)
-        mock_extract.assert_called_once_with(mock_request)
         mock_get_info.assert_called_once_with("test-token")
         mock_check_token.assert_called_once_with({"sub": "user-123"})
         mock_generate.assert_called_once_with({"sub": "user-123"})
-        mock_store.assert_called_once_with({"user_uuid": "user-123"}, mock_request)
 
-        # Verify that call_next was called with the request
-        mock_app.assert_called_once_with(mock_request)
+        # Verify that the request state is visible to the downstream app
+        assert scope["state"]["token_info"] == {"user_uuid": "user-123"}
+        assert scope["state"]["user_uuid"] == "user-123"
+        assert scope["state"]["token"] == "test-token"
+        assert scope["state"]["licenses"] == {"license-1": {"uuid": "license-1"}}
+        assert scope["state"]["licences_refresh_at"] == 1000600
+        mock_app.assert_called_once()
 
 # Test TokenVerificationMiddleware with exception
 @pytest.mark.asyncio
 async def test_token_verification_middleware_with_exception():
-    # Create mock app and request
+    # Create mock app and scope
     mock_app = AsyncMock()
-    mock_request = MagicMock(spec=Request)
-    mock_request.url.path = "/api/protected"  # A protected path
-    mock_request.headers = {"Authorization": "Bearer test-token"}
+    scope = make_scope("/api/protected", {"Authorization": "Bearer test-token"})
 
     # Create middleware instance
     middleware = TokenVerificationMiddleware(mock_app)
@@ -445,12 +721,22 @@ async def test_token_verification_middleware_with_exception():
     with patch("middlewares.token_middleware.is_unprotected_path", return_value=False), \
          patch("middlewares.token_middleware.check_headers_token", side_effect=HTTPException(status_code=401, detail="Invalid token")):
 
-        # Call dispatch
-        response = await middleware.dispatch(mock_request, mock_app)
+        messages = await call_middleware(middleware, scope)
 
-        # Verify response is a JSONResponse with the correct status code and content
-        assert response.status_code == 401
-        assert response.body.decode().find("Invalid token") > 0
+        # Verify the response has the correct status code and content
+        assert messages[0]["status"] == 401
+        assert messages[1]["body"] == b'{"detail":"Invalid token"}'
 
-        # Verify that call_next was not called
+        # Verify that the downstream app was not called
         mock_app.assert_not_called()
+
+# Test TokenVerificationMiddleware passes non-http scopes through
+@pytest.mark.asyncio
+async def test_token_verification_middleware_lifespan_scope():
+    mock_app = AsyncMock()
+    middleware = TokenVerificationMiddleware(mock_app)
+    scope = {"type": "lifespan"}
+
+    await call_middleware(middleware, scope)
+
+    mock_app.assert_called_once()
@@ -0,0 +1,117 @@
+import json
+import httpx
+import pytest
+from unittest.mock import AsyncMock, patch
+
+from middlewares.tracing_middleware import TracingMiddleware
+from services import tracing_service
+from services.http_service import InstrumentedTransport
+from services.tracing_service import FileExporter, InMemoryExporter, NOOP_SPAN, configure_tracing, current_span, \
+    parse_traceparent, span, start_trace, traced
+
+
+@pytest.fixture
+def exporter():
+    exporter = InMemoryExporter()
+    configure_tracing(1.0, exporter)
+    yield exporter
+    configure_tracing(0, None)
+
+
+# Test parse_traceparent function
+def test_parse_traceparent():
+    trace_id, parent_id = "4bf92f3577b34da6a3ce929d0e0e4736", "00f067aa0ba902b7"
+    assert parse_traceparent(f"00-{trace_id}-{parent_id}-01") == (trace_id, parent_id, True)
+    assert parse_traceparent(f"00-{trace_id}-{parent_id}-00") == (trace_id, parent_id, False)
+    assert parse_traceparent(f"00-{'0' * 32}-{parent_id}-01") is None
+    assert parse_traceparent("garbage") is None
+    assert parse_traceparent(None) is None
+
+
+# Test spans are no-ops outside a sampled trace
+def test_span_without_trace():
+    assert span("redis GET") is NOOP_SPAN
+    assert start_trace("GET /mine") is None
+
+    configure_tracing(0.0, InMemoryExporter())
+    try:
+        assert start_trace("GET /mine") is None
+    finally:
+        configure_tracing(0, None)
+
+
+# Test nested spans share the trace and export when they end
+@pytest.mark.asyncio
+async def test_nested_spans(exporter):
+    @traced("token_middleware")
+    async def verify():
+        with span("redis MGET"):
+            pass
+        raise ValueError("denied")
+
+    root = start_trace("GET /mine")
+    with pytest.raises(ValueError):
+        with root:
+            await verify()
+
+    assert current_span.get() is None
+    spans = {s["name"]: s for s in exporter.get_trace(root.trace_id)}
+    assert spans["redis MGET"]["parent_id"] == spans["token_middleware"]["span_id"]
+    assert spans["token_middleware"]["parent_id"] == root.span_id
+    assert spans["token_middleware"]["status"] == "error"
+    assert spans["GET /mine"]["status"] == "error"
+
+
+# Test the incoming sampling decision is followed
+def test_start_trace_follows_traceparent(exporter):
+    trace_id, parent_id = "4bf92f3577b34da6a3ce929d0e0e4736", "00f067aa0ba902b7"
+    root = start_trace("GET /mine", f"00-{trace_id}-{parent_id}-01")
+    assert root.trace_id == trace_id and root.parent_id == parent_id
+    assert start_trace("GET /mine", f"00-{trace_id}-{parent_id}-00") is None
+
+
+# Test outgoing calls carry the trace context
+@pytest.mark.asyncio
+async def test_traceparent_propagation(exporter):
+    transport = InstrumentedTransport("keycloak")
+    request = httpx.Request("POST", "http://keycloak/introspect?token=secret")
+
+    with patch.object(httpx.AsyncHTTPTransport, "handle_async_request", AsyncMock(return_value=httpx.Response(200))):
+        with start_trace("GET /mine") as root:
+            await transport.handle_async_request(request)
+
+    http_span = next(s for s in exporter.get_trace(root.trace_id) if s["name"] == "http keycloak")
+    assert request.headers["traceparent"] == f"00-{root.trace_id}-{http_span['span_id']}-01"
+    assert http_span["attributes"]["url"] == "http://keycloak/introspect"
+    assert http_span["attributes"]["status"] == 200
+
+
+# Test the root span of a request
+@pytest.mark.asyncio
+async def test_tracing_middleware(exporter):
+    async def app(scope, receive, send):
+        with span("mongo list_items"):
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+
+    await TracingMiddleware(app)({"type": "http", "method": "GET", "path": "/license/v1/mine", "headers": []},
+                                 AsyncMock(), AsyncMock())
+
+    root = next(s for s in exporter.spans if s["name"] == "GET /license/v1/mine")
+    assert root["attributes"] == {"status": 200, "route": "unmatched"}
+    assert [s["name"] for s in exporter.get_trace(root["trace_id"])] == ["mongo list_items", "GET /license/v1/mine"]
+
+
+# Test the file exporter writes one JSON line per span
+def test_file_exporter(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    configure_tracing(1.0, FileExporter(str(path)))
+    try:
+        with start_trace("GET /mine"):
+            with span("redis GET"):
+                pass
+    finally:
+        tracing_service.exporter.close()
+        configure_tracing(0, None)
+
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [line["name"] for line in lines] == ["redis GET", "GET /mine"]
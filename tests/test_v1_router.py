@@ -42,32 +42,80 @@ def test_get_repo():
 
     # Create a mock for ITEM_REPO
     mock_repo = MagicMock()
-    # Set up the __enter__ method to return a specific mock
-    enter_mock = MagicMock()
-    mock_repo.__enter__.return_value = enter_mock
+    mock_repo.open.return_value = mock_repo
 
     # Patch the ITEM_REPO in the config
     with patch('routers.v1.ITEM_REPO', mock_repo):
-        # Get the generator
-        repo_gen = get_repo()
+        # The shared repository is handed out as is, without reconnecting
+        assert get_repo() is mock_repo
+        assert get_repo() is mock_repo
+        mock_repo.close.assert_not_called()
+
+# Test create_items_response helper
+def test_create_items_response():
+    import json
+    from fastapi.responses import ORJSONResponse
+    from routers.v1 import create_items_response
+
+    # Full items are written straight to JSON
+    response = create_items_response(mock_items, "next", None)
+    assert isinstance(response, ORJSONResponse)
+    body = json.loads(response.body)
+    assert body == {"status": "success", "data": mock_items, "message": "Operation completed successfully", "next_cursor": "next"}
+
+    # Projected items are returned as is
+    response = create_items_response([{"uuid": "item-1", "name": "Item 1"}], None, ["uuid", "name"])
+    assert b'"data":[{"uuid":"item-1","name":"Item 1"}]' in response.body
+    assert b'"next_cursor":null' in response.body
+
+# Test create_items_response with validation enabled
+def test_create_items_response_validated():
+    import json
+    from routers.v1 import create_items_response
+    item = {
+        "uuid": "item-1", "type_uuid": "type-1", "name": "Item 1", "auto_renew": True, "iat": 1, "exp": 2,
+        "user_uuid": "user-1", "entity_uuid": "entity-1", "historical": [], "sales": [],
+        "api_roles": None, "app_roles": None, "apps": None
+    }
 
-        # Get the repository from the generator
-        repo = next(repo_gen)
+    with patch('routers.v1.ITEM_RESPONSE_VALIDATION', True):
+        response = create_items_response([item], None, None)
+        assert json.loads(response.body)["data"] == [item]
 
-        # Verify that the repository is the result of __enter__
-        assert repo is enter_mock
+        # Unassigned licences have no user nor entity
+        unassigned = {**item, "user_uuid": None, "entity_uuid": None,
+                      "historical": [{"iat": 1, "exp": 2, "user_uuid": None}]}
+        response = create_items_response([unassigned], None, None)
+        assert json.loads(response.body)["data"] == [unassigned]
 
-        # Verify that the context manager was entered
-        mock_repo.__enter__.assert_called_once()
+        # Repository output not matching the model is caught
+        with pytest.raises(Exception):
+            create_items_response([{"uuid": "item-1"}], None, None)
 
-        # Exhaust the generator to trigger the exit
-        try:
-            next(repo_gen)
-        except StopIteration:
-            pass
+# Test list_items_response streams NDJSON when asked to
+@pytest.mark.asyncio
+async def test_list_items_response_ndjson():
+    from fastapi.responses import StreamingResponse
+    from starlette.requests import Request
+    from routers.v1 import PageParams, list_items_response
 
-        # Verify that the context manager was exited
-        mock_repo.__exit__.assert_called_once()
+    repo = MagicMock()
+    repo.iter_item_batches.return_value = iter([[{"uuid": "item-1"}], [{"uuid": "item-2"}]])
+    request = Request({"type": "http", "headers": [(b"accept", b"application/x-ndjson")]})
+
+    response = await list_items_response(request, {}, repo, None, "summary", PageParams(limit=10, cursor=None))
+
+    assert isinstance(response, StreamingResponse)
+    assert response.media_type == "application/x-ndjson"
+    chunks = [chunk async for chunk in response.body_iterator]
+    assert b"".join(chunks) == b'{"uuid":"item-1"}\n{"uuid":"item-2"}\n'
+    repo.list_items.assert_not_called()
+
+    # Default envelope otherwise
+    repo.list_items.return_value = [{"uuid": "item-1"}]
+    request = Request({"type": "http", "headers": [(b"accept", b"application/json")]})
+    response = await list_items_response(request, {}, repo, None, "summary", PageParams(limit=10, cursor=None))
+    assert b'"next_cursor":null' in response.body
 
 @pytest.fixture
 def patch_get_items():
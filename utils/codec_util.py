@@ -0,0 +1,36 @@
+import msgpack
+import orjson
+from config.config import CACHE_CODEC
+
+# The first byte of every cached value identifies the codec used to write it,
+# so the codec can be switched without flushing Redis.
+CODECS = {
+    "orjson": (1, orjson.dumps, orjson.loads),
+    "msgpack": (2, msgpack.packb, msgpack.unpackb),
+}
+DECODERS = {version: loads for version, _, loads in CODECS.values()}
+
+
+def validate_codec( codec: str ) -> str:
+    if codec not in CODECS:
+        raise ValueError(f"Unknown CACHE_CODEC {codec!r}, expected one of: {', '.join(CODECS)}")
+    return codec
+
+
+# Checked when the configuration is first used, at startup, rather than on every cache write
+validate_codec(CACHE_CODEC)
+
+
+def encode( data: dict, codec: str = CACHE_CODEC ) -> bytes:
+    version, dumps, _ = CODECS[codec]
+    return bytes([version]) + dumps(data)
+
+
+def decode( payload: bytes ) -> dict | None:
+    if not payload:
+        return None
+    loads = DECODERS.get(payload[0])
+    if loads is None:
+        # Written by an unknown codec version: treat it as a cache miss
+        return None
+    return loads(payload[1:])
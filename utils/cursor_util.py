@@ -0,0 +1,17 @@
+import base64
+
+import orjson
+
+
+def encode_cursor( last_id: str ) -> str:
+    return base64.urlsafe_b64encode(orjson.dumps({"after": last_id})).decode().rstrip("=")
+
+
+def decode_cursor( cursor: str ) -> str:
+    try:
+        data = orjson.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise ValueError("Invalid cursor")
+    if not isinstance(data, dict) or not isinstance(data.get("after"), str):
+        raise ValueError("Invalid cursor")
+    return data["after"]
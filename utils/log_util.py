@@ -0,0 +1,69 @@
+import logging
+import random
+from contextvars import ContextVar
+
+import orjson
+
+# Fields of the request being served, written out once in its summary line
+request_fields: ContextVar[dict | None] = ContextVar("request_fields", default=None)
+# Share of sampled debug events that are kept, see sampled_debug
+sample_rate = 1.0
+
+
+class StructuredFormatter(logging.Formatter):
+    """One line per record, as JSON or as text followed by key=value fields."""
+
+    def __init__(self, json: bool = False):
+        super().__init__("%(levelname)s:%(name)s:%(message)s")
+        self.json = json
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = getattr(record, "fields", None) or {}
+        if not self.json:
+            line = super().format(record)
+            return line + "".join(f" {key}={value}" for key, value in fields.items())
+        entry = {
+            "time": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **fields
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return orjson.dumps(entry, default=str).decode()
+
+
+def parse_levels(levels: str) -> dict[str, str]:
+    """'middlewares=DEBUG,services.jwks_service=WARNING' -> {logger name: level}"""
+    parsed = {}
+    for entry in levels.split(","):
+        name, _, level = entry.strip().partition("=")
+        if name and level:
+            parsed[name.strip()] = level.strip().upper()
+    return parsed
+
+
+def configure_logging(level: str = "INFO", levels: str = "", json: bool = False, debug_sample_rate: float = 1.0) -> None:
+    global sample_rate
+    sample_rate = debug_sample_rate
+    handler = logging.StreamHandler()
+    handler.setFormatter(StructuredFormatter(json=json))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level.upper())
+    for name, module_level in parse_levels(levels).items():
+        logging.getLogger(name).setLevel(module_level)
+
+
+def sampled_debug(logger: logging.Logger, msg: str, *args) -> None:
+    # Hot path events: nothing is built unless debug is on for the logger, then only a sample is kept
+    if logger.isEnabledFor(logging.DEBUG) and random.random() < sample_rate:
+        logger.debug(msg, *args)
+
+
+def annotate_request(**fields) -> None:
+    current = request_fields.get()
+    if current is not None:
+        current.update(fields)
+